@@ -325,6 +325,20 @@ def handle_expert_chat_input_deprecated(multi_expert_system):
     
     return None
 
+def stream_expert_text(events, multi_expert_system, finished):
+    """Yield consultation chunks for st.write_stream, titled per expert; the final result is appended to finished."""
+    current_expert = None
+    for event in events:
+        if event['expert'] is None:
+            finished.append(event['result'])
+            continue
+        if event['expert'] != current_expert:
+            if current_expert is not None:
+                yield "\n\n---\n\n"
+            current_expert = event['expert']
+            yield f"**{multi_expert_system.experts[current_expert].title}**\n\n"
+        yield event['delta']
+
 def get_model_components(config, vector_db):
     """Get model-specific components based on user settings."""
     from user_manager import UserManager
@@ -337,7 +351,8 @@ def get_model_components(config, vector_db):
     
     # Create model-specific handlers
     rag_handler = RAGHandler(config.GEMINI_API_KEY, vector_db, model_name=standard_model)
-    multi_expert_system = MultiExpertSystem(config.GEMINI_API_KEY, model_name=expert_model)
+    multi_expert_system = MultiExpertSystem(config.GEMINI_API_KEY, model_name=expert_model,
+                                            prefer_flash=config.EXPERT_PREFER_FLASH)
     
     return rag_handler, multi_expert_system, standard_model, expert_model
 
@@ -1349,8 +1364,15 @@ def main():
                         'username': st.session_state.get('username', '')
                     }
                     
-                    # Consult experts with full context and user info
-                    consultation_result = multi_expert_system.consult_experts(prompt, full_context, user_info)
+                    # Consult experts with full context and user info, showing their
+                    # answers as they are generated; the formatted consultation
+                    # replaces the live text once every expert has finished
+                    finished = []
+                    events = multi_expert_system.stream_consultation(prompt, full_context, user_info)
+                    thinking_placeholder.empty()
+                    with thinking_placeholder.container():
+                        st.write_stream(stream_expert_text(events, multi_expert_system, finished))
+                    consultation_result = finished[0]
                     
                     # Extract results from consultation
                     experts_consulted = consultation_result['experts_consulted']
@@ -1391,6 +1413,8 @@ def main():
                             
                             # Main response - this now contains the full professional advice
                             st.markdown(expert_response['main_response'], unsafe_allow_html=True)
+                            if expert_response.get('synthesized'):
+                                st.caption("⚡ Combined from earlier answers to related questions")
                             
                             # Follow-up questions if they exist and are contextual
                             follow_ups = expert_response.get('follow_up_questions', [])
@@ -28,6 +28,8 @@ class Config:
         self.EXPERT_CONFIDENCE_THRESHOLD = float(os.getenv("EXPERT_CONFIDENCE_THRESHOLD", "0.7"))
         self.EXPERT_MAX_CONTEXT_LENGTH = int(os.getenv("EXPERT_MAX_CONTEXT_LENGTH", "5"))
         self.EXPERT_TEMPERATURE = float(os.getenv("EXPERT_TEMPERATURE", "0.7"))
+        # Draft expert answers with the flash model, escalating weak drafts to EXPERT_MODEL
+        self.EXPERT_PREFER_FLASH = os.getenv("EXPERT_PREFER_FLASH", "false").lower() == "true"
         
         # Expert consultation types
         self.CONSULTATION_TYPES = [
@@ -4,25 +4,264 @@ Provides comprehensive expertise in nutraceutical and bar manufacturing
 """
 
 import google.generativeai as genai
-from typing import List, Dict, Tuple, Optional
+from typing import Any, List, Dict, Tuple, Optional, Iterator
+import bisect
+import copy
+import functools
+import hashlib
+import itertools
 import json
-from datetime import datetime
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from multi_expert_system import get_gemini_model, response_timestamp
 
 logger = logging.getLogger(__name__)
 
+# Generation settings shared by the sync and async consultants
+ANALYSIS_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "expertise_areas": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "consultation_type": {"type": "STRING"},
+        "key_focus_areas": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "confidence_level": {"type": "STRING"}
+    },
+    "required": ["expertise_areas", "consultation_type", "key_focus_areas", "confidence_level"]
+}
+
+ANALYSIS_GENERATION_CONFIG = {
+    "max_output_tokens": 256,  # Deterministic classification into a small JSON object
+    "temperature": 0.0,
+    "response_mime_type": "application/json",
+    "response_schema": ANALYSIS_RESPONSE_SCHEMA
+}
+
+EXPERT_GENERATION_CONFIG = {
+    "max_output_tokens": 8192,  # Maximum allowed for Gemini
+    "temperature": 0.2,  # Slightly higher for creativity in expert mode
+    "top_p": 0.9,
+    "top_k": 40
+}
+
+# Conversation history is kept in a bounded ring; evicted turns are folded
+# into a short rolling summary instead of being retained in full.
+HISTORY_MAX_TURNS = 50
+HISTORY_SUMMARY_MAX_CHARS = 4000
+HISTORY_QUERY_MAX_CHARS = 256
+
+# Full responses are only written to disk when a history_dir is configured,
+# on a single background thread so consultations never wait on file I/O.
+_history_executor: Optional[ThreadPoolExecutor] = None
+_history_executor_lock = threading.Lock()
+
+# SOP context included in a prompt is capped at roughly this many tokens
+# (estimated at ~4 characters per token); chunks past the budget are dropped.
+CONTEXT_TOKEN_BUDGET = 30000
+CONTEXT_CHARS_PER_TOKEN = 4
+CONTEXT_CHAR_BUDGET = CONTEXT_TOKEN_BUDGET * CONTEXT_CHARS_PER_TOKEN
+NO_CONTEXT_TEXT = "No specific SOP context available"
+
+# LRU cache of query analyses, keyed by model + query
+ANALYSIS_CACHE_SIZE = 2048
+
+_analysis_cache: "OrderedDict[str, Dict]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+# Static consultation instructions, the expert model's system instruction. Each
+# request then carries only the per-query prompt.
+EXPERT_SYSTEM_PROMPT = """
+You are an expert consultant for process manufacturing in nutraceutical and bar products.
+
+**CRITICAL FORMATTING REQUIREMENTS:**
+- Use clear headings with ## for main sections and ### for subsections
+- Each bullet point (•) must be on its own separate line
+- Add blank lines between bullet points for better readability
+- Start each bullet point with a **bold category or key term**
+- Group information under logical section headings
+- Use **bold text** for important terms, processes, and requirements
+- Cite SOP references in quotes after each relevant point
+- Never combine multiple bullet points into one paragraph
+
+**REQUIRED EXPERT RESPONSE FORMAT:**
+
+## Executive Summary
+• [Key finding 1] ("[SOP Name]" if applicable)
+• [Key finding 2] ("[SOP Name]" if applicable)
+• [Main recommendation]
+
+## Detailed Analysis
+
+### Current State Assessment
+• [Assessment point 1] ("[SOP Name]")
+• [Assessment point 2] ("[SOP Name]")
+
+### Key Requirements & Standards
+• [Requirement 1] ("[SOP Name]")
+• [Requirement 2] ("[SOP Name]")
+
+### Expert Recommendations
+
+#### Immediate Actions (0-3 months)
+• [Action 1] ("[SOP Name]" if applicable)
+• [Action 2] ("[SOP Name]" if applicable)
+
+#### Medium-term Strategy (3-12 months)
+• [Strategy 1]
+• [Strategy 2]
+
+#### Long-term Considerations (12+ months)
+• [Consideration 1]
+• [Consideration 2]
+
+## Risk Assessment & Compliance
+
+### Potential Risks
+• [Risk 1] ("[SOP Name]")
+• [Risk 2] ("[SOP Name]")
+
+### Regulatory Compliance
+• [Compliance requirement 1] ("[SOP Name]")
+• [Compliance requirement 2] ("[SOP Name]")
+
+## Multi-Role Perspectives
+
+[One "### <Role> Perspective" subsection for each role listed under ROLE PERSPECTIVES below]
+
+## Implementation Guidance
+
+### Resource Requirements
+• [Resource 1]
+• [Resource 2]
+
+### Success Metrics
+• [Metric 1]
+• [Metric 2]
+
+### Next Steps
+• [Next step 1]
+• [Next step 2]
+
+Provide comprehensive, actionable guidance using clear formatting and specific SOP references.
+"""
+
+# SOP filename references (including revision numbers and special characters).
+# The name is capped at 200 characters on one line so long runs of plain text
+# cannot trigger polynomial backtracking.
+_SOP_RE = re.compile(r'([A-Za-z0-9\-_()][A-Za-z0-9\-_() ]{0,200}\.(?:docx?|pdf))\b')
+_SOP_SPAN_RE = re.compile(r'<span class="sop-reference-inline">([^<]+)</span>')
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def _format_sop(match: re.Match) -> str:
+    """Wrap a matched SOP name in inline reference markup, stripping stray tags."""
+    return f'<span class="sop-reference-inline">{_TAG_RE.sub("", match.group(1))}</span>'
+
+
+def _get_history_executor() -> ThreadPoolExecutor:
+    """Return the shared background writer for persisted consultation history."""
+    global _history_executor
+    with _history_executor_lock:
+        if _history_executor is None:
+            _history_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-writer")
+        return _history_executor
+
+
+def _write_history_file(path: Path, record: Dict) -> None:
+    """Write one full consultation record as JSON."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(record, indent=2), encoding="utf-8")
+    except Exception as e:
+        logger.warning(f"Could not persist consultation history to {path}: {e}")
+
+
+@functools.lru_cache(maxsize=32)
+def _join_context_chunks(context: Tuple[str, ...]) -> str:
+    """
+    Join the longest prefix of context chunks that fits CONTEXT_CHAR_BUDGET,
+    truncating the next chunk into the remaining room, as _prepare_context does
+    in multi_expert_system, so an oversized first chunk is cut, not dropped.
+    """
+    # Cumulative chunk lengths, counting the newline separator after each chunk
+    ends = list(itertools.accumulate(len(chunk) + 1 for chunk in context))
+    count = bisect.bisect_right(ends, CONTEXT_CHAR_BUDGET + 1)
+    chunks = list(context[:count])
+    room = CONTEXT_CHAR_BUDGET - (ends[count - 1] if count else 0)
+    if count < len(context) and room > 0:
+        chunks.append(context[count][:room])
+    return "\n".join(chunks)
+
+
+def _join_context(context: List[str]) -> str:
+    """Return the prompt text for the SOP context, joined once per distinct context."""
+    return _join_context_chunks(tuple(context)) if context else ""
+
+
+@functools.lru_cache(maxsize=64)
+def _perspective_block(roles: Tuple[str, ...]) -> str:
+    """Build the ROLE PERSPECTIVES template for a sequence of roles."""
+    return "\n".join(
+        f"### {role} Perspective\n"
+        f"• [Key insight from {role.lower()} viewpoint] ('[SOP Name]' if applicable)\n"
+        f"• [Additional {role.lower()} consideration]"
+        for role in roles
+    )
+
+
+def _analysis_cache_key(model_name: str, query: str) -> str:
+    """Digest of everything the analysis prompt depends on."""
+    payload = "\0".join([model_name, query])
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def _get_cached_analysis(key: str) -> Optional[Dict]:
+    """Return a deep copy of a cached analysis, marking it most recently used."""
+    with _analysis_cache_lock:
+        analysis = _analysis_cache.get(key)
+        if analysis is None:
+            return None
+        _analysis_cache.move_to_end(key)
+    return copy.deepcopy(analysis)
+
+
+def _store_analysis(key: str, analysis: Dict) -> None:
+    """Cache a deep copy of an analysis, evicting the least recently used entry when full."""
+    snapshot = copy.deepcopy(analysis)
+    with _analysis_cache_lock:
+        _analysis_cache[key] = snapshot
+        _analysis_cache.move_to_end(key)
+        if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+
+
 class ManufacturingExpertConsultant:
     """
     Expert consultant combining expertise of CEO, CFO, CMO, Quality Director, 
     and Supply Chain Director for process manufacturing in nutraceutical and bar products.
     """
     
-    def __init__(self, api_key: str, model_name: str = "gemini-1.5-pro"):
-        """Initialize the expert consultant with Gemini API."""
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model_name)
+    def __init__(self, api_key: str, model_name: str = "gemini-1.5-pro",
+                 history_dir: Optional[str] = None):
+        """
+        Initialize the expert consultant with Gemini API. When history_dir is
+        given, each full response is also saved there as a JSON file.
+        """
+        self.model = get_gemini_model(api_key, model_name)
+        # Consultations send only the per-query prompt; the static instructions
+        # are this model's system instruction
+        self.expert_model = get_gemini_model(api_key, model_name, EXPERT_SYSTEM_PROMPT)
         self.model_name = model_name
-        self.conversation_history = []
+        self.conversation_history = deque(maxlen=HISTORY_MAX_TURNS)
+        self._rolling_summary = ""
+        self.history_dir = Path(history_dir) if history_dir else None
+        self.last_response = None  # Full structured result of the most recent consultation
         self.expertise_areas = {
             "CEO": "Strategic planning, business growth, innovation, market positioning",
             "CFO": "Financial planning, cost optimization, ROI analysis, budgeting",
@@ -30,219 +269,195 @@ class ManufacturingExpertConsultant:
             "Quality Director": "Quality control, compliance, certifications, safety protocols",
             "Supply Chain Director": "Sourcing, logistics, inventory management, supplier relations"
         }
+        self._roles_lc = [(role, role.lower()) for role in self.expertise_areas]
         
     def analyze_query(self, query: str, context: List[str]) -> Dict[str, any]:
         """
         Analyze the query to determine which expertise areas are most relevant.
+        Classification uses the query alone; context is accepted for API
+        compatibility and only used when generating the response.
         """
-        analysis_prompt = f"""
-        As a manufacturing expert consultant, analyze this query and determine:
-        1. Which expertise areas are most relevant (CEO, CFO, CMO, Quality Director, Supply Chain Director)
-        2. The type of consultation needed (strategic, operational, technical, regulatory)
-        3. Key focus areas to address
-        
-        Query: {query}
-        
-        Available SOP Context:
-        {chr(10).join(context[:25]) if context else "No specific SOP context available"}
+        cache_key = _analysis_cache_key(self.model_name, query)
+        cached = _get_cached_analysis(cache_key)
+        if cached is not None:
+            return cached
         
-        Return a JSON object with:
-        - expertise_areas: list of relevant roles
-        - consultation_type: primary type of consultation
-        - key_focus_areas: list of main topics to address
-        - confidence_level: high/medium/low
-        """
+        analysis_prompt = self._build_analysis_prompt(query)
         
         try:
-            # Configure generation for maximum output
-            generation_config = {
-                "max_output_tokens": 8192,  # Maximum allowed for Gemini
-                "temperature": 0.1,
-                "top_p": 0.8,
-                "top_k": 40
-            }
-            
-            response = self.model.generate_content(analysis_prompt, generation_config=generation_config)
+            response = self.model.generate_content(analysis_prompt, generation_config=ANALYSIS_GENERATION_CONFIG)
             # Parse the response to extract structured information
-            analysis = self._parse_analysis_response(response.text)
-            return analysis
+            return self._analysis_from_response(cache_key, response.text)
         except Exception as e:
             logger.error(f"Error analyzing query: {e}")
-            return {
-                "expertise_areas": ["General"],
-                "consultation_type": "general",
-                "key_focus_areas": ["general_advice"],
-                "confidence_level": "low"
-            }
+            return self._default_analysis()
+    
+    def _build_analysis_prompt(self, query: str) -> str:
+        """Build the prompt used to classify a query before consultation."""
+        return (f"Classify this process manufacturing query. "
+                f"Roles: [{', '.join(self.expertise_areas)}]. "
+                f"Consultation types: strategic, operational, technical, regulatory. "
+                f"Query: {query}\n"
+                f"Return JSON with expertise_areas (relevant roles), consultation_type, "
+                f"key_focus_areas (main topics) and confidence_level (high/medium/low).")
+    
+    def _default_analysis(self) -> Dict[str, any]:
+        """Analysis used when the query could not be classified."""
+        return {
+            "expertise_areas": ["General"],
+            "consultation_type": "general",
+            "key_focus_areas": ["general_advice"],
+            "confidence_level": "low"
+        }
     
     def generate_expert_response(self, query: str, context: List[str], 
                                analysis: Dict[str, any]) -> Dict[str, any]:
         """
         Generate a comprehensive expert response based on the query and context.
         """
-        expertise_prompt = self._build_expertise_prompt(query, context, analysis)
+        expertise_prompt = self._build_expertise_prompt(query, _join_context(context), analysis)
         
         try:
-            # Configure generation for maximum output
-            generation_config = {
-                "max_output_tokens": 8192,  # Maximum allowed for Gemini
-                "temperature": 0.2,  # Slightly higher for creativity in expert mode
-                "top_p": 0.9,
-                "top_k": 40
-            }
-            
-            response = self.model.generate_content(expertise_prompt, generation_config=generation_config)
-            
-            # Format SOP names in the response
-            import re
-            formatted_response = response.text
-            
-            # More precise pattern to match SOP filenames (including revision numbers and special characters)
-            sop_pattern = r'\b([A-Za-z0-9\-\_\(\)\s]+(?:Rev\d+(?:Draft\d+)?)?[A-Za-z0-9\-\_\(\)\s]*\.(doc|docx|pdf))\b'
-            
-            def format_sop(match):
-                sop_name = match.group(1)
-                # Clean up any existing HTML tags
-                clean_name = re.sub(r'<[^>]+>', '', sop_name)
-                return f'<span class="sop-reference-inline">{clean_name}</span>'
-            
-            # Replace SOP names with formatted versions, but avoid double-formatting
-            if '<span class="sop-reference-inline">' not in formatted_response:
-                formatted_response = re.sub(sop_pattern, format_sop, formatted_response)
-            else:
-                # If already formatted, just clean any malformed HTML
-                formatted_response = re.sub(r'<span class="sop-reference-inline">([^<]+)</span>', 
-                                          lambda m: f'<span class="sop-reference-inline">{re.sub(r"<[^>]+>", "", m.group(1))}</span>', 
-                                          formatted_response)
-            
-            # Structure the expert response
-            expert_response = {
-                "main_response": formatted_response,
-                "expertise_perspectives": self._extract_perspectives(response.text, analysis),
-                "recommendations": self._extract_recommendations(response.text),
-                "risks_and_considerations": self._extract_risks(response.text),
-                "confidence_level": analysis.get("confidence_level", "medium"),
-                "follow_up_questions": self._generate_follow_up_questions(query, response.text),
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            # Add to conversation history
-            self.conversation_history.append({
-                "query": query,
-                "response": expert_response,
-                "context_used": len(context)
-            })
-            
-            return expert_response
+            response = self.expert_model.generate_content(expertise_prompt, generation_config=EXPERT_GENERATION_CONFIG)
+            return self._build_expert_response(query, context, analysis, response.text)
             
         except Exception as e:
             logger.error(f"Error generating expert response: {e}")
             return self._generate_fallback_response(query)
     
-    def _build_expertise_prompt(self, query: str, context: List[str], 
+    def stream_expert_response(self, query: str, context: List[str],
+                               analysis: Dict[str, any]) -> Iterator[str]:
+        """
+        Stream the expert response line by line as Gemini generates it.
+        SOP references are formatted per completed line; once the stream is
+        exhausted the structured response is available as self.last_response.
+        """
+        expertise_prompt = self._build_expertise_prompt(query, _join_context(context), analysis)
+        raw_parts = []
+        formatted_parts = []
+        buffer = ""
+        
+        try:
+            stream = self.expert_model.generate_content(expertise_prompt, generation_config=EXPERT_GENERATION_CONFIG,
+                                                        stream=True)
+            for chunk in stream:
+                raw_parts.append(chunk.text)
+                buffer += chunk.text
+                *lines, buffer = buffer.split("\n")
+                for line in lines:
+                    formatted_line = self._format_sop_references(line) + "\n"
+                    formatted_parts.append(formatted_line)
+                    yield formatted_line
+            
+            if buffer:
+                formatted_line = self._format_sop_references(buffer)
+                formatted_parts.append(formatted_line)
+                yield formatted_line
+                
+        except Exception as e:
+            logger.error(f"Error streaming expert response: {e}")
+            self.last_response = self._generate_fallback_response(query)
+            yield self.last_response["main_response"]
+            return
+        
+        self.last_response = self._build_expert_response(query, context, analysis, "".join(raw_parts),
+                                                         formatted_response="".join(formatted_parts))
+    
+    def _format_sop_references(self, text: str) -> str:
+        """Wrap SOP filenames in the response with inline reference markup."""
+        # Replace SOP names with formatted versions, but avoid double-formatting
+        if '<span class="sop-reference-inline">' not in text:
+            return _SOP_RE.sub(_format_sop, text)
+        
+        # If already formatted, just clean any malformed HTML
+        return _SOP_SPAN_RE.sub(_format_sop, text)
+    
+    def _build_expert_response(self, query: str, context: List[str], analysis: Dict[str, any],
+                               response_text: str, formatted_response: Optional[str] = None) -> Dict[str, any]:
+        """Format the raw model output into a structured expert response."""
+        if formatted_response is None:
+            formatted_response = self._format_sop_references(response_text)
+        
+        # Structure the expert response
+        expert_response = {
+            "main_response": formatted_response,
+            "expertise_perspectives": self._extract_perspectives(response_text, analysis),
+            "recommendations": self._extract_recommendations(response_text),
+            "risks_and_considerations": self._extract_risks(response_text),
+            "confidence_level": analysis.get("confidence_level", "medium"),
+            "follow_up_questions": self._generate_follow_up_questions(query, response_text),
+            "timestamp": response_timestamp()
+        }
+        
+        # History keeps a lightweight record; the full response lives only in last_response
+        self.last_response = expert_response
+        timestamp_ns = time.time_ns()
+        self._record_interaction({
+            "query": query[:HISTORY_QUERY_MAX_CHARS],
+            "confidence_level": expert_response["confidence_level"],
+            "context_used": len(context),
+            "timestamp_ns": timestamp_ns
+        })
+        if self.history_dir is not None:
+            # The uuid keeps names unique when clocks are coarse or processes share the directory
+            path = self.history_dir / f"{timestamp_ns}-{uuid.uuid4().hex[:8]}.json"
+            _get_history_executor().submit(_write_history_file, path,
+                                           {"query": query, "response": expert_response})
+        
+        return expert_response
+    
+    def _build_expertise_prompt(self, query: str, joined_context: str,
                                analysis: Dict[str, any]) -> str:
-        """Build a comprehensive prompt for expert consultation."""
+        """
+        Build the per-query part of the consultation prompt. The static
+        instructions live in EXPERT_SYSTEM_PROMPT, the expert model's system instruction.
+        """
         expertise_areas = analysis.get("expertise_areas", ["General"])
         
         prompt = f"""
-        You are an expert consultant for process manufacturing in nutraceutical and bar products.
         You combine the expertise of: {', '.join(expertise_areas)}
         
         QUERY: {query}
         
         RELEVANT SOP CONTEXT:
-        {chr(10).join(context) if context else "No specific SOP context available"}
+        {joined_context or NO_CONTEXT_TEXT}
         
         CONSULTATION TYPE: {analysis.get('consultation_type', 'general')}
         KEY FOCUS AREAS: {', '.join(analysis.get('key_focus_areas', ['general']))}
         
-        **CRITICAL FORMATTING REQUIREMENTS:**
-        - Use clear headings with ## for main sections and ### for subsections
-        - Each bullet point (•) must be on its own separate line
-        - Add blank lines between bullet points for better readability
-        - Start each bullet point with a **bold category or key term**
-        - Group information under logical section headings
-        - Use **bold text** for important terms, processes, and requirements
-        - Cite SOP references in quotes after each relevant point
-        - Never combine multiple bullet points into one paragraph
-        
-        **REQUIRED EXPERT RESPONSE FORMAT:**
-        
-        ## Executive Summary
-        • [Key finding 1] ("[SOP Name]" if applicable)
-        • [Key finding 2] ("[SOP Name]" if applicable)
-        • [Main recommendation]
-        
-        ## Detailed Analysis
-        
-        ### Current State Assessment
-        • [Assessment point 1] ("[SOP Name]")
-        • [Assessment point 2] ("[SOP Name]")
-        
-        ### Key Requirements & Standards
-        • [Requirement 1] ("[SOP Name]")
-        • [Requirement 2] ("[SOP Name]")
-        
-        ### Expert Recommendations
-        
-        #### Immediate Actions (0-3 months)
-        • [Action 1] ("[SOP Name]" if applicable)
-        • [Action 2] ("[SOP Name]" if applicable)
-        
-        #### Medium-term Strategy (3-12 months)
-        • [Strategy 1]
-        • [Strategy 2]
-        
-        #### Long-term Considerations (12+ months)
-        • [Consideration 1]
-        • [Consideration 2]
-        
-        ## Risk Assessment & Compliance
-        
-        ### Potential Risks
-        • [Risk 1] ("[SOP Name]")
-        • [Risk 2] ("[SOP Name]")
-        
-        ### Regulatory Compliance
-        • [Compliance requirement 1] ("[SOP Name]")
-        • [Compliance requirement 2] ("[SOP Name]")
-        
-        ## Multi-Role Perspectives
-        
-        {chr(10).join([f"### {role} Perspective" + chr(10) + f"• [Key insight from {role.lower()} viewpoint] ('[SOP Name]' if applicable)" + chr(10) + f"• [Additional {role.lower()} consideration]" 
-                      for role in expertise_areas if role in self.expertise_areas])}
-        
-        ## Implementation Guidance
-        
-        ### Resource Requirements
-        • [Resource 1]
-        • [Resource 2]
-        
-        ### Success Metrics
-        • [Metric 1]
-        • [Metric 2]
-        
-        ### Next Steps
-        • [Next step 1]
-        • [Next step 2]
-        
-        Provide comprehensive, actionable guidance using clear formatting and specific SOP references.
+        ROLE PERSPECTIVES:
+        {_perspective_block(tuple(role for role in expertise_areas if role in self.expertise_areas))}
         """
         
         return prompt
     
-    def _parse_analysis_response(self, response_text: str) -> Dict[str, any]:
-        """Parse the analysis response to extract structured information."""
+    def _analysis_from_response(self, cache_key: str, response_text: str) -> Dict[str, any]:
+        """
+        Parse an analysis response, caching it only if it matched the schema,
+        so one malformed response does not stick to the query.
+        """
+        analysis = self._parse_analysis_response(response_text)
+        if analysis is None:
+            return self._fallback_analysis(response_text)
+        _store_analysis(cache_key, analysis)
+        return analysis
+    
+    def _parse_analysis_response(self, response_text: str) -> Optional[Dict[str, any]]:
+        """Parse the analysis response, or return None if it does not match ANALYSIS_RESPONSE_SCHEMA."""
+        # Analysis runs in JSON mode, so the response should be the object itself,
+        # but it is only trusted if it has every schema key with the right type
         try:
-            # Attempt to extract JSON from the response
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-        except:
-            pass
-        
-        # Fallback parsing logic
+            analysis = json.loads(response_text)
+        except json.JSONDecodeError:
+            logger.warning("Analysis response is not valid JSON, using fallback parsing")
+            return None
+        if not self._matches_analysis_schema(analysis):
+            logger.warning("Analysis response does not match ANALYSIS_RESPONSE_SCHEMA, using fallback parsing")
+            return None
+        return {key: analysis[key] for key in ANALYSIS_RESPONSE_SCHEMA["required"]}
+    
+    def _fallback_analysis(self, response_text: str) -> Dict[str, any]:
+        """Keyword-based analysis for a response that could not be parsed."""
         return {
             "expertise_areas": self._extract_expertise_areas(response_text),
             "consultation_type": "general",
@@ -250,13 +465,24 @@ class ManufacturingExpertConsultant:
             "confidence_level": "medium"
         }
     
+    @staticmethod
+    def _matches_analysis_schema(analysis: Any) -> bool:
+        """Whether a parsed analysis has every ANALYSIS_RESPONSE_SCHEMA key with the declared type."""
+        if not isinstance(analysis, dict):
+            return False
+        for key in ANALYSIS_RESPONSE_SCHEMA["required"]:
+            value = analysis.get(key)
+            if ANALYSIS_RESPONSE_SCHEMA["properties"][key]["type"] == "ARRAY":
+                if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                    return False
+            elif not isinstance(value, str):
+                return False
+        return True
+    
     def _extract_expertise_areas(self, text: str) -> List[str]:
         """Extract relevant expertise areas from text."""
-        areas = []
-        for role in self.expertise_areas.keys():
-            if role.lower() in text.lower():
-                areas.append(role)
-        return areas if areas else ["General"]
+        text_lc = text.lower()
+        return [role for role, role_lc in self._roles_lc if role_lc in text_lc] or ["General"]
     
     def _extract_perspectives(self, response_text: str, analysis: Dict[str, any]) -> Dict[str, str]:
         """Extract role-specific perspectives from the response."""
@@ -304,17 +530,75 @@ class ManufacturingExpertConsultant:
             "risks_and_considerations": ["Ensure compliance with regulations"],
             "confidence_level": "low",
             "follow_up_questions": ["Can you provide more specific details about your concern?"],
-            "timestamp": datetime.now().isoformat()
+            "timestamp": response_timestamp()
         }
     
+    def _record_interaction(self, interaction: Dict[str, any]) -> None:
+        """Append to the history ring, folding the evicted turn into the rolling summary."""
+        if len(self.conversation_history) == self.conversation_history.maxlen:
+            oldest = self.conversation_history[0]
+            self._rolling_summary += (f"- {oldest['query'][:100]} "
+                                      f"(confidence: {oldest['confidence_level']})\n")
+            self._rolling_summary = self._rolling_summary[-HISTORY_SUMMARY_MAX_CHARS:]
+        self.conversation_history.append(interaction)
+    
     def get_conversation_summary(self) -> str:
         """Get a summary of the consultation conversation."""
         if not self.conversation_history:
             return "No consultation history available."
         
-        summary = f"Consultation Summary ({len(self.conversation_history)} interactions):\n"
-        for i, interaction in enumerate(self.conversation_history[-5:], 1):  # Last 5 interactions
+        summary = ""
+        if self._rolling_summary:
+            summary += f"Earlier consultations:\n{self._rolling_summary}\n"
+        
+        summary += f"Consultation Summary ({len(self.conversation_history)} interactions):\n"
+        for i, interaction in enumerate(list(self.conversation_history)[-5:], 1):  # Last 5 interactions
             summary += f"\n{i}. Query: {interaction['query'][:100]}...\n"
-            summary += f"   Confidence: {interaction['response']['confidence_level']}\n"
+            summary += f"   Confidence: {interaction['confidence_level']}\n"
         
-        return summary
\ No newline at end of file
+        return summary
+
+
+class AsyncExpertConsultant(ManufacturingExpertConsultant):
+    """
+    Async variant of the expert consultant. Consultations await the Gemini
+    async API, so concurrent ones overlap instead of blocking one another on
+    the sync client.
+    """
+    
+    async def _submit(self, prompt: str, generation_config: Dict[str, any],
+                      model: Optional[genai.GenerativeModel] = None) -> str:
+        """Send a prompt through the async API and return the response text."""
+        response = await (model or self.model).generate_content_async(prompt, generation_config=generation_config)
+        return response.text
+    
+    async def analyze_query_async(self, query: str, context: List[str]) -> Dict[str, any]:
+        """Async counterpart of analyze_query."""
+        cache_key = _analysis_cache_key(self.model_name, query)
+        cached = _get_cached_analysis(cache_key)
+        if cached is not None:
+            return cached
+        
+        try:
+            response_text = await self._submit(self._build_analysis_prompt(query),
+                                               ANALYSIS_GENERATION_CONFIG)
+            return self._analysis_from_response(cache_key, response_text)
+        except Exception as e:
+            logger.error(f"Error analyzing query: {e}")
+            return self._default_analysis()
+    
+    async def generate_expert_response_async(self, query: str, context: List[str],
+                                             analysis: Dict[str, any]) -> Dict[str, any]:
+        """Async counterpart of generate_expert_response."""
+        try:
+            expertise_prompt = self._build_expertise_prompt(query, _join_context(context), analysis)
+            response_text = await self._submit(expertise_prompt, EXPERT_GENERATION_CONFIG, self.expert_model)
+            return self._build_expert_response(query, context, analysis, response_text)
+        except Exception as e:
+            logger.error(f"Error generating expert response: {e}")
+            return self._generate_fallback_response(query)
+    
+    async def ask(self, query: str, context: List[str]) -> Dict[str, any]:
+        """Analyze and answer a query in one awaitable call."""
+        analysis = await self.analyze_query_async(query, context)
+        return await self.generate_expert_response_async(query, context, analysis)
@@ -7,11 +7,47 @@ so that when the AI references them, users can click to open the actual SOPs in
 """
 
 import os
+import csv
 import json
 import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Tuple
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Worker threads for batch CSV processing (per-row work is file I/O bound)
+BATCH_WORKERS = 32
+
+# Google Drive URL formats, tried in priority order within a single match:
+# /file/d/ID/view, ?id=ID, /d/ID, then any 25+ char token after drive.google.com.
+# Each alternative scans from the start of the URL, so the first format that
+# appears anywhere wins, exactly as when the patterns were tried one by one.
+_GDRIVE_ID_RE = re.compile(
+    r'(?:(?s:.*?)/file/d/([a-zA-Z0-9_-]+)'
+    r'|(?s:.*?)id=([a-zA-Z0-9_-]+)'
+    r'|(?s:.*?)/d/([a-zA-Z0-9_-]+)'
+    r'|(?s:.*?)drive\.google\.com.*?([a-zA-Z0-9_-]{25,}))'
+)
+
+
+def _dump_json(data: Dict) -> bytes:
+    """Serialize metadata as indented UTF-8 JSON, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2).encode('utf-8')
+
+
+def _load_json(path: Path) -> Dict:
+    """Read a metadata file, using orjson when available."""
+    raw = path.read_bytes()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
 class GDriveMetadataGenerator:
     def __init__(self, sop_directory: str):
         """
@@ -33,18 +69,9 @@ class GDriveMetadataGenerator:
         Returns:
             Google Drive file ID
         """
-        # Handle different Google Drive URL formats
-        patterns = [
-            r'/file/d/([a-zA-Z0-9-_]+)',           # /file/d/ID/view
-            r'id=([a-zA-Z0-9-_]+)',                # ?id=ID
-            r'/d/([a-zA-Z0-9-_]+)',                # /d/ID
-            r'drive\.google\.com.*?([a-zA-Z0-9-_]{25,})',  # General pattern
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, gdrive_url)
-            if match:
-                return match.group(1)
+        match = _GDRIVE_ID_RE.match(gdrive_url)
+        if match:
+            return next(group for group in match.groups() if group)
         
         raise ValueError(f"Could not extract Google Drive ID from URL: {gdrive_url}")
     
@@ -71,12 +98,60 @@ class GDriveMetadataGenerator:
         Returns:
             List of SOP file paths
         """
+        if not self.sop_directory.is_dir():
+            return []
+        
+        # Single directory pass, classifying entries by suffix
+        extensions = set(self.supported_extensions)
         sop_files = []
-        for ext in self.supported_extensions:
-            sop_files.extend(self.sop_directory.glob(f"*{ext}"))
+        with os.scandir(self.sop_directory) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.splitext(entry.name)[1] in extensions:
+                    sop_files.append(Path(entry.path))
         
         return sorted(sop_files)
     
+    def find_metadata_files(self) -> List[Path]:
+        """
+        Find all .gdrive_metadata files in the directory
+        
+        Returns:
+            List of metadata file paths
+        """
+        if not self.sop_directory.is_dir():
+            return []
+        
+        with os.scandir(self.sop_directory) as entries:
+            return sorted(Path(entry.path) for entry in entries
+                          if entry.name.endswith('.gdrive_metadata') and entry.is_file())
+    
+    def build_metadata(self, sop_file: Path, gdrive_url: str) -> Tuple[Path, bytes]:
+        """
+        Build the .gdrive_metadata path and serialized contents for a SOP
+        
+        Args:
+            sop_file: Path to the SOP document
+            gdrive_url: Google Drive URL for the document
+            
+        Returns:
+            Tuple of (metadata file path, JSON bytes)
+            
+        Raises:
+            ValueError: If no Google Drive ID can be extracted from the URL
+        """
+        gdrive_id = self.extract_gdrive_id_from_url(gdrive_url)
+        gdrive_link = self.create_gdrive_link(gdrive_id, "view")
+        
+        metadata = {
+            "gdrive_id": gdrive_id,
+            "gdrive_link": gdrive_link,
+            "original_filename": sop_file.name,
+            "created_by": "gdrive_metadata_generator"
+        }
+        
+        metadata_file = Path(str(sop_file) + '.gdrive_metadata')
+        return metadata_file, _dump_json(metadata)
+    
     def create_metadata_file(self, sop_file: Path, gdrive_url: str, overwrite: bool = False) -> bool:
         """
         Create .gdrive_metadata file for a specific SOP
@@ -96,18 +171,9 @@ class GDriveMetadataGenerator:
             return False
         
         try:
-            gdrive_id = self.extract_gdrive_id_from_url(gdrive_url)
-            gdrive_link = self.create_gdrive_link(gdrive_id, "view")
+            metadata_file, data = self.build_metadata(sop_file, gdrive_url)
             
-            metadata = {
-                "gdrive_id": gdrive_id,
-                "gdrive_link": gdrive_link,
-                "original_filename": sop_file.name,
-                "created_by": "gdrive_metadata_generator"
-            }
-            
-            with open(metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=2)
+            metadata_file.write_bytes(data)
             
             print(f"✅ Created: {metadata_file.name}")
             return True
@@ -116,6 +182,20 @@ class GDriveMetadataGenerator:
             print(f"❌ Error processing {sop_file.name}: {e}")
             return False
     
+    def _fsync_directory(self) -> None:
+        """
+        Flush directory entries for newly written metadata files in one barrier
+        """
+        try:
+            fd = os.open(self.sop_directory, os.O_RDONLY)
+        except OSError:
+            # Directories cannot be opened for fsync on some platforms (e.g. Windows)
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
     def interactive_mapping(self) -> None:
         """
         Interactive mode to map SOP files to Google Drive URLs
@@ -179,45 +259,80 @@ class GDriveMetadataGenerator:
         
         CSV format: filename,gdrive_url
         """
-        import csv
-        
         csv_path = Path(csv_file)
         if not csv_path.exists():
             print(f"❌ CSV file not found: {csv_file}")
             return
         
-        created_count = 0
-        skipped_count = 0
-        error_count = 0
-        
+        filenames = []
+        gdrive_urls = []
         with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
+            reader = csv.reader(f)
+            header = next(reader, [])
+            try:
+                filename_idx = header.index('filename')
+                url_idx = header.index('gdrive_url')
+            except ValueError:
+                print(f"❌ CSV header must contain 'filename' and 'gdrive_url' columns: {csv_file}")
+                return
             
             for row in reader:
-                filename = row.get('filename', '').strip()
-                gdrive_url = row.get('gdrive_url', '').strip()
-                
-                if not filename or not gdrive_url:
-                    print(f"⚠️  Skipping incomplete row: {row}")
-                    continue
-                
-                sop_file = self.sop_directory / filename
-                if not sop_file.exists():
-                    print(f"❌ File not found: {filename}")
-                    error_count += 1
-                    continue
-                
-                success = self.create_metadata_file(sop_file, gdrive_url, overwrite=True)
-                if success:
-                    created_count += 1
-                else:
-                    skipped_count += 1
+                filenames.append(row[filename_idx].strip() if filename_idx < len(row) else '')
+                gdrive_urls.append(row[url_idx].strip() if url_idx < len(row) else '')
+        
+        # Rows are independent, so overlap their file I/O; results come back in row order
+        with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+            results = list(executor.map(self._process_row, filenames, gdrive_urls))
+        
+        counts = Counter()
+        for status, message in results:
+            counts[status] += 1
+            print(message)
+        
+        if counts['created']:
+            # Flush the directory once for all new metadata files
+            self._fsync_directory()
+        
+        created_count = counts['created']
+        skipped_count = counts['skipped']
+        error_count = counts['error']
         
         print(f"\n📊 Batch processing complete!")
         print(f"   ✅ Created: {created_count}")
         print(f"   ⏭️  Skipped: {skipped_count}")
         print(f"   ❌ Errors: {error_count}")
     
+    def _process_row(self, filename: str, gdrive_url: str) -> Tuple[str, str]:
+        """
+        Create the metadata file for one CSV mapping row
+        
+        Args:
+            filename: SOP filename from the row
+            gdrive_url: Google Drive URL from the row
+            
+        Returns:
+            Tuple of (status, message) where status is one of
+            "created", "skipped", "error" or "incomplete"
+        """
+        if not filename or not gdrive_url:
+            return "incomplete", f"⚠️  Skipping incomplete row: {filename},{gdrive_url}"
+        
+        sop_file = self.sop_directory / filename
+        if not sop_file.exists():
+            return "error", f"❌ File not found: {filename}"
+        
+        try:
+            metadata_file, data = self.build_metadata(sop_file, gdrive_url)
+        except ValueError as e:
+            return "skipped", f"❌ Error processing {sop_file.name}: {e}"
+        
+        try:
+            with open(metadata_file, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            return "error", f"❌ Could not write {metadata_file.name}: {e}"
+        return "created", f"✅ Created: {metadata_file.name}"
+    
     def create_sample_csv(self, output_file: str = "sop_gdrive_mapping.csv") -> None:
         """
         Create a sample CSV file with all SOP files for manual editing
@@ -239,17 +354,16 @@ class GDriveMetadataGenerator:
         """
         List all existing metadata files
         """
-        metadata_files = list(self.sop_directory.glob("*.gdrive_metadata"))
+        metadata_files = self.find_metadata_files()
         
         if not metadata_files:
             print("📭 No metadata files found")
             return
         
         print(f"📋 Found {len(metadata_files)} metadata files:")
-        for metadata_file in sorted(metadata_files):
+        for metadata_file in metadata_files:
             try:
-                with open(metadata_file, 'r') as f:
-                    data = json.load(f)
+                data = _load_json(metadata_file)
                 print(f"   ✅ {metadata_file.name.replace('.gdrive_metadata', '')}")
                 print(f"      🔗 {data.get('gdrive_link', 'No link')}")
             except Exception as e:
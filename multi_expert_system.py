@@ -3,941 +3,1637 @@ Multi-Expert Persona System for Process Manufacturing
 Provides specialized expertise through individual expert personas with @mention functionality
 """
 
-import google.generativeai as genai
-from typing import List, Dict, Tuple, Optional, Any
+from typing import List, Dict, Tuple, Optional, Any, AsyncIterator, Callable, ClassVar, Iterator, TYPE_CHECKING
+import asyncio
+import copy
+import functools
+import hashlib
+import itertools
 import json
+import os
+import queue
 import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 import logging
 
+import numpy as np
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from semantic_cache import SemanticCache, context_digest
+
+# google.generativeai pulls in grpc and protobuf, so it is imported on first
+# model use rather than whenever this module is imported
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
 logger = logging.getLogger(__name__)
 
-class ExpertPersona:
-    """Base class for individual expert personas"""
-    
-    def __init__(self, name: str, title: str, expertise: str, personality: str, 
-                 specializations: List[str], api_key: str, model_name: str = "gemini-1.5-pro"):
-        self.name = name
-        self.title = title
-        self.expertise = expertise
-        self.personality = personality
-        self.specializations = specializations
-        self.conversation_history = []
-        
-        # Initialize Gemini model
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model_name)
-        self.model_name = model_name
-    
-    def analyze_relevance(self, query: str) -> float:
-        """Analyze how relevant this expert is to the query (0.0 to 1.0)"""
-        relevance_score = 0.0
-        query_lower = query.lower()
-        
-        # Check for direct mentions
-        if f"@{self.name.lower()}" in query_lower:
-            return 1.0
-        
-        # Check for specialization keywords
-        for spec in self.specializations:
-            if spec.lower() in query_lower:
-                relevance_score += 0.3
-        
-        # Check for title/role keywords
-        if any(word in query_lower for word in self.title.lower().split()):
-            relevance_score += 0.2
-        
-        return min(relevance_score, 1.0)
-    
-    def _generate_market_analysis_response(self, query: str, context: List[str], 
-                                         collaboration_context: str = "", user_info: Dict = None) -> Dict[str, Any]:
-        """Enhanced Market Analysis with actual web research capabilities"""
-        
-        try:
-            # Enhanced prompt with web research instructions
-            research_prompt = f"""
-            You are an expert market analyst specializing in the dietary supplements and vitamins industry. Your company is ProCaps Laboratories, with the website: https://www.procapslabs.com.
+# Opt-in (SEMANTIC_CACHE=true, or SEMANTIC_CACHE_DIR set): near-duplicate
+# queries to the same expert with the same context reuse the earlier response
+# instead of issuing another Gemini request. A near-duplicate can still be a
+# different question (another machine or SOP number), and every miss costs an
+# embedding call, so it is off by default and queries are not embedded. The
+# cache is in-memory unless SEMANTIC_CACHE_DIR is set; cached responses can be
+# shaped by user_info, so only point it at a private directory.
+SEMANTIC_CACHE_ENABLED = (bool(os.getenv("SEMANTIC_CACHE_DIR"))
+                          or os.getenv("SEMANTIC_CACHE", "false").lower() == "true")
+_response_cache: Optional[SemanticCache] = (SemanticCache(os.getenv("SEMANTIC_CACHE_DIR") or None)
+                                            if SEMANTIC_CACHE_ENABLED else None)
 
-            USER QUERY: {query}
-            CONTEXT: {chr(10).join(context) if context else "No specific context"}
 
-            Please perform a thorough market analysis based on this information. For the nutritional supplements, vitamins, health products market, provide the following details:
+def _embed_query(query: str) -> Optional[np.ndarray]:
+    """Embedding for semantic cache lookups, or None when the cache is disabled"""
+    return _response_cache.embed(query) if _response_cache is not None else None
 
-            MANDATORY: You MUST provide actual, specific data - NO PLACEHOLDERS, NO "INSERT DATA HERE", NO GENERIC STATEMENTS.
 
-            ABSOLUTELY FORBIDDEN PHRASES:
-            ❌ NEVER write: "[Insert Number]", "[Insert URL]", "[Insert Data]", "TBD", "N/A"
-            ❌ NEVER write: "4.6 out of 5 stars based on [Insert Number] reviews [Insert Amazon Review URL]"
-            ❌ NEVER write: "(Source: A credible market research report URL is needed here...)"
-            ❌ NEVER write: "(URLs and pricing to be added once the retail brand is identified)"
-            
-            ✅ ALWAYS write: "4.6★ (2,347 reviews)" with actual numbers
-            ✅ ALWAYS provide: Real URLs, actual prices, specific review counts
-            ✅ ALWAYS include: Proper markdown table formatting where applicable
-
-            **TOP 10 DIRECT COMPETITORS:**
-            - Company names with website URLs
-            - Brief description of their product focus
-            - Key product lines and specializations
-
-            **COMPETITOR PRODUCT & PRICING DATA:**
-            - List major SKUs or bestselling products for each competitor
-            - Product names and sizes/quantities (e.g. "Vitamin D3 2000 IU, 360 capsules")
-            - Retail price (or price ranges) with direct URLs
-            - Product URLs from Amazon, iHerb, Vitacost, CVS, Walgreens, Walmart
-
-            **COMPETITOR BUSINESS MODEL ANALYSIS:**
-            - Revenue channels: DTC, Amazon, retail partnerships, subscriptions
-            - Market positioning: Premium, value, mass market
-            - Distribution strategy: Online-only, omnichannel, retail-focused
-            - Brand presence: Social media following, marketing approach
-            - Customer base: Target demographics and market segments
-            
-            **SPECIAL NOTE FOR LIFE EXTENSION:**
-            - Use ZoomInfo data: https://www.zoominfo.com/c/life-extension/22380853
-            - Extract most recent revenue figures and PR announcements
-            - Include actual financial data and recent company updates
+async def _embed_query_async(query: str) -> Optional[np.ndarray]:
+    """Async counterpart of _embed_query"""
+    return await _response_cache.embed_async(query) if _response_cache is not None else None
 
-            **COMPREHENSIVE CUSTOMER SENTIMENT ANALYSIS:**
-            (MANDATORY: This section requires analysis of customer reviews from various platforms like Amazon, Trustpilot, and brand websites. Specific examples of positive and negative feedback with review dates and URLs are required.)
-            
-            **INCLUDE PROCAPS PRODUCT ANALYSIS:**
-            - **ProCaps Product Reviews**: Search for reviews of the specific ProCaps product from the URL
-            - **ProCaps Amazon Store**: Check ProCaps Amazon channel: https://www.amazon.com/s?i=merchant-items&me=ANISFYH0BPVKG
-            - **ProCaps Marketplace Presence**: Check if ProCaps product is available on Amazon (seller ID: ANISFYH0BPVKG), iHerb, etc.
-            - **ProCaps Customer Feedback**: Look for any customer reviews on supplement forums or social media
-            
-            **Competitor Review Analysis:**
-            - **Amazon Reviews**: Extract actual customer quotes with reviewer names and dates
-            - **iHerb Reviews**: Analyze verified purchase reviews with specific dates
-            - **Trustpilot Reviews**: Find brand reviews with dates and direct URLs
-            - **Brand Website Reviews**: Check official website customer feedback sections
-            - **Reddit/Forum Analysis**: Search supplement communities for product discussions
-            - **Review Aggregation**: Compile star ratings across all platforms
-            - **Sentiment Trends**: Track review sentiment over time (quarterly analysis)
-            
-            **Required Format with REAL URLs:**
-            - Quote actual reviews: "Great quality, no fishy taste" - Amazon review by Sarah M. (Jan 15, 2024)
-            - **MANDATORY**: Find and include ACTUAL review page URLs:
-              * Amazon: https://amazon.com/product-reviews/[ACTUAL-ASIN]
-              * iHerb: https://iherb.com/reviews/[ACTUAL-PRODUCT-ID]
-              * Target: https://target.com/reviews/[ACTUAL-PRODUCT-ID]
-              * Brand website: [ACTUAL-REVIEW-PAGE-URL]
-            - Provide platform breakdown: Amazon 4.5★ (8,234 reviews), iHerb 4.7★ (1,247 reviews)
-            - NO PLACEHOLDER URLs - must be real, clickable links
-
-            **COMPREHENSIVE MARKETPLACE PRESENCE:**
-            Check ALL major platforms and provide REAL URLs for each competitor:
-            
-            **Required Platforms to Check:**
-            - **Amazon**: amazon.com/stores/[BRAND-NAME] or specific product URLs
-            - **iHerb**: iherb.com/c/[BRAND-NAME] or product pages
-            - **Walmart**: walmart.com/browse/[BRAND-NAME] or product listings
-            - **Target**: target.com/s/[BRAND-NAME] or product pages
-            - **ThriveMarket**: thrivemarket.com/brands/[BRAND-NAME]
-            - **Brand Website**: Official e-commerce site with direct product URLs
-            - **CVS**: cvs.com/shop/[BRAND-NAME]
-            - **Walgreens**: walgreens.com/store/c/[BRAND-NAME]
-            
-            **Table Format Required (INCLUDE PROCAPS PRODUCT FIRST):**
-            | Brand | Product | Size/Quantity | Amazon | Price/Unit | iHerb | Walmart | Target | ThriveMarket | Brand Website |
-            |-------|---------|---------------|--------|------------|-------|---------|---------|--------------|---------------|
-            | **ProCaps Labs** | **[Extract from URL]** | **[Extract size]** | **[Check availability]** | **[Calculate]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **✅ [ProCaps URL]** |
-            | Nature Made | Vitamin D3 2000 IU | 360 Softgels | ✅ $19.99 | $0.056/pill | ✅ $17.99 | ✅ $17.97 | ✅ $18.49 | ❌ | ✅ $21.99 |
-            | NOW Foods | Vitamin D3 2000 IU | 120 Softgels | ✅ $9.99 | $0.083/pill | ✅ $8.49 | ✅ $8.98 | ❌ | ✅ $9.29 | ✅ $10.99 |
-            
-            **REQUIREMENTS:**
-            - **Price/Unit**: Calculate based on Amazon price (Amazon Price ÷ Quantity)
-            - **Brand Website**: Include official direct-to-consumer pricing
-            - **All URLs**: Must be actual, working links - NO placeholders like "[Store URL]"
+# Generation settings: research and professional experts answer with low
+# temperature for factual accuracy, the remaining experts slightly higher
+FACTUAL_GENERATION_CONFIG = {
+    "max_output_tokens": 32768,  # MAXIMUM tokens - comprehensive analysis required
+    "temperature": 0.1,
+    "top_p": 0.95,
+    "top_k": 40
+}
 
-            **COMPREHENSIVE MARKET TRENDS & INSIGHTS:**
-            (MANDATORY: This section requires research into current market trends, including popular ingredients, consumer preferences, and emerging product forms. Cite specific market research reports with URLs and publication dates.)
-            
-            - **Ingredient Innovation Trends**: Research trending ingredients with growth percentages
-            - **Consumer Behavior Analysis**: Purchasing patterns, demographic shifts, preference changes
-            - **Regulatory Environment**: FDA/FTC updates, new compliance requirements, industry guidelines
-            - **Market Size & Growth**: Actual market valuations, growth projections, segment analysis
-            - **Competitive Dynamics**: New product launches, M&A activity, market consolidation
-            - **Technology Trends**: E-commerce growth, subscription models, personalization tech
-            - **Sustainability Trends**: Eco-friendly packaging, clean label movement, ethical sourcing
-            
-            **Required Sources with URLs:**
-            - Nutrition Business Journal reports with direct URLs
-            - Grand View Research market studies with publication dates
-            - Mintel consumer trend reports with specific URLs
-            - Nielsen retail analytics with data URLs
-            - FDA.gov regulatory updates with document links
-            - Industry association reports (CRN, AHPA) with URLs
-            - **ZoomInfo company data**: Use https://www.zoominfo.com/c/life-extension/22380853 for Life Extension revenue and recent PR data
-
-            **RESEARCH METHODOLOGY:**
-            - Search major e-commerce platforms (Amazon, iHerb, Vitacost, CVS, Walgreens, Target, Walmart)
-            - Analyze SEC filings, 10-K reports, and investor presentations for financial data
-            - Research market intelligence firms (IBISWorld, Euromonitor, Grand View Research, Fortune Business Insights)
-            - Monitor financial news sources (Reuters, Bloomberg, Yahoo Finance, MarketWatch)
-            - Track social media presence (Instagram, Facebook, Twitter, LinkedIn) with engagement metrics
-            - Analyze press releases from PR Newswire, Business Wire, and company investor relations
-            - Research patent databases (USPTO), trademark filings, and regulatory approvals
-            - Study trade publications and industry associations (CRN, AHPA, NBJ)
-            - Monitor review aggregation sites and sentiment analysis tools
-
-            **REPORT FORMAT:**
-            Present this analysis in a clear, structured report format with headings, bullet points, and TABLES where appropriate. Include:
-
-            1. **Executive Summary** (2-3 key findings with sources)
-            2. **Top 10 Direct Competitors** (Company names, websites, product focus)
-            3. **Competitor Product & Pricing Data** (SKUs, prices, URLs) - USE TABLE FORMAT
-            4. **Competitor Projected Revenue** (Annual revenue estimates, sources)
-            5. **Customer Sentiment Analysis** (Review summaries, ratings, URLs)
-            6. **Marketplaces Presence** (Platform presence, store URLs, product counts) - USE TABLE FORMAT
-            7. **Market Trends & Insights** (Industry trends, opportunities, threats)
-            8. **Strategic Recommendations** (Data-driven insights with supporting evidence)
-
-            **COMPREHENSIVE STRATEGIC RECOMMENDATIONS:**
-            (MANDATORY: This section should provide data-driven recommendations based on the market analysis. These recommendations should be specific and actionable, supported by the data presented in the report.)
-            
-            **Required Format:**
-            - **Immediate Actions (0-3 months)**: Specific tactics with expected outcomes
-            - **Medium-term Strategy (3-12 months)**: Strategic initiatives with ROI projections
-            - **Long-term Vision (12+ months)**: Innovation opportunities with market validation
-            - **Investment Requirements**: Specific budget estimates for each recommendation
-            - **Success Metrics**: KPIs to track progress and measure impact
-            - **Risk Assessment**: Potential challenges and mitigation strategies
-
-            **TABLE REQUIREMENTS:**
-            - Use proper markdown table formatting with | separators
-            - Include real pricing data with price-per-unit calculations
-            - Show actual star ratings (4.5★) and review counts (2,347 reviews)
-            - Use ✅/❌ symbols for marketplace availability
-            - Include actual URLs where applicable
-            
-            SOURCE VERIFICATION REQUIREMENTS:
-            - Every claim must include a clickable URL or specific source citation
-            - Financial data must reference SEC filings, investor presentations, or credible financial reports
-            - Market share data must cite specific research firm reports with publication dates
-            - Customer sentiment must include direct links to review pages and specific review counts
-            - PR coverage must include actual press release URLs and media mention links
-            - Product data must include direct retailer URLs and manufacturer specification sheets
-            
-            CRITICAL QUALITY STANDARDS:
-            - NO generic statements without verifiable sources
-            - NO placeholder text or hypothetical data
-            - NO vague market references without specific report citations
-            - NO revenue estimates without actual financial document sources
-            - EVERY URL must be real and verifiable
-            - EVERY statistic must have a credible source attribution
-            
-            Deliver a comprehensive market intelligence report with real, actionable data that a business can immediately use for decision-making.
-            """
-            
-            generation_config = {
-                "max_output_tokens": 32768,  # MAXIMUM tokens - comprehensive analysis required
-                "temperature": 0.1,  # Lower temperature for factual research
-                "top_p": 0.95,
-                "top_k": 40
-            }
-            
-            response = self.model.generate_content(research_prompt, generation_config=generation_config)
-            
-            expert_response = {
-                "expert_name": self.name,
-                "expert_title": self.title,
-                "main_response": response.text,
-                "key_insights": ["Real-time market research conducted", "Actual pricing and product data collected", "Live competitive intelligence analysis"],
-                "recommendations": {"immediate": ["Review actual competitor products", "Analyze real pricing strategies"], 
-                                 "strategic": ["Implement competitive monitoring", "Develop data-driven positioning"]},
-                "risks_considerations": ["Market data changes rapidly", "Pricing volatility in online channels"],
-                "follow_up_questions": ["Would you like deeper analysis of specific competitors?", "Should I research additional product categories or segments?"],
-                "confidence_level": "high",
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            return expert_response
-            
-        except Exception as e:
-            logger.error(f"Error in market analysis research: {e}")
-            return self._generate_fallback_response(query)
-    
-    def _generate_advanced_market_analysis_response(self, query: str, context: List[str], 
-                                                   collaboration_context: str = "", user_info: Dict = None) -> Dict[str, Any]:
-        """Advanced Market Analysis with comprehensive product URL analysis"""
-        
-        try:
-            # Advanced market intelligence prompt with detailed product analysis
-            advanced_prompt = f"""
-            You are a Senior Market Intelligence Analyst specializing in the dietary supplements and vitamins industry. You have deep knowledge of key players, product types, regulations, and market trends. You are skilled at sourcing data from online marketplaces, competitor websites, review platforms, and public reports.
-
-            Your objective is to provide detailed market intelligence for ProCaps Laboratories products, using product URLs as starting points, to support strategic decision-making and competitive positioning.
-
-            USER QUERY: {query}
-            CONTEXT: {chr(10).join(context) if context else "No specific context"}
-            {f"COLLABORATION CONTEXT: {collaboration_context}" if collaboration_context else ""}
-
-            When given a ProCaps product URL, perform the following comprehensive analysis:
-
-            **1. PRODUCT DATA EXTRACTION:**
-            - Visit the provided URL and extract:
-              * Product name, SKU or product ID
-              * Ingredients and dosages
-              * Product format (capsules, powder, liquid)
-              * Size/quantity (e.g. 360 capsules, 4 oz.)
-              * Price (regular and any discounts)
-              * Product description and marketing claims
-
-            **2. COMPETITOR IDENTIFICATION:**
-            - Identify direct competitors offering:
-              * Similar formulations and health benefits
-              * Similar product formats or dosages
-            - For each competitor provide:
-              * Brand name and company website URL
-              * Short company overview/description
-              * Focus on premium supplement segment competitors
-
-            **3. COMPETITOR PRODUCT CATALOGING & TABLE COMPARISON:**
-            - Find TOP 10 similar products to the provided ProCaps product
-            - Select the TOP 3 competitors for detailed table comparison
-            - **INCLUDE PROCAPS PRODUCT** as the first row in all comparison tables
-            - Create comprehensive comparison table with columns:
-              * Product Name & Brand
-              * Size/Quantity (e.g., "360 capsules", "4 oz")
-              * Retail Price
-              * Price Per Capsule/Unit
-              * Star Rating
-              * Number of Reviews
-              * Available Marketplaces (Amazon, Walmart, iHerb, Vitacost)
-              * Marketplace URLs for each platform
-              * Key Ingredients/Formulation
-              * Special Features/Claims
-
-            **4. COMPREHENSIVE MARKETPLACE PRESENCE TABLE:**
-            Check ALL major platforms for each competitor with REAL URLs:
-            
-            **Required Platforms:**
-            - **Amazon**: Product pages and brand stores
-            - **iHerb**: Brand pages and individual products  
-            - **Walmart**: Online marketplace listings
-            - **Target**: Product availability and pricing
-            - **ThriveMarket**: Brand presence and product selection
-            - **Brand Website**: Direct-to-consumer offerings
-            - **CVS**: Pharmacy chain online presence
-            - **Walgreens**: Retail pharmacy availability
-            
-            **Table Format (INCLUDE PROCAPS PRODUCT FIRST):**
-            | Brand | Product | Size/Quantity | Amazon | Price/Unit | iHerb | Walmart | Target | ThriveMarket | Brand Website | CVS | Walgreens |
-            |-------|---------|---------------|--------|------------|-------|---------|---------|--------------|---------------|-----|-----------|
-            | **ProCaps Labs** | **[Extract from URL]** | **[Extract size]** | **[Check availability]** | **[Calculate from available price]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **✅ [ProCaps URL]** | **[Check availability]** | **[Check availability]** |
-            | Nature Made | Vitamin D3 2000 IU | 360 Softgels | ✅ $19.99 | $0.056/pill | ✅ $17.99 | ✅ $17.97 | ✅ $18.49 | ❌ | ✅ $21.99 | ✅ $20.99 | ✅ $19.49 |
-            | NOW Foods | Vitamin D3 2000 IU | 120 Softgels | ✅ $9.99 | $0.083/pill | ✅ $8.49 | ✅ $8.98 | ❌ | ✅ $9.29 | ✅ $10.99 | ❌ | ❌ |
-            
-            **REQUIREMENTS:**
-            - **Price/Unit**: Calculate based on Amazon price (Amazon Price ÷ Quantity)
-            - **Brand Website**: Must include official direct-to-consumer pricing
-            - **All URLs**: Must be actual working marketplace links - NO placeholders
-
-            **5. COMPETITOR BUSINESS MODEL & MARKET PRESENCE:**
-            - Distribution channels: DTC, Amazon, retail partnerships, subscriptions
-            - Market positioning: Premium, value, mass market segments
-            - Sales indicators: Review volume, bestseller ranks, marketplace presence
-            - Brand strength: Social media following, marketing spend indicators
-            - Customer acquisition: Subscription models, loyalty programs, referral systems
-            
-            **SPECIAL NOTE FOR LIFE EXTENSION:**
-            - Use ZoomInfo data: https://www.zoominfo.com/c/life-extension/22380853
-            - Extract most recent revenue figures and PR announcements
-            - Include actual financial data and recent company updates
-            
-            (Note: Specific revenue estimates removed for most companies - focus on observable business model indicators, except where reliable data like ZoomInfo is available)
+STANDARD_GENERATION_CONFIG = {
+    "max_output_tokens": 32768,  # MAXIMUM tokens for comprehensive expert analysis
+    "temperature": 0.2,
+    "top_p": 0.9,
+    "top_k": 40
+}
 
-            **6. COMPREHENSIVE CUSTOMER SENTIMENT ANALYSIS:**
-            Research and analyze customer reviews from multiple platforms - **START WITH PROCAPS PRODUCT FIRST**:
-            
-            **ProCaps Product Analysis (FIRST):**
-            - **ProCaps Product Reviews**: Search for reviews of the specific ProCaps product from the provided URL
-            - **ProCaps Amazon Store**: Check ProCaps Amazon channel: https://www.amazon.com/s?i=merchant-items&me=ANISFYH0BPVKG
-            - **ProCaps Marketplace Reviews**: Check if ProCaps product has reviews on Amazon (seller ID: ANISFYH0BPVKG), iHerb, etc.
-            - **ProCaps Customer Feedback**: Look for customer reviews on supplement forums, social media, or Reddit
-            - **ProCaps Brand Sentiment**: Analyze overall ProCaps Laboratories brand perception
-            
-            **Competitor Analysis:**
-            - **Amazon Reviews**: Extract actual customer quotes with dates and reviewer names
-            - **iHerb Reviews**: Analyze verified purchase reviews with dates
-            - **Trustpilot Reviews**: Find brand reviews with specific dates and URLs
-            - **Brand Website Reviews**: Check official website customer feedback
-            - **Reddit/Forums**: Search supplement forums for product discussions
-            
-            **Sentiment Breakdown Format:**
-            ```
-            ## Customer Sentiment Analysis
-            
-            ### ProCaps Laboratories [Product Name from URL] (FIRST)
-            **Overall Rating**: [Search for actual ratings] across platforms
-            **Marketplace Presence**: [Check Amazon, iHerb, etc. for availability and reviews]
-            
-            **Positive Themes:**
-            - [Extract actual customer feedback if available]
-            - [Search supplement forums for mentions]
-            
-            **Negative Themes:**
-            - [Extract any negative feedback if found]
-            - [Note any gaps in marketplace presence]
-            
-            ### Nature Made Vitamin D3
-            **Overall Rating**: 4.5★ across platforms (8,234 Amazon reviews, 1,247 iHerb reviews)
-            
-            **Positive Themes:**
-            - Quality: "Great quality, no fishy taste" - Amazon review by Sarah M. (Jan 2024)
-            - Effectiveness: "Improved my vitamin D levels significantly" - iHerb review (Dec 2023)
-            - Value: "Best price per capsule I've found" - Amazon review by John D. (Feb 2024)
-            
-            **Negative Themes:**
-            - Size: "Pills are too large to swallow easily" - Amazon review by Mary K. (Jan 2024)
-            - Packaging: "Bottle arrived damaged" - Amazon review (Dec 2023)
-            
-            **Review URLs (MUST BE REAL):**
-            - Amazon: https://amazon.com/product-reviews/B074H8KJJ (actual ASIN)
-            - iHerb: https://iherb.com/reviews/12345 (actual product ID)
-            - Target: https://target.com/reviews/A-12345 (actual product ID)
-            - Brand Site: https://naturemade.com/products/vitamin-d3/reviews (actual URL)
-            ```
-            
-            **CRITICAL**: NO placeholder URLs - all review links must be real and functional
+# The configs above give the ceiling; each request is capped by query shape
+# so a short question can't run on for the full budget. Requests for broad or
+# ranked analysis keep more room, long briefs keep the full ceiling.
+OUTPUT_TOKENS_SHORT = 4096
+OUTPUT_TOKENS_MEDIUM = 8192
+OUTPUT_TOKENS_BROAD = 16384
+SHORT_QUERY_CHARS = 200
+LONG_QUERY_CHARS = 1000
+_BROAD_REQUEST_RE = re.compile(r'\b(?:top \d+|comprehensive|in[- ]depth|detailed|full analysis|step[- ]by[- ]step)\b')
 
-            **7. COMPREHENSIVE MARKET TRENDS & INSIGHTS:**
-            Research and cite specific market intelligence with sources and dates:
-            
-            **Required Research Areas:**
-            - **Ingredient Trends**: Research trending ingredients and formulations
-            - **Consumer Behavior**: Analyze purchasing patterns and preferences
-            - **Regulatory Changes**: Track FDA/FTC updates affecting supplements
-            - **Market Growth**: Find actual market size and growth projections
-            - **Competitive Landscape**: Monitor new entrants and product launches
-            
-            **Format with Sources:**
-            ```
-            ## Market Trends & Insights
-            
-            ### Ingredient Innovation Trends
-            - **Liposomal Delivery**: 34% growth in liposomal vitamin products (Nutrition Business Journal, March 2024)
-            - **Plant-Based Sources**: 67% of consumers prefer plant-derived vitamins (Mintel Report, February 2024)
-            - **Personalized Nutrition**: $8.2B market expected by 2026 (Grand View Research, January 2024)
-            
-            **Sources:**
-            - NBJ 2024 Supplement Report: nutritionbusinessjournal.com/reports/2024-supplement-trends
-            - Mintel Consumer Survey: mintel.com/global-consumer-trends-2024
-            - Grand View Research: grandviewresearch.com/industry-analysis/personalized-nutrition-market
-            
-            ### Consumer Preference Shifts
-            - **Clean Label**: 78% prioritize minimal ingredients (IRI Market Research, Feb 2024)
-            - **Sustainability**: 45% willing to pay premium for eco-friendly packaging (Nielsen, Jan 2024)
-            - **Subscription Model**: 31% growth in supplement subscriptions (McKinsey, Dec 2023)
-            
-            ### Regulatory Environment
-            - **FDA Draft Guidance**: New supplement labeling requirements (FDA.gov, March 2024)
-            - **FTC Enforcement**: Increased scrutiny on health claims (FTC.gov, February 2024)
-            ```
+# Context included in an expert prompt is capped at roughly this many tokens
+# (estimated at ~4 characters per token) after duplicate chunks are removed
+EXPERT_CONTEXT_TOKEN_BUDGET = 30000
+CONTEXT_CHARS_PER_TOKEN = 4
 
-            **8. REPORT PRESENTATION:**
-            Deliver findings in a clear, structured report with headings and COMPREHENSIVE TABLES:
-            
-            **Required Table Formats:**
-            
-            **A. TOP 3 COMPETITOR COMPARISON TABLE:**
-            | Product Name | Brand | Size/Qty | Price | Price/Unit | Rating | Reviews | Amazon URL | Walmart URL | iHerb URL | Vitacost URL |
-            |--------------|-------|----------|-------|------------|--------|---------|------------|-------------|-----------|--------------|
-            | [Product 1]  | [Brand] | [360 caps] | [$X.XX] | [$X.XX] | [4.5★] | [1,234] | [URL] | [URL] | [URL] | [URL] |
-            
-            **B. MARKETPLACE PRESENCE MATRIX:**
-            | Brand | Amazon | Walmart.com | iHerb | Vitacost | Other Platforms |
-            |-------|--------|-------------|-------|----------|-----------------|
-            | [Brand 1] | ✅ $X.XX (4.5★, 1K reviews) | ✅ $X.XX | ✅ $X.XX | ❌ | CVS, Target |
-            
-            **C. PRICING ANALYSIS TABLE:**
-            | Product | Regular Price | Sale Price | Price/Capsule | Best Value Platform | Subscription Discount |
-            |---------|---------------|------------|---------------|--------------------|--------------------|
-            | [Product] | $X.XX | $X.XX | $X.XX | Amazon | 15% off |
-            
-            **Report Structure:**
-            - Product Overview (with ProCaps product details)
-            - Top 10 Similar Products (brief list)
-            - Top 3 Competitor Detailed Comparison (with tables)
-            - Marketplace Presence Analysis (with tables)
-            - Pricing Analysis (with tables)
-            - **Comprehensive Customer Sentiment Analysis** (with actual review quotes, dates, URLs)
-            - **Detailed Market Trends & Insights** (with research reports, URLs, publication dates)
-            - **Strategic Recommendations** (data-driven, specific, actionable)
-
-            **8. COMPREHENSIVE STRATEGIC RECOMMENDATIONS:**
-            Provide data-driven recommendations based on the complete analysis:
-            
-            **Format Requirements:**
-            ```
-            ## Strategic Recommendations for ProCaps Laboratories
-            
-            ### Immediate Actions (0-3 months)
-            1. **Pricing Strategy**: 
-               - Current ProCaps pricing: $X.XX ($X.XX/capsule)
-               - Market average: $X.XX ($X.XX/capsule)
-               - Recommendation: Adjust pricing to $X.XX for competitive positioning
-               - Expected impact: X% increase in market share
-            
-            2. **Product Positioning**:
-               - Gap identified: Premium liposomal delivery segment underserved
-               - Opportunity: 67% consumer preference for enhanced absorption
-               - Action: Develop liposomal vitamin D3 formulation
-            
-            ### Medium-term Strategy (3-12 months)
-            1. **Market Expansion**:
-               - Target platforms: Vitacost (competitor absence noted)
-               - Investment required: $X for marketplace setup
-               - Projected ROI: X% based on competitor performance
-            
-            2. **Customer Experience**:
-               - Address top complaint: Large pill size (mentioned in 23% of negative reviews)
-               - Solution: Develop smaller softgel format
-               - Market validation: 45% preference for smaller formats (consumer survey data)
-            
-            ### Long-term Vision (12+ months)
-            1. **Innovation Pipeline**:
-               - Emerging trend: Personalized nutrition (31% annual growth)
-               - Opportunity: Custom vitamin D dosing based on blood levels
-               - Partnership potential: Direct-to-consumer testing companies
-            ```
-
-            **9. SOURCE REFERENCING:**
-            - Provide references for all data used
-            - Include URLs, screenshot references, data providers
-            - Flag gaps where data is unavailable
-
-            **MANDATORY TABLE FORMATTING & DATA REQUIREMENTS:**
-
-            ABSOLUTELY NO PLACEHOLDERS ALLOWED:
-            ❌ NEVER write: "[Insert Number]", "[Insert URL]", "[Product Name]", "TBD", "N/A"
-            ❌ NEVER write: "4.6 out of 5 stars based on [Insert Number] reviews"
-            ✅ ALWAYS write: "4.6★ (2,347 reviews)" with actual numbers
-
-            **REQUIRED TABLE FORMAT EXAMPLE:**
-
-            ## Top 3 Competitor Comparison (INCLUDING PROCAPS PRODUCT)
-
-            | Brand | Product | Size/Quantity | Amazon | Price/Unit | Rating | Reviews | iHerb | Walmart | Target | Brand Website |
-            |-------|---------|---------------|--------|------------|--------|---------|-------|---------|---------|---------------|
-            | **ProCaps Labs** | **[Extract from URL]** | **[Extract size]** | **[Check availability]** | **[Calculate]** | **[Search for ratings]** | **[Search for reviews]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **✅ [ProCaps URL]** |
-            | Nature Made | Vitamin D3 2000 IU | 360 Softgels | ✅ $19.99 | $0.056/pill | 4.5★ | 8,234 | ✅ $17.99 | ✅ $17.97 | ✅ $18.49 | ✅ $21.99 |
-            | NOW Foods | D3 2000 IU Softgels | 120 Softgels | ✅ $9.99 | $0.083/pill | 4.3★ | 5,672 | ✅ $8.49 | ✅ $8.98 | ❌ | ✅ $10.99 |
-            | Nature's Bounty | Vitamin D3 2000 IU | 250 Tablets | ✅ $15.99 | $0.064/pill | 4.6★ | 12,567 | ✅ $14.50 | ✅ $15.25 | ✅ $14.99 | ✅ $17.99 |
-
-            ## Comprehensive Marketplace Presence Matrix (INCLUDING PROCAPS PRODUCT)
-
-            | Brand | Product | Size/Quantity | Amazon | Price/Unit | iHerb | Walmart | Target | ThriveMarket | Brand Website | CVS | Walgreens |
-            |-------|---------|---------------|--------|------------|-------|---------|---------|--------------|---------------|-----|-----------|
-            | **ProCaps Labs** | **[Extract from URL]** | **[Extract size]** | **[Check availability]** | **[Calculate]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **✅ [ProCaps URL]** | **[Check availability]** | **[Check availability]** |
-            | Nature Made | Vitamin D3 2000 IU | 360 Softgels | ✅ $19.99 | $0.056/pill | ✅ $17.99 | ✅ $17.97 | ✅ $18.49 | ❌ | ✅ $21.99 | ✅ $20.99 | ✅ $19.49 |
-            | NOW Foods | D3 2000 IU Softgels | 120 Softgels | ✅ $9.99 | $0.083/pill | ✅ $8.49 | ✅ $8.98 | ❌ | ✅ $9.29 | ✅ $10.99 | ❌ | ❌ |
-
-            **CRITICAL EXECUTION REQUIREMENTS:**
-            1. **EXTRACT PROCAPS PRODUCT DATA FIRST**: Visit the provided ProCaps URL and extract:
-               - Product name, size/quantity, ingredients, claims
-               - Check ProCaps Amazon store: https://www.amazon.com/s?i=merchant-items&me=ANISFYH0BPVKG
-               - Search for the specific product on Amazon using seller ID: ANISFYH0BPVKG
-               - Check if available on iHerb, Walmart, Target, etc.
-               - Search for any customer reviews or mentions
-               - Include ProCaps as the FIRST row in ALL comparison tables
-            2. **FIND REAL COMPETITOR PRODUCTS**: Research actual competing products with real names, prices, and data
-            3. **CALCULATE ACTUAL PRICE PER UNIT**: Divide real price by real quantity
-            4. **USE REAL STAR RATINGS**: Find actual ratings like "4.5★", "4.3★", "4.6★"
-            5. **INCLUDE REAL REVIEW COUNTS**: Use actual numbers like "8,234", "5,672", "12,567"
-            6. **PROVIDE REAL URLs**: Include actual marketplace links or indicate availability with ✅/❌
-            7. **USE PROPER TABLE FORMATTING**: Ensure tables render correctly in markdown
-
-            **ACTIVE DATA COLLECTION PROCESS:**
-            1. Extract product details from the provided ProCaps URL
-            2. **ACTIVELY SEARCH GOOGLE** for each competitor product on marketplaces:
-               - Search: "[Product Name] site:amazon.com"
-               - Search: "[Product Name] site:iherb.com" 
-               - Search: "[Product Name] site:vitacost.com"
-               - Search: "[Product Name] site:walmart.com"
-            3. Find and verify actual product URLs for each marketplace
-            4. Extract real pricing data from each marketplace
-            5. Calculate exact price per capsule/softgel/tablet for each product
-            6. Gather actual review counts and star ratings
-            7. Format in comprehensive comparison tables
-
-            **PRICING CALCULATION REQUIREMENTS:**
-            - Price per capsule = Total Price ÷ Number of Capsules
-            - Price per softgel = Total Price ÷ Number of Softgels  
-            - Price per tablet = Total Price ÷ Number of Tablets
-            - Price per serving = Total Price ÷ Number of Servings
-            - Always show the unit of measurement (e.g., "$0.052/capsule", "$0.037/softgel")
-
-            **EXAMPLE OUTPUT STYLE:**
-            "Nature Made Vitamin D3 has 8,234 reviews with a 4.5★ rating on Amazon at $12.99 for 250 tablets ($0.052 per tablet)"
-
-            NOT: "Product has [Insert Number] reviews with [Insert Rating] on [Insert Platform]"
-
-            **MANDATORY WEB RESEARCH INSTRUCTIONS:**
-            
-            You MUST actively research and find real data. Do not write placeholder text. Instead:
-            
-            1. **For ProCaps Amazon**: Check ProCaps Amazon store (seller ID: ANISFYH0BPVKG): https://www.amazon.com/s?i=merchant-items&me=ANISFYH0BPVKG
-            2. **For Amazon URLs**: Search for products on Amazon and find actual product pages with real ASINs
-            3. **For iHerb URLs**: Search iHerb.com for the specific products and get real product IDs
-            4. **For Walmart URLs**: Search walmart.com for the products and get actual item pages
-            5. **For Target URLs**: Search target.com for the products and get real product links
-            6. **For ThriveMarket URLs**: Search thrivemarket.com for brand presence and products
-            7. **For Brand Websites**: Find official e-commerce sites and extract direct-to-consumer pricing
-            8. **For CVS URLs**: Search cvs.com for product availability and pricing
-            9. **For Walgreens URLs**: Search walgreens.com for product listings and pricing
-            10. **For Reviews**: Find actual review page URLs and extract real review data
-            11. **For Pricing**: Collect current prices from each platform INCLUDING brand's own website
-            12. **For Price/Unit**: Calculate price per pill/capsule/tablet based on Amazon pricing
-            
-            **CRITICAL**: Replace ALL "[FIND REAL URL]" and "[REAL URL]" placeholders with actual working URLs
-            
-            **EXAMPLE OF PROPER RESEARCH OUTPUT:**
-            ```
-            | Brand | Product | Size/Quantity | Amazon | Price/Unit | iHerb | Walmart | Target | Brand Website |
-            |-------|---------|---------------|--------|------------|-------|---------|---------|---------------|
-            | **ProCaps Labs** | **Essential-1 NuOnce Max D3** | **52 Softgels** | **✅ $X.XX (via ANISFYH0BPVKG)** | **$X.XX/pill** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **✅ [ProCaps URL]** |
-            | Nature Made | Vitamin D3 2000 IU | 360 Softgels | ✅ $19.99 | $0.056/pill | ✅ $17.99 | ✅ $17.97 | ✅ $18.49 | ✅ $21.99 |
-            | NOW Foods | D3 2000 IU Softgels | 120 Softgels | ✅ $9.99 | $0.083/pill | ✅ $8.49 | ✅ $8.98 | ❌ | ✅ $10.99 |
-            ```
-            
-            **KEY REQUIREMENTS:**
-            - **ProCaps Amazon**: Search ProCaps Amazon store using seller ID: ANISFYH0BPVKG
-            - **Price/Unit**: Always calculate as Amazon Price ÷ Quantity (e.g., $19.99 ÷ 360 = $0.056/pill)
-            - **Brand Website**: Must include official direct-to-consumer pricing from company's own site
-            - **Real URLs**: All marketplace links must be actual, working product pages
-            
-            **MARKETPLACE PRESENCE RESEARCH:**
-            ```
-            | Competitor | Amazon | iHerb | Vitacost | Walmart |
-            |------------|--------|-------|----------|---------|
-            | Nature Made | ✅ $12.99 (4.5★, 8K reviews) | ✅ $11.50 | ✅ $13.25 | ✅ $11.47 |
-            ```
-            
-            If you cannot find a product on a specific marketplace, use ❌. If you find it, use ✅ with price and basic info.
+# Chunks whose word 3-gram sets overlap an earlier chunk's by at least this
+# Jaccard similarity (overlapping RAG splits, re-extracted revisions) are dropped too
+CONTEXT_NEAR_DUPLICATE_JACCARD = 0.85
+CONTEXT_SHINGLE_WORDS = 3
 
-            Deliver a comprehensive market intelligence report with properly formatted tables containing only real data and actual marketplace information gathered through active research.
-            """
-            
-            generation_config = {
-                "max_output_tokens": 32768,  # MAXIMUM tokens - budget is not a concern
-                "temperature": 0.1,  # Lower temperature for factual accuracy
-                "top_p": 0.95,
-                "top_k": 40
-            }
-            
-            response = self.model.generate_content(advanced_prompt, generation_config=generation_config)
-            
-            expert_response = {
-                "expert_name": self.name,
-                "expert_title": self.title,
-                "main_response": response.text,
-                "key_insights": ["Comprehensive product URL analysis conducted", "Full competitive landscape mapped", "Marketplace presence analyzed across major platforms"],
-                "recommendations": {"immediate": ["Review competitor product positioning", "Analyze pricing strategies across platforms"], 
-                                 "strategic": ["Develop competitive monitoring system", "Optimize product positioning based on market gaps"]},
-                "risks_considerations": ["Market data changes rapidly", "Competitor pricing volatility", "New product launches can shift landscape"],
-                "follow_up_questions": ["Would you like deeper analysis of specific competitors?", "Should I track historical pricing trends for key products?", "Do you want analysis of additional product categories?"],
-                "confidence_level": "high",
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            return expert_response
-            
-        except Exception as e:
-            logger.error(f"Error in advanced market analysis: {e}")
-            return self._generate_fallback_response(query)
+# Opt-in (EXPERT_SYNTHESIS=true, with the semantic cache enabled): when no
+# cached response is close enough to reuse but several related ones are, a
+# lightweight model combines them instead of running the full expert prompt.
+# It answers SYNTHESIS_INSUFFICIENT when they do not cover the query.
+# Synthesized responses are marked "synthesized" and never cached, so later
+# answers are never blends of blends.
+SYNTHESIS_ENABLED = os.getenv("EXPERT_SYNTHESIS", "false").lower() == "true"
+SYNTHESIS_MODEL = "gemini-1.5-flash"
+SYNTHESIS_MIN_SIMILARITY = 0.75
+SYNTHESIS_TOP_K = 3
+SYNTHESIS_MIN_ENTRIES = 2
+SYNTHESIS_INSUFFICIENT = "INSUFFICIENT"
+
+SYNTHESIS_GENERATION_CONFIG = {
+    "max_output_tokens": 8192,
+    "temperature": 0.1
+}
+
+# With prefer_flash, a cache miss is first drafted by the lightweight model
+# and only escalated to the expert's own model when the draft fails the
+# quality checklist in _draft_quality (a fraction of checks passed).
+# Accepted drafts are not cached: the caches are keyed by the expert's model,
+# and later requests for it must not be served lightweight-model output.
+DRAFT_MODEL = "gemini-1.5-flash"
+DRAFT_MIN_QUALITY = 0.75
+DRAFT_MIN_CHARS = 400
+
+DRAFT_GENERATION_CONFIG = {
+    "max_output_tokens": 8192,
+    "temperature": 0.1
+}
+
+# Experts whose prompts demand sourced research: their drafts must also
+# include a markdown table and at least one URL, and none of the placeholder
+# phrases their prompts forbid
+RESEARCH_EXPERTS = frozenset({"MarketAnalysisExpert", "AdvancedMarketAnalyst"})
+RESEARCH_FORBIDDEN_PHRASES = (
+    "[Insert Number]", "[Insert URL]", "[Insert Data]", "[Insert Rating]", "[Insert Platform]",
+    "[Product Name]", "TBD", "N/A", "(Source: A credible market research", "(URLs and pricing to be added"
+)
+
+SYNTHESIS_PROMPT_TEMPLATE = """
+You are assisting a {title}. Combine the prior answers below into a single answer to the new question.
+Keep their SOP references, facts and recommendations; do not invent new ones.
+If the prior answers do not address the new question, reply with exactly: {insufficient}
+
+NEW QUESTION: {query}
+
+{prior_answers}
+"""
+
+# Each expert keeps a short ring of lightweight history records. When
+# EXPERT_HISTORY_FILE is set, records evicted from the ring are appended there
+# as JSON lines by a background thread.
+EXPERT_HISTORY_MAX_TURNS = 32
+EXPERT_HISTORY_FILE = os.getenv("EXPERT_HISTORY_FILE")
+
+_history_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="expert-history") if EXPERT_HISTORY_FILE else None
+
+# MultiExpertSystem keeps the most recent consultations. Past the newest
+# CONSULTATION_FULL_TURNS, each expert's main_response is cut to
+# CONSULTATION_TRIMMED_CHARS so old turns don't hold full answers.
+CONSULTATION_HISTORY_MAX_TURNS = 200
+CONSULTATION_FULL_TURNS = 20
+CONSULTATION_TRIMMED_CHARS = 500
+
+# Exact repeats of an expert request (same expert, model, query, context,
+# collaboration context and user) are answered from memory, ahead of the
+# embedding call the semantic cache needs
+EXACT_CACHE_SIZE = 1000
+EXACT_CACHE_TTL_SECONDS = 60 * 60
+
+_exact_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_exact_cache_lock = threading.Lock()
+_exact_cache_stats = {"hits": 0, "misses": 0}
+
+# API key the SDK is configured with; get_gemini_model reconfigures on change
+_configured_api_key: Optional[str] = None
+_sdk_lock = threading.Lock()
+
+# Blocking work reached from the async paths (persisting the semantic cache,
+# assembling consultations) and the sync consultation fan-out run on this
+# pool, sized for I/O rather than CPU
+EXPERT_IO_WORKERS = int(os.getenv("EXPERT_IO_WORKERS", "32"))
+_io_executor = ThreadPoolExecutor(max_workers=EXPERT_IO_WORKERS, thread_name_prefix="expert-io")
+
+# Most requests an ExpertBatch keeps in flight at once, to stay inside the
+# Gemini per-minute request quota when a large batch is flushed
+BATCH_MAX_CONCURRENCY = int(os.getenv("EXPERT_BATCH_CONCURRENCY", "8"))
+
+# Identical expert requests that arrive while one is already being answered
+# (e.g. several users asking the same question at once) wait for that answer
+# instead of issuing their own Gemini call. Sync and async callers coalesce in
+# separate tables: a sync caller blocks its thread while waiting, so if it
+# waited on an async leader running on the same event loop, neither could finish.
+_inflight: Dict[str, Future] = {}
+_inflight_async: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+# Auto-selected experts must match at least one specialization (0.3); a
+# title keyword alone (0.2) only selects an expert when nobody scores higher
+MIN_DISPATCH_RELEVANCE = 0.3
+
+# When no expert matches a keyword, the expert whose expertise text is most
+# similar (TF-IDF cosine) is chosen if the similarity reaches this
+MIN_PROFILE_SIMILARITY = 0.1
+
+# Experts answered with the professional standards prompt
+PROFESSIONAL_EXPERTS = frozenset({
+    "QualityExpert", "ManufacturingExpert", "SafetyExpert", "MaintenanceExpert",
+    "ProcessEngineeringExpert", "ProductDevelopmentExpert", "AccountingExpert"
+})
+
+# Fixed insight, recommendation, risk and follow-up fields of the market and
+# professional response builders. Lists are tuples so responses can share them;
+# the recommendations mapping is copied per response.
+_MARKET_ANALYSIS_FIELDS = {
+    "key_insights": ("Real-time market research conducted", "Actual pricing and product data collected", "Live competitive intelligence analysis"),
+    "recommendations": {"immediate": ("Review actual competitor products", "Analyze real pricing strategies"),
+                        "strategic": ("Implement competitive monitoring", "Develop data-driven positioning")},
+    "risks_considerations": ("Market data changes rapidly", "Pricing volatility in online channels"),
+    "follow_up_questions": ("Would you like deeper analysis of specific competitors?", "Should I research additional product categories or segments?"),
+    "confidence_level": "high"
+}
+_ADVANCED_MARKET_ANALYSIS_FIELDS = {
+    "key_insights": ("Comprehensive product URL analysis conducted", "Full competitive landscape mapped", "Marketplace presence analyzed across major platforms"),
+    "recommendations": {"immediate": ("Review competitor product positioning", "Analyze pricing strategies across platforms"),
+                        "strategic": ("Develop competitive monitoring system", "Optimize product positioning based on market gaps")},
+    "risks_considerations": ("Market data changes rapidly", "Competitor pricing volatility", "New product launches can shift landscape"),
+    "follow_up_questions": ("Would you like deeper analysis of specific competitors?", "Should I track historical pricing trends for key products?", "Do you want analysis of additional product categories?"),
+    "confidence_level": "high"
+}
+_PROFESSIONAL_FIELDS = {
+    "key_insights": ("Technical analysis with industry standards", "Real specifications and procedures referenced", "Professional-grade recommendations provided"),
+    "recommendations": {"immediate": ("Review referenced standards and procedures", "Implement specific technical recommendations"),
+                        "strategic": ("Develop systematic approach based on industry standards", "Establish monitoring and measurement protocols")},
+    "risks_considerations": ("Ensure compliance with all referenced regulations", "Verify equipment specifications before implementation"),
+    "follow_up_questions": ("Would you like specific implementation guidance?", "Should I provide additional technical references for this topic?"),
+    "confidence_level": "high"
+}
+
+# Static persona and instruction prompts, sent as each expert model's system
+# instruction. The per-query part (query, context, collaboration context) is
+# the only content sent with each request.
+MARKET_RESEARCH_PROMPT = """
+You are an expert market analyst specializing in the dietary supplements and vitamins industry. Your company is ProCaps Laboratories, with the website: https://www.procapslabs.com.
+
+Please perform a thorough market analysis based on the user query and context at the end of this prompt. For the nutritional supplements, vitamins, health products market, provide the following details:
+
+MANDATORY: You MUST provide actual, specific data - NO PLACEHOLDERS, NO "INSERT DATA HERE", NO GENERIC STATEMENTS.
+
+ABSOLUTELY FORBIDDEN PHRASES:
+❌ NEVER write: "[Insert Number]", "[Insert URL]", "[Insert Data]", "TBD", "N/A"
+❌ NEVER write: "4.6 out of 5 stars based on [Insert Number] reviews [Insert Amazon Review URL]"
+❌ NEVER write: "(Source: A credible market research report URL is needed here...)"
+❌ NEVER write: "(URLs and pricing to be added once the retail brand is identified)"
+
+✅ ALWAYS write: "4.6★ (2,347 reviews)" with actual numbers
+✅ ALWAYS provide: Real URLs, actual prices, specific review counts
+✅ ALWAYS include: Proper markdown table formatting where applicable
+
+**TOP 10 DIRECT COMPETITORS:**
+- Company names with website URLs
+- Brief description of their product focus
+- Key product lines and specializations
+
+**COMPETITOR PRODUCT & PRICING DATA:**
+- List major SKUs or bestselling products for each competitor
+- Product names and sizes/quantities (e.g. "Vitamin D3 2000 IU, 360 capsules")
+- Retail price (or price ranges) with direct URLs
+- Product URLs from Amazon, iHerb, Vitacost, CVS, Walgreens, Walmart
+
+**COMPETITOR BUSINESS MODEL ANALYSIS:**
+- Revenue channels: DTC, Amazon, retail partnerships, subscriptions
+- Market positioning: Premium, value, mass market
+- Distribution strategy: Online-only, omnichannel, retail-focused
+- Brand presence: Social media following, marketing approach
+- Customer base: Target demographics and market segments
+
+**SPECIAL NOTE FOR LIFE EXTENSION:**
+- Use ZoomInfo data: https://www.zoominfo.com/c/life-extension/22380853
+- Extract most recent revenue figures and PR announcements
+- Include actual financial data and recent company updates
+
+**COMPREHENSIVE CUSTOMER SENTIMENT ANALYSIS:**
+(MANDATORY: This section requires analysis of customer reviews from various platforms like Amazon, Trustpilot, and brand websites. Specific examples of positive and negative feedback with review dates and URLs are required.)
+
+**INCLUDE PROCAPS PRODUCT ANALYSIS:**
+- **ProCaps Product Reviews**: Search for reviews of the specific ProCaps product from the URL
+- **ProCaps Amazon Store**: Check ProCaps Amazon channel: https://www.amazon.com/s?i=merchant-items&me=ANISFYH0BPVKG
+- **ProCaps Marketplace Presence**: Check if ProCaps product is available on Amazon (seller ID: ANISFYH0BPVKG), iHerb, etc.
+- **ProCaps Customer Feedback**: Look for any customer reviews on supplement forums or social media
+
+**Competitor Review Analysis:**
+- **Amazon Reviews**: Extract actual customer quotes with reviewer names and dates
+- **iHerb Reviews**: Analyze verified purchase reviews with specific dates
+- **Trustpilot Reviews**: Find brand reviews with dates and direct URLs
+- **Brand Website Reviews**: Check official website customer feedback sections
+- **Reddit/Forum Analysis**: Search supplement communities for product discussions
+- **Review Aggregation**: Compile star ratings across all platforms
+- **Sentiment Trends**: Track review sentiment over time (quarterly analysis)
+
+**Required Format with REAL URLs:**
+- Quote actual reviews: "Great quality, no fishy taste" - Amazon review by Sarah M. (Jan 15, 2024)
+- **MANDATORY**: Find and include ACTUAL review page URLs:
+  * Amazon: https://amazon.com/product-reviews/[ACTUAL-ASIN]
+  * iHerb: https://iherb.com/reviews/[ACTUAL-PRODUCT-ID]
+  * Target: https://target.com/reviews/[ACTUAL-PRODUCT-ID]
+  * Brand website: [ACTUAL-REVIEW-PAGE-URL]
+- Provide platform breakdown: Amazon 4.5★ (8,234 reviews), iHerb 4.7★ (1,247 reviews)
+- NO PLACEHOLDER URLs - must be real, clickable links
+
+**COMPREHENSIVE MARKETPLACE PRESENCE:**
+Check ALL major platforms and provide REAL URLs for each competitor:
+
+**Required Platforms to Check:**
+- **Amazon**: amazon.com/stores/[BRAND-NAME] or specific product URLs
+- **iHerb**: iherb.com/c/[BRAND-NAME] or product pages
+- **Walmart**: walmart.com/browse/[BRAND-NAME] or product listings
+- **Target**: target.com/s/[BRAND-NAME] or product pages
+- **ThriveMarket**: thrivemarket.com/brands/[BRAND-NAME]
+- **Brand Website**: Official e-commerce site with direct product URLs
+- **CVS**: cvs.com/shop/[BRAND-NAME]
+- **Walgreens**: walgreens.com/store/c/[BRAND-NAME]
+
+**Table Format Required (INCLUDE PROCAPS PRODUCT FIRST):**
+| Brand | Product | Size/Quantity | Amazon | Price/Unit | iHerb | Walmart | Target | ThriveMarket | Brand Website |
+|-------|---------|---------------|--------|------------|-------|---------|---------|--------------|---------------|
+| **ProCaps Labs** | **[Extract from URL]** | **[Extract size]** | **[Check availability]** | **[Calculate]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **✅ [ProCaps URL]** |
+| Nature Made | Vitamin D3 2000 IU | 360 Softgels | ✅ $19.99 | $0.056/pill | ✅ $17.99 | ✅ $17.97 | ✅ $18.49 | ❌ | ✅ $21.99 |
+| NOW Foods | Vitamin D3 2000 IU | 120 Softgels | ✅ $9.99 | $0.083/pill | ✅ $8.49 | ✅ $8.98 | ❌ | ✅ $9.29 | ✅ $10.99 |
+
+**REQUIREMENTS:**
+- **Price/Unit**: Calculate based on Amazon price (Amazon Price ÷ Quantity)
+- **Brand Website**: Include official direct-to-consumer pricing
+- **All URLs**: Must be actual, working links - NO placeholders like "[Store URL]"
+
+**COMPREHENSIVE MARKET TRENDS & INSIGHTS:**
+(MANDATORY: This section requires research into current market trends, including popular ingredients, consumer preferences, and emerging product forms. Cite specific market research reports with URLs and publication dates.)
+
+- **Ingredient Innovation Trends**: Research trending ingredients with growth percentages
+- **Consumer Behavior Analysis**: Purchasing patterns, demographic shifts, preference changes
+- **Regulatory Environment**: FDA/FTC updates, new compliance requirements, industry guidelines
+- **Market Size & Growth**: Actual market valuations, growth projections, segment analysis
+- **Competitive Dynamics**: New product launches, M&A activity, market consolidation
+- **Technology Trends**: E-commerce growth, subscription models, personalization tech
+- **Sustainability Trends**: Eco-friendly packaging, clean label movement, ethical sourcing
+
+**Required Sources with URLs:**
+- Nutrition Business Journal reports with direct URLs
+- Grand View Research market studies with publication dates
+- Mintel consumer trend reports with specific URLs
+- Nielsen retail analytics with data URLs
+- FDA.gov regulatory updates with document links
+- Industry association reports (CRN, AHPA) with URLs
+- **ZoomInfo company data**: Use https://www.zoominfo.com/c/life-extension/22380853 for Life Extension revenue and recent PR data
+
+**RESEARCH METHODOLOGY:**
+- Search major e-commerce platforms (Amazon, iHerb, Vitacost, CVS, Walgreens, Target, Walmart)
+- Analyze SEC filings, 10-K reports, and investor presentations for financial data
+- Research market intelligence firms (IBISWorld, Euromonitor, Grand View Research, Fortune Business Insights)
+- Monitor financial news sources (Reuters, Bloomberg, Yahoo Finance, MarketWatch)
+- Track social media presence (Instagram, Facebook, Twitter, LinkedIn) with engagement metrics
+- Analyze press releases from PR Newswire, Business Wire, and company investor relations
+- Research patent databases (USPTO), trademark filings, and regulatory approvals
+- Study trade publications and industry associations (CRN, AHPA, NBJ)
+- Monitor review aggregation sites and sentiment analysis tools
+
+**REPORT FORMAT:**
+Present this analysis in a clear, structured report format with headings, bullet points, and TABLES where appropriate. Include:
+
+1. **Executive Summary** (2-3 key findings with sources)
+2. **Top 10 Direct Competitors** (Company names, websites, product focus)
+3. **Competitor Product & Pricing Data** (SKUs, prices, URLs) - USE TABLE FORMAT
+4. **Competitor Projected Revenue** (Annual revenue estimates, sources)
+5. **Customer Sentiment Analysis** (Review summaries, ratings, URLs)
+6. **Marketplaces Presence** (Platform presence, store URLs, product counts) - USE TABLE FORMAT
+7. **Market Trends & Insights** (Industry trends, opportunities, threats)
+8. **Strategic Recommendations** (Data-driven insights with supporting evidence)
+
+**COMPREHENSIVE STRATEGIC RECOMMENDATIONS:**
+(MANDATORY: This section should provide data-driven recommendations based on the market analysis. These recommendations should be specific and actionable, supported by the data presented in the report.)
+
+**Required Format:**
+- **Immediate Actions (0-3 months)**: Specific tactics with expected outcomes
+- **Medium-term Strategy (3-12 months)**: Strategic initiatives with ROI projections
+- **Long-term Vision (12+ months)**: Innovation opportunities with market validation
+- **Investment Requirements**: Specific budget estimates for each recommendation
+- **Success Metrics**: KPIs to track progress and measure impact
+- **Risk Assessment**: Potential challenges and mitigation strategies
+
+**TABLE REQUIREMENTS:**
+- Use proper markdown table formatting with | separators
+- Include real pricing data with price-per-unit calculations
+- Show actual star ratings (4.5★) and review counts (2,347 reviews)
+- Use ✅/❌ symbols for marketplace availability
+- Include actual URLs where applicable
+
+SOURCE VERIFICATION REQUIREMENTS:
+- Every claim must include a clickable URL or specific source citation
+- Financial data must reference SEC filings, investor presentations, or credible financial reports
+- Market share data must cite specific research firm reports with publication dates
+- Customer sentiment must include direct links to review pages and specific review counts
+- PR coverage must include actual press release URLs and media mention links
+- Product data must include direct retailer URLs and manufacturer specification sheets
+
+CRITICAL QUALITY STANDARDS:
+- NO generic statements without verifiable sources
+- NO placeholder text or hypothetical data
+- NO vague market references without specific report citations
+- NO revenue estimates without actual financial document sources
+- EVERY URL must be real and verifiable
+- EVERY statistic must have a credible source attribution
+
+Deliver a comprehensive market intelligence report with real, actionable data that a business can immediately use for decision-making.
+"""
+
+ADVANCED_MARKET_RESEARCH_PROMPT = """
+You are a Senior Market Intelligence Analyst specializing in the dietary supplements and vitamins industry. You have deep knowledge of key players, product types, regulations, and market trends. You are skilled at sourcing data from online marketplaces, competitor websites, review platforms, and public reports.
+
+Your objective is to provide detailed market intelligence for ProCaps Laboratories products, using product URLs as starting points, to support strategic decision-making and competitive positioning.
+
+When given a ProCaps product URL, perform the following comprehensive analysis:
+
+**1. PRODUCT DATA EXTRACTION:**
+- Visit the provided URL and extract:
+  * Product name, SKU or product ID
+  * Ingredients and dosages
+  * Product format (capsules, powder, liquid)
+  * Size/quantity (e.g. 360 capsules, 4 oz.)
+  * Price (regular and any discounts)
+  * Product description and marketing claims
+
+**2. COMPETITOR IDENTIFICATION:**
+- Identify direct competitors offering:
+  * Similar formulations and health benefits
+  * Similar product formats or dosages
+- For each competitor provide:
+  * Brand name and company website URL
+  * Short company overview/description
+  * Focus on premium supplement segment competitors
+
+**3. COMPETITOR PRODUCT CATALOGING & TABLE COMPARISON:**
+- Find TOP 10 similar products to the provided ProCaps product
+- Select the TOP 3 competitors for detailed table comparison
+- **INCLUDE PROCAPS PRODUCT** as the first row in all comparison tables
+- Create comprehensive comparison table with columns:
+  * Product Name & Brand
+  * Size/Quantity (e.g., "360 capsules", "4 oz")
+  * Retail Price
+  * Price Per Capsule/Unit
+  * Star Rating
+  * Number of Reviews
+  * Available Marketplaces (Amazon, Walmart, iHerb, Vitacost)
+  * Marketplace URLs for each platform
+  * Key Ingredients/Formulation
+  * Special Features/Claims
+
+**4. COMPREHENSIVE MARKETPLACE PRESENCE TABLE:**
+Check ALL major platforms for each competitor with REAL URLs:
+
+**Required Platforms:**
+- **Amazon**: Product pages and brand stores
+- **iHerb**: Brand pages and individual products  
+- **Walmart**: Online marketplace listings
+- **Target**: Product availability and pricing
+- **ThriveMarket**: Brand presence and product selection
+- **Brand Website**: Direct-to-consumer offerings
+- **CVS**: Pharmacy chain online presence
+- **Walgreens**: Retail pharmacy availability
+
+**Table Format (INCLUDE PROCAPS PRODUCT FIRST):**
+| Brand | Product | Size/Quantity | Amazon | Price/Unit | iHerb | Walmart | Target | ThriveMarket | Brand Website | CVS | Walgreens |
+|-------|---------|---------------|--------|------------|-------|---------|---------|--------------|---------------|-----|-----------|
+| **ProCaps Labs** | **[Extract from URL]** | **[Extract size]** | **[Check availability]** | **[Calculate from available price]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **✅ [ProCaps URL]** | **[Check availability]** | **[Check availability]** |
+| Nature Made | Vitamin D3 2000 IU | 360 Softgels | ✅ $19.99 | $0.056/pill | ✅ $17.99 | ✅ $17.97 | ✅ $18.49 | ❌ | ✅ $21.99 | ✅ $20.99 | ✅ $19.49 |
+| NOW Foods | Vitamin D3 2000 IU | 120 Softgels | ✅ $9.99 | $0.083/pill | ✅ $8.49 | ✅ $8.98 | ❌ | ✅ $9.29 | ✅ $10.99 | ❌ | ❌ |
+
+**REQUIREMENTS:**
+- **Price/Unit**: Calculate based on Amazon price (Amazon Price ÷ Quantity)
+- **Brand Website**: Must include official direct-to-consumer pricing
+- **All URLs**: Must be actual working marketplace links - NO placeholders
+
+**5. COMPETITOR BUSINESS MODEL & MARKET PRESENCE:**
+- Distribution channels: DTC, Amazon, retail partnerships, subscriptions
+- Market positioning: Premium, value, mass market segments
+- Sales indicators: Review volume, bestseller ranks, marketplace presence
+- Brand strength: Social media following, marketing spend indicators
+- Customer acquisition: Subscription models, loyalty programs, referral systems
+
+**SPECIAL NOTE FOR LIFE EXTENSION:**
+- Use ZoomInfo data: https://www.zoominfo.com/c/life-extension/22380853
+- Extract most recent revenue figures and PR announcements
+- Include actual financial data and recent company updates
+
+(Note: Specific revenue estimates removed for most companies - focus on observable business model indicators, except where reliable data like ZoomInfo is available)
+
+**6. COMPREHENSIVE CUSTOMER SENTIMENT ANALYSIS:**
+Research and analyze customer reviews from multiple platforms - **START WITH PROCAPS PRODUCT FIRST**:
+
+**ProCaps Product Analysis (FIRST):**
+- **ProCaps Product Reviews**: Search for reviews of the specific ProCaps product from the provided URL
+- **ProCaps Amazon Store**: Check ProCaps Amazon channel: https://www.amazon.com/s?i=merchant-items&me=ANISFYH0BPVKG
+- **ProCaps Marketplace Reviews**: Check if ProCaps product has reviews on Amazon (seller ID: ANISFYH0BPVKG), iHerb, etc.
+- **ProCaps Customer Feedback**: Look for customer reviews on supplement forums, social media, or Reddit
+- **ProCaps Brand Sentiment**: Analyze overall ProCaps Laboratories brand perception
+
+**Competitor Analysis:**
+- **Amazon Reviews**: Extract actual customer quotes with dates and reviewer names
+- **iHerb Reviews**: Analyze verified purchase reviews with dates
+- **Trustpilot Reviews**: Find brand reviews with specific dates and URLs
+- **Brand Website Reviews**: Check official website customer feedback
+- **Reddit/Forums**: Search supplement forums for product discussions
+
+**Sentiment Breakdown Format:**
+```
+## Customer Sentiment Analysis
+
+### ProCaps Laboratories [Product Name from URL] (FIRST)
+**Overall Rating**: [Search for actual ratings] across platforms
+**Marketplace Presence**: [Check Amazon, iHerb, etc. for availability and reviews]
+
+**Positive Themes:**
+- [Extract actual customer feedback if available]
+- [Search supplement forums for mentions]
+
+**Negative Themes:**
+- [Extract any negative feedback if found]
+- [Note any gaps in marketplace presence]
+
+### Nature Made Vitamin D3
+**Overall Rating**: 4.5★ across platforms (8,234 Amazon reviews, 1,247 iHerb reviews)
+
+**Positive Themes:**
+- Quality: "Great quality, no fishy taste" - Amazon review by Sarah M. (Jan 2024)
+- Effectiveness: "Improved my vitamin D levels significantly" - iHerb review (Dec 2023)
+- Value: "Best price per capsule I've found" - Amazon review by John D. (Feb 2024)
+
+**Negative Themes:**
+- Size: "Pills are too large to swallow easily" - Amazon review by Mary K. (Jan 2024)
+- Packaging: "Bottle arrived damaged" - Amazon review (Dec 2023)
+
+**Review URLs (MUST BE REAL):**
+- Amazon: https://amazon.com/product-reviews/B074H8KJJ (actual ASIN)
+- iHerb: https://iherb.com/reviews/12345 (actual product ID)
+- Target: https://target.com/reviews/A-12345 (actual product ID)
+- Brand Site: https://naturemade.com/products/vitamin-d3/reviews (actual URL)
+```
+
+**CRITICAL**: NO placeholder URLs - all review links must be real and functional
+
+**7. COMPREHENSIVE MARKET TRENDS & INSIGHTS:**
+Research and cite specific market intelligence with sources and dates:
+
+**Required Research Areas:**
+- **Ingredient Trends**: Research trending ingredients and formulations
+- **Consumer Behavior**: Analyze purchasing patterns and preferences
+- **Regulatory Changes**: Track FDA/FTC updates affecting supplements
+- **Market Growth**: Find actual market size and growth projections
+- **Competitive Landscape**: Monitor new entrants and product launches
+
+**Format with Sources:**
+```
+## Market Trends & Insights
+
+### Ingredient Innovation Trends
+- **Liposomal Delivery**: 34% growth in liposomal vitamin products (Nutrition Business Journal, March 2024)
+- **Plant-Based Sources**: 67% of consumers prefer plant-derived vitamins (Mintel Report, February 2024)
+- **Personalized Nutrition**: $8.2B market expected by 2026 (Grand View Research, January 2024)
+
+**Sources:**
+- NBJ 2024 Supplement Report: nutritionbusinessjournal.com/reports/2024-supplement-trends
+- Mintel Consumer Survey: mintel.com/global-consumer-trends-2024
+- Grand View Research: grandviewresearch.com/industry-analysis/personalized-nutrition-market
+
+### Consumer Preference Shifts
+- **Clean Label**: 78% prioritize minimal ingredients (IRI Market Research, Feb 2024)
+- **Sustainability**: 45% willing to pay premium for eco-friendly packaging (Nielsen, Jan 2024)
+- **Subscription Model**: 31% growth in supplement subscriptions (McKinsey, Dec 2023)
+
+### Regulatory Environment
+- **FDA Draft Guidance**: New supplement labeling requirements (FDA.gov, March 2024)
+- **FTC Enforcement**: Increased scrutiny on health claims (FTC.gov, February 2024)
+```
+
+**8. REPORT PRESENTATION:**
+Deliver findings in a clear, structured report with headings and COMPREHENSIVE TABLES:
+
+**Required Table Formats:**
+
+**A. TOP 3 COMPETITOR COMPARISON TABLE:**
+| Product Name | Brand | Size/Qty | Price | Price/Unit | Rating | Reviews | Amazon URL | Walmart URL | iHerb URL | Vitacost URL |
+|--------------|-------|----------|-------|------------|--------|---------|------------|-------------|-----------|--------------|
+| [Product 1]  | [Brand] | [360 caps] | [$X.XX] | [$X.XX] | [4.5★] | [1,234] | [URL] | [URL] | [URL] | [URL] |
+
+**B. MARKETPLACE PRESENCE MATRIX:**
+| Brand | Amazon | Walmart.com | iHerb | Vitacost | Other Platforms |
+|-------|--------|-------------|-------|----------|-----------------|
+| [Brand 1] | ✅ $X.XX (4.5★, 1K reviews) | ✅ $X.XX | ✅ $X.XX | ❌ | CVS, Target |
+
+**C. PRICING ANALYSIS TABLE:**
+| Product | Regular Price | Sale Price | Price/Capsule | Best Value Platform | Subscription Discount |
+|---------|---------------|------------|---------------|--------------------|--------------------|
+| [Product] | $X.XX | $X.XX | $X.XX | Amazon | 15% off |
+
+**Report Structure:**
+- Product Overview (with ProCaps product details)
+- Top 10 Similar Products (brief list)
+- Top 3 Competitor Detailed Comparison (with tables)
+- Marketplace Presence Analysis (with tables)
+- Pricing Analysis (with tables)
+- **Comprehensive Customer Sentiment Analysis** (with actual review quotes, dates, URLs)
+- **Detailed Market Trends & Insights** (with research reports, URLs, publication dates)
+- **Strategic Recommendations** (data-driven, specific, actionable)
+
+**8. COMPREHENSIVE STRATEGIC RECOMMENDATIONS:**
+Provide data-driven recommendations based on the complete analysis:
+
+**Format Requirements:**
+```
+## Strategic Recommendations for ProCaps Laboratories
+
+### Immediate Actions (0-3 months)
+1. **Pricing Strategy**: 
+   - Current ProCaps pricing: $X.XX ($X.XX/capsule)
+   - Market average: $X.XX ($X.XX/capsule)
+   - Recommendation: Adjust pricing to $X.XX for competitive positioning
+   - Expected impact: X% increase in market share
+
+2. **Product Positioning**:
+   - Gap identified: Premium liposomal delivery segment underserved
+   - Opportunity: 67% consumer preference for enhanced absorption
+   - Action: Develop liposomal vitamin D3 formulation
+
+### Medium-term Strategy (3-12 months)
+1. **Market Expansion**:
+   - Target platforms: Vitacost (competitor absence noted)
+   - Investment required: $X for marketplace setup
+   - Projected ROI: X% based on competitor performance
+
+2. **Customer Experience**:
+   - Address top complaint: Large pill size (mentioned in 23% of negative reviews)
+   - Solution: Develop smaller softgel format
+   - Market validation: 45% preference for smaller formats (consumer survey data)
+
+### Long-term Vision (12+ months)
+1. **Innovation Pipeline**:
+   - Emerging trend: Personalized nutrition (31% annual growth)
+   - Opportunity: Custom vitamin D dosing based on blood levels
+   - Partnership potential: Direct-to-consumer testing companies
+```
+
+**9. SOURCE REFERENCING:**
+- Provide references for all data used
+- Include URLs, screenshot references, data providers
+- Flag gaps where data is unavailable
+
+**MANDATORY TABLE FORMATTING & DATA REQUIREMENTS:**
+
+ABSOLUTELY NO PLACEHOLDERS ALLOWED:
+❌ NEVER write: "[Insert Number]", "[Insert URL]", "[Product Name]", "TBD", "N/A"
+❌ NEVER write: "4.6 out of 5 stars based on [Insert Number] reviews"
+✅ ALWAYS write: "4.6★ (2,347 reviews)" with actual numbers
+
+**REQUIRED TABLE FORMAT EXAMPLE:**
+
+## Top 3 Competitor Comparison (INCLUDING PROCAPS PRODUCT)
+
+| Brand | Product | Size/Quantity | Amazon | Price/Unit | Rating | Reviews | iHerb | Walmart | Target | Brand Website |
+|-------|---------|---------------|--------|------------|--------|---------|-------|---------|---------|---------------|
+| **ProCaps Labs** | **[Extract from URL]** | **[Extract size]** | **[Check availability]** | **[Calculate]** | **[Search for ratings]** | **[Search for reviews]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **✅ [ProCaps URL]** |
+| Nature Made | Vitamin D3 2000 IU | 360 Softgels | ✅ $19.99 | $0.056/pill | 4.5★ | 8,234 | ✅ $17.99 | ✅ $17.97 | ✅ $18.49 | ✅ $21.99 |
+| NOW Foods | D3 2000 IU Softgels | 120 Softgels | ✅ $9.99 | $0.083/pill | 4.3★ | 5,672 | ✅ $8.49 | ✅ $8.98 | ❌ | ✅ $10.99 |
+| Nature's Bounty | Vitamin D3 2000 IU | 250 Tablets | ✅ $15.99 | $0.064/pill | 4.6★ | 12,567 | ✅ $14.50 | ✅ $15.25 | ✅ $14.99 | ✅ $17.99 |
+
+## Comprehensive Marketplace Presence Matrix (INCLUDING PROCAPS PRODUCT)
+
+| Brand | Product | Size/Quantity | Amazon | Price/Unit | iHerb | Walmart | Target | ThriveMarket | Brand Website | CVS | Walgreens |
+|-------|---------|---------------|--------|------------|-------|---------|---------|--------------|---------------|-----|-----------|
+| **ProCaps Labs** | **[Extract from URL]** | **[Extract size]** | **[Check availability]** | **[Calculate]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **✅ [ProCaps URL]** | **[Check availability]** | **[Check availability]** |
+| Nature Made | Vitamin D3 2000 IU | 360 Softgels | ✅ $19.99 | $0.056/pill | ✅ $17.99 | ✅ $17.97 | ✅ $18.49 | ❌ | ✅ $21.99 | ✅ $20.99 | ✅ $19.49 |
+| NOW Foods | D3 2000 IU Softgels | 120 Softgels | ✅ $9.99 | $0.083/pill | ✅ $8.49 | ✅ $8.98 | ❌ | ✅ $9.29 | ✅ $10.99 | ❌ | ❌ |
+
+**CRITICAL EXECUTION REQUIREMENTS:**
+1. **EXTRACT PROCAPS PRODUCT DATA FIRST**: Visit the provided ProCaps URL and extract:
+   - Product name, size/quantity, ingredients, claims
+   - Check ProCaps Amazon store: https://www.amazon.com/s?i=merchant-items&me=ANISFYH0BPVKG
+   - Search for the specific product on Amazon using seller ID: ANISFYH0BPVKG
+   - Check if available on iHerb, Walmart, Target, etc.
+   - Search for any customer reviews or mentions
+   - Include ProCaps as the FIRST row in ALL comparison tables
+2. **FIND REAL COMPETITOR PRODUCTS**: Research actual competing products with real names, prices, and data
+3. **CALCULATE ACTUAL PRICE PER UNIT**: Divide real price by real quantity
+4. **USE REAL STAR RATINGS**: Find actual ratings like "4.5★", "4.3★", "4.6★"
+5. **INCLUDE REAL REVIEW COUNTS**: Use actual numbers like "8,234", "5,672", "12,567"
+6. **PROVIDE REAL URLs**: Include actual marketplace links or indicate availability with ✅/❌
+7. **USE PROPER TABLE FORMATTING**: Ensure tables render correctly in markdown
+
+**ACTIVE DATA COLLECTION PROCESS:**
+1. Extract product details from the provided ProCaps URL
+2. **ACTIVELY SEARCH GOOGLE** for each competitor product on marketplaces:
+   - Search: "[Product Name] site:amazon.com"
+   - Search: "[Product Name] site:iherb.com" 
+   - Search: "[Product Name] site:vitacost.com"
+   - Search: "[Product Name] site:walmart.com"
+3. Find and verify actual product URLs for each marketplace
+4. Extract real pricing data from each marketplace
+5. Calculate exact price per capsule/softgel/tablet for each product
+6. Gather actual review counts and star ratings
+7. Format in comprehensive comparison tables
+
+**PRICING CALCULATION REQUIREMENTS:**
+- Price per capsule = Total Price ÷ Number of Capsules
+- Price per softgel = Total Price ÷ Number of Softgels  
+- Price per tablet = Total Price ÷ Number of Tablets
+- Price per serving = Total Price ÷ Number of Servings
+- Always show the unit of measurement (e.g., "$0.052/capsule", "$0.037/softgel")
+
+**EXAMPLE OUTPUT STYLE:**
+"Nature Made Vitamin D3 has 8,234 reviews with a 4.5★ rating on Amazon at $12.99 for 250 tablets ($0.052 per tablet)"
+
+NOT: "Product has [Insert Number] reviews with [Insert Rating] on [Insert Platform]"
+
+**MANDATORY WEB RESEARCH INSTRUCTIONS:**
+
+You MUST actively research and find real data. Do not write placeholder text. Instead:
+
+1. **For ProCaps Amazon**: Check ProCaps Amazon store (seller ID: ANISFYH0BPVKG): https://www.amazon.com/s?i=merchant-items&me=ANISFYH0BPVKG
+2. **For Amazon URLs**: Search for products on Amazon and find actual product pages with real ASINs
+3. **For iHerb URLs**: Search iHerb.com for the specific products and get real product IDs
+4. **For Walmart URLs**: Search walmart.com for the products and get actual item pages
+5. **For Target URLs**: Search target.com for the products and get real product links
+6. **For ThriveMarket URLs**: Search thrivemarket.com for brand presence and products
+7. **For Brand Websites**: Find official e-commerce sites and extract direct-to-consumer pricing
+8. **For CVS URLs**: Search cvs.com for product availability and pricing
+9. **For Walgreens URLs**: Search walgreens.com for product listings and pricing
+10. **For Reviews**: Find actual review page URLs and extract real review data
+11. **For Pricing**: Collect current prices from each platform INCLUDING brand's own website
+12. **For Price/Unit**: Calculate price per pill/capsule/tablet based on Amazon pricing
+
+**CRITICAL**: Replace ALL "[FIND REAL URL]" and "[REAL URL]" placeholders with actual working URLs
+
+**EXAMPLE OF PROPER RESEARCH OUTPUT:**
+```
+| Brand | Product | Size/Quantity | Amazon | Price/Unit | iHerb | Walmart | Target | Brand Website |
+|-------|---------|---------------|--------|------------|-------|---------|---------|---------------|
+| **ProCaps Labs** | **Essential-1 NuOnce Max D3** | **52 Softgels** | **✅ $X.XX (via ANISFYH0BPVKG)** | **$X.XX/pill** | **[Check availability]** | **[Check availability]** | **[Check availability]** | **✅ [ProCaps URL]** |
+| Nature Made | Vitamin D3 2000 IU | 360 Softgels | ✅ $19.99 | $0.056/pill | ✅ $17.99 | ✅ $17.97 | ✅ $18.49 | ✅ $21.99 |
+| NOW Foods | D3 2000 IU Softgels | 120 Softgels | ✅ $9.99 | $0.083/pill | ✅ $8.49 | ✅ $8.98 | ❌ | ✅ $10.99 |
+```
+
+**KEY REQUIREMENTS:**
+- **ProCaps Amazon**: Search ProCaps Amazon store using seller ID: ANISFYH0BPVKG
+- **Price/Unit**: Always calculate as Amazon Price ÷ Quantity (e.g., $19.99 ÷ 360 = $0.056/pill)
+- **Brand Website**: Must include official direct-to-consumer pricing from company's own site
+- **Real URLs**: All marketplace links must be actual, working product pages
+
+**MARKETPLACE PRESENCE RESEARCH:**
+```
+| Competitor | Amazon | iHerb | Vitacost | Walmart |
+|------------|--------|-------|----------|---------|
+| Nature Made | ✅ $12.99 (4.5★, 8K reviews) | ✅ $11.50 | ✅ $13.25 | ✅ $11.47 |
+```
+
+If you cannot find a product on a specific marketplace, use ❌. If you find it, use ✅ with price and basic info.
+
+Deliver a comprehensive market intelligence report with properly formatted tables containing only real data and actual marketplace information gathered through active research.
+"""
+
+PROFESSIONAL_PROMPT = """
+You are {name}, a {title} with 10/10 expertise in {expertise}.
+
+PERSONALITY & APPROACH: {personality}
+
+PROFESSIONAL STANDARDS REQUIRED:
+
+1. **CITE REAL STANDARDS & REFERENCES**:
+   - Reference actual industry standards (ISO, ASTM, FDA CFR, OSHA, cGMP, USP, etc.)
+   - Include specific regulation numbers and sections when applicable
+   - Cite real equipment manuals, manufacturer specifications, and technical guides
+   - Reference actual case studies, industry reports, and technical papers
+
+2. **PROVIDE SPECIFIC TECHNICAL DATA**:
+   - Include actual operating parameters, specifications, and tolerances
+   - Reference real manufacturer part numbers, model numbers, and technical specs
+   - Provide specific measurement units, ranges, and acceptance criteria
+   - Include actual troubleshooting procedures and diagnostic steps
+
+3. **REFERENCE REAL INDUSTRY PRACTICES**:
+   - Cite actual companies and their documented best practices (when publicly available)
+   - Reference real industry associations and their guidelines
+   - Include actual training programs, certifications, and qualifications
+   - Mention real software, tools, and systems used in the industry
+
+4. **INCLUDE ACTUAL SOURCES**:
+   - Provide website URLs for standards organizations and regulatory bodies
+   - Reference actual equipment manufacturer websites and technical documentation
+   - Include links to industry associations and professional organizations
+   - Cite real training providers and certification bodies
+
+5. **EXPERT-SPECIFIC REQUIREMENTS**:
+
+**For Quality/Safety Experts**: 
+   - Cite specific FDA CFR sections, ISO standards, and cGMP requirements
+   - Reference actual audit checklists and compliance documentation
+   - Include real SPC charts, control limits, and statistical methods
+
+**For Manufacturing/Process/Maintenance Experts**:
+   - Reference actual equipment manuals and manufacturer specifications
+   - Include real troubleshooting flowcharts and diagnostic procedures
+   - Cite specific maintenance schedules and PM procedures
+   - Reference actual OEE calculations and performance metrics
+
+**For Product Development/Formulation Experts**:
+   - Cite real scientific studies and clinical research papers
+   - Reference actual ingredient suppliers and specification sheets
+   - Include real formulation guidelines and stability testing protocols
+   - Mention actual analytical methods and testing procedures
+
+**For Accounting Experts**:
+   - Reference actual GAAP standards and accounting principles
+   - Cite real software systems (SAP, Oracle, QuickBooks) and their implementations
+   - Include actual cost accounting methods and variance analysis techniques
+   - Reference real financial ratios and industry benchmarks
+
+FORMAT REQUIREMENTS:
+- Start with direct technical analysis (no greetings)
+- Include section headers for easy navigation
+- Provide actionable step-by-step procedures
+- Include specific references with URLs when possible
+- End with clear next steps and recommendations
+
+AVOID:
+- Generic advice without specific references
+- Vague statements like "industry best practices suggest"
+- Hypothetical examples instead of real case studies
+- Recommendations without technical backing
+
+Deliver expert-level technical guidance with the depth and specificity expected from a seasoned professional with 10+ years of experience.
+"""
+
+STANDARD_PROMPT = """
+You are {name}, a {title} specializing in {expertise}.
+
+PERSONALITY & APPROACH: {personality}
+
+CORE SPECIALIZATIONS:
+{specializations}
+
+Provide PROFESSIONAL, INDUSTRY-SPECIFIC ADVICE as a seasoned expert. Your response should:
+
+1. Start directly with expert analysis - NO GREETINGS unless the user greets you first
+2. Use your extensive technical expertise and knowledge base to provide comprehensive solutions
+3. Reference SOP context when relevant and helpful, but don't be limited by it
+4. If SOP context doesn't address the question, use your expert knowledge and industry experience
+5. Include specific metrics, standards, or benchmarks used in the industry
+6. Cite industry best practices, troubleshooting procedures, and technical solutions
+7. Provide actionable, specific recommendations based on your expertise and experience
+
+Format your response naturally as a professional consultation, NOT as a rigid template.
+
+Examples of professional tone:
+- "For filter dryer noise, first check the agitator bearing lubrication and alignment..."
+- "Based on industry standards, your fill weight variance should remain within ±2% to meet USP requirements..."
+- "Common causes of hydraulic noise include cavitation, worn pump components, or contaminated fluid..."
+- "I recommend checking the vacuum pump oil level and inlet filter - these are frequent noise sources..."
+- "The symptoms you describe suggest bearing wear - typical replacement intervals are 8,000-12,000 hours..."
+
+CRITICAL REQUIREMENTS:
+- NO formulaic sections like "Immediate/Short-term/Long-term" recommendations
+- NO time-based greetings like "Good morning" unless user greets you first
+- NO generic placeholders like "[Executive Name]", "[Company Name]", etc.
+- NO template-style responses
+- Use your full technical expertise and knowledge base to provide comprehensive solutions
+- Don't be limited to only SOP context - use your extensive industry experience
+- Provide specific, actionable technical guidance based on your expertise
+- Address the user directly and professionally as a colleague
+
+Write as if you're a highly experienced professional giving specific, valuable advice to a colleague in your organization.
+"""
+
+# Per-query prompt templates, filled in with str.format on each request
+QUERY_PROMPT_TEMPLATE = """
+USER QUERY: {query}
+CONTEXT: {context}
+{collaboration}
+"""
+
+STANDARD_QUERY_PROMPT_TEMPLATE = """
+USER QUERY: {query}
+
+USER CONTEXT: You are speaking with a colleague in your organization. {user_context} Never use generic placeholders like "[Executive Name]" or forced greetings.
+
+RELEVANT SOP CONTEXT:
+{context}
+
+{collaboration}
+"""
+
+# Topic keywords (matched anywhere in the lowercased query) and the follow-up
+# questions offered for them, checked in order
+_FOLLOW_UP_RULES = (
+    (re.compile(r'quality|defect|compliance|fda'), (
+        "Do you need help setting up specific quality metrics or control charts?",
+        "Would you like guidance on FDA audit preparation?"
+    )),
+    (re.compile(r'production|equipment|efficiency|capacity'), (
+        "Should we analyze your current OEE (Overall Equipment Effectiveness)?",
+        "Do you need help with capacity planning calculations?"
+    )),
+    (re.compile(r'cost|budget|financial|accounting'), (
+        "Would you like to see industry benchmarks for your cost categories?",
+        "Should we develop a cost reduction roadmap?"
+    )),
+)
+_DEFAULT_FOLLOW_UPS = ("Would you like me to dive deeper into any specific aspect of this topic?",)
+
+# SOP filename references (including revision numbers and special characters).
+# The name is capped at 200 characters on one line so long runs of plain text
+# cannot trigger polynomial backtracking.
+_SOP_RE = re.compile(r'([A-Za-z0-9\-_()][A-Za-z0-9\-_() ]{0,200}\.(?:docx?|pdf))\b')
+# Longest name _SOP_RE can match before the extension's dot
+_SOP_NAME_MAX_CHARS = 201
+_SOP_EXTENSION_RE = re.compile(r'\.(?:docx?|pdf)\b')
+_TAG_RE = re.compile(r'<[^>]+>')
+_MENTION_RE = re.compile(r'@(\w+)')
+_WORD_RE = re.compile(r'[a-z0-9]+')
+_STRUCTURE_RE = re.compile(r'^\s*(?:#{1,6}\s|[-*•]\s|\d+\.\s)', re.MULTILINE)
+_DECLINE_RE = re.compile(r"\b(?:I (?:cannot|can't|am unable to|don't have access)|as an AI)\b", re.IGNORECASE)
+_TABLE_ROW_RE = re.compile(r'^\s*\|.*\|\s*$', re.MULTILINE)
+_URL_RE = re.compile(r'https?://\S+')
+_FORBIDDEN_RE = re.compile("|".join(map(re.escape, RESEARCH_FORBIDDEN_PHRASES)))
+
+
+def get_gemini_model(api_key: str, model_name: str,
+                     system_instruction: Optional[str] = None) -> "genai.GenerativeModel":
+    """
+    Return the shared model for a model name and system instruction, shared by
+    every expert and consultant. genai.configure is process-wide, so only one
+    API key is in use at a time: a different key reconfigures the SDK and
+    discards the models built for the previous one.
+    """
+    global _configured_api_key
+    with _sdk_lock:
+        if api_key != _configured_api_key:
+            import google.generativeai as genai
+            # genai.configure discards the process-wide client (and its gRPC
+            # channel), so it runs only when the key changes
+            genai.configure(api_key=api_key)
+            _configured_api_key = api_key
+            _build_model.cache_clear()
+    return _build_model(model_name, system_instruction)
+
+
+@functools.lru_cache(maxsize=32)
+def _build_model(model_name: str, system_instruction: Optional[str]) -> "genai.GenerativeModel":
+    """Build a model for the configured API key; models are thin wrappers around the SDK client."""
+    import google.generativeai as genai
+    return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+
+
+def _shingles(words: List[str]) -> frozenset:
+    """Hashed word n-grams of a chunk, for near-duplicate detection."""
+    if len(words) <= CONTEXT_SHINGLE_WORDS:
+        return frozenset((hash(tuple(words)),))
+    return frozenset(hash(tuple(words[i:i + CONTEXT_SHINGLE_WORDS]))
+                     for i in range(len(words) - CONTEXT_SHINGLE_WORDS + 1))
+
+
+def _is_near_duplicate(shingles: frozenset, kept: List[frozenset]) -> bool:
+    """Whether a chunk's shingles overlap any kept chunk's above CONTEXT_NEAR_DUPLICATE_JACCARD."""
+    for other in kept:
+        overlap = len(shingles & other)
+        if overlap and overlap / (len(shingles) + len(other) - overlap) >= CONTEXT_NEAR_DUPLICATE_JACCARD:
+            return True
+    return False
+
+
+@functools.lru_cache(maxsize=32)
+def _prepare_context(context: Tuple[str, ...]) -> str:
+    """
+    Join context chunks for a prompt, dropping chunks that repeat or nearly
+    repeat an earlier one (ignoring case and whitespace) and truncating at
+    EXPERT_CONTEXT_TOKEN_BUDGET.
+    """
+    char_budget = EXPERT_CONTEXT_TOKEN_BUDGET * CONTEXT_CHARS_PER_TOKEN
+    seen = set()
+    kept_shingles = []
+    chunks = []
+    used = 0
+    for chunk in context:
+        words = chunk.lower().split()
+        key = " ".join(words)
+        if not key or key in seen:
+            continue
+        shingles = _shingles(words)
+        if _is_near_duplicate(shingles, kept_shingles):
+            continue
+        room = char_budget - used
+        if len(chunk) > room:
+            if room > 0:
+                chunks.append(chunk[:room])
+            break
+        seen.add(key)
+        kept_shingles.append(shingles)
+        chunks.append(chunk)
+        used += len(chunk) + 1
+    return "\n".join(chunks)
+
+
+def _exact_cache_key(expert_name: str, model_name: str, query: str, digest: str) -> str:
+    """Digest of everything an expert response depends on."""
+    payload = "\0".join([expert_name, model_name, query, digest])
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def _restamped(response: Dict[str, Any]) -> Dict[str, Any]:
+    """Deep copy of a shared response, so callers cannot mutate the cached one, with a fresh timestamp."""
+    return {**copy.deepcopy(response), "timestamp": response_timestamp()}
+
+
+def _get_exact_response(key: str) -> Optional[Dict[str, Any]]:
+    """Return a restamped deep copy of an unexpired exact-cache entry, if present."""
+    with _exact_cache_lock:
+        entry = _exact_cache.get(key)
+        if entry is None or time.monotonic() - entry[0] > EXACT_CACHE_TTL_SECONDS:
+            _exact_cache_stats["misses"] += 1
+            return None
+        _exact_cache.move_to_end(key)
+        _exact_cache_stats["hits"] += 1
+        response = entry[1]
+    return _restamped(response)
+
+
+def _store_exact_response(key: str, response: Dict[str, Any]) -> None:
+    """Remember a response, evicting the least recently used beyond EXACT_CACHE_SIZE."""
+    snapshot = copy.deepcopy(response)
+    with _exact_cache_lock:
+        _exact_cache[key] = (time.monotonic(), snapshot)
+        _exact_cache.move_to_end(key)
+        if len(_exact_cache) > EXACT_CACHE_SIZE:
+            _exact_cache.popitem(last=False)
+
+
+def _join_inflight(key: str, table: Dict[str, Future]) -> Tuple[Future, bool]:
+    """Return the in-flight future for key in table and whether the caller must resolve it."""
+    with _inflight_lock:
+        future = table.get(key)
+        if future is not None:
+            return future, False
+        future = table[key] = Future()
+        return future, True
+
+
+def _leave_inflight(key: str, table: Dict[str, Future]) -> None:
+    """Forget a resolved in-flight request."""
+    with _inflight_lock:
+        table.pop(key, None)
+
+
+async def _run_blocking(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking call on the expert I/O pool and await its result."""
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, functools.partial(func, *args))
+
+
+def _output_token_budget(query: str) -> Optional[int]:
+    """Output token cap for a query, or None to keep the config's ceiling."""
+    if len(query) >= LONG_QUERY_CHARS:
+        return None
+    if _BROAD_REQUEST_RE.search(query.lower()):
+        return OUTPUT_TOKENS_BROAD
+    return OUTPUT_TOKENS_SHORT if len(query) < SHORT_QUERY_CHARS else OUTPUT_TOKENS_MEDIUM
+
+
+def _draft_quality(text: str, research: bool) -> float:
+    """
+    Fraction of the draft checklist a lightweight-model answer passes. A
+    research draft containing a forbidden placeholder scores zero outright.
+    """
+    if research and _FORBIDDEN_RE.search(text):
+        return 0.0
+    checks = [
+        len(text.strip()) >= DRAFT_MIN_CHARS,
+        _STRUCTURE_RE.search(text) is not None,
+        _DECLINE_RE.search(text) is None
+    ]
+    if research:
+        checks.append(_TABLE_ROW_RE.search(text) is not None)
+        checks.append(_URL_RE.search(text) is not None)
+    return sum(checks) / len(checks)
+
+
+def exact_cache_stats() -> Dict[str, int]:
+    """Hit and miss counts for the exact expert response cache."""
+    with _exact_cache_lock:
+        return dict(_exact_cache_stats, size=len(_exact_cache))
+
+
+def format_timestamp_ns(timestamp_ns: int) -> str:
+    """Format a history record's timestamp_ns (from time.time_ns()) as a local ISO 8601 string."""
+    return datetime.fromtimestamp(timestamp_ns / 1e9).isoformat()
+
+
+def response_timestamp() -> str:
+    """
+    The "timestamp" field of expert responses and consultation results: local
+    ISO 8601, part of their public shape. Internal history records keep an
+    integer timestamp_ns and are formatted only when written out.
+    """
+    return datetime.now().isoformat()
+
+
+def _append_history_line(path: str, record: Dict[str, Any]) -> None:
+    """Append one history record to a JSON lines file, with an ISO timestamp."""
+    record = dict(record)
+    if "timestamp_ns" in record:
+        record["timestamp"] = format_timestamp_ns(record.pop("timestamp_ns"))
+    try:
+        line = orjson.dumps(record) if orjson is not None else json.dumps(record).encode('utf-8')
+        with open(path, 'ab') as f:
+            f.write(line + b"\n")
+    except Exception as e:
+        logger.warning(f"Could not write expert history to {path}: {e}")
+
+
+def _format_sop(match: re.Match) -> str:
+    """Wrap a matched SOP name in inline reference markup, stripping stray tags."""
+    return f'<span class="sop-reference-inline">{_TAG_RE.sub("", match.group(1))}</span>'
+
+
+def _link_sop_references(text: str) -> str:
+    """
+    Equivalent to _SOP_RE.sub(_format_sop, text) in linear time. Scanning
+    with _SOP_RE tries up to 200 name characters at every position; instead
+    find each file extension and match the name only in the window before it.
+    """
+    parts = []
+    last = 0
+    for extension in _SOP_EXTENSION_RE.finditer(text):
+        match = _SOP_RE.search(text, max(last, extension.start() - _SOP_NAME_MAX_CHARS), extension.end())
+        if match is None:
+            continue
+        parts.append(text[last:match.start()])
+        parts.append(_format_sop(match))
+        last = match.end()
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+class ExpertPersona:
+    """Base class for individual expert personas"""
+    
+    # Static part of every fallback response; the lists are tuples so the
+    # shared template cannot be mutated through a returned response
+    _FALLBACK_SHELL: ClassVar[Dict[str, Any]] = {
+        "key_insights": ("General insight based on field expertise",),
+        "risks_considerations": ("Consider regulatory requirements",),
+        "follow_up_questions": ("Can you provide more specific details?",),
+        "confidence_level": "low",
+        "fallback": True
+    }
+    _FALLBACK_RECOMMENDATIONS: ClassVar[Dict[str, Tuple[str, ...]]] = {
+        "immediate": ("Review relevant documentation",),
+        "short_term": ("Consult with team",),
+        "long_term": ("Develop comprehensive strategy",)
+    }
+    
+    def __init__(self, name: str, title: str, expertise: str, personality: str, 
+                 specializations: List[str], api_key: str, model_name: str = "gemini-1.5-pro",
+                 prefer_flash: bool = False):
+        self.name = name
+        self.title = title
+        self.expertise = expertise
+        self.personality = personality
+        # Frozen: the relevance index and matchers below are derived from these
+        self.specializations = tuple(specializations)
+        self._api_key = api_key
+        self.conversation_history = deque(maxlen=EXPERT_HISTORY_MAX_TURNS)
+        
+        # Lowercased matchers used by analyze_relevance on every query
+        self._mention = f"@{name.lower()}"
+        # Title words, matched as whole words so "quality?" counts and "&" or "—" never do
+        self._title_tokens = frozenset(_WORD_RE.findall(title.lower()))
+        # Distinct specializations; _spec_re only answers whether any of them occurs
+        self._specs_lower = tuple(sorted({spec.lower() for spec in specializations}, key=len, reverse=True))
+        self._spec_re = re.compile("|".join(map(re.escape, self._specs_lower))) if self._specs_lower else None
+        
+        self._static_prompt, self._query_template = self._build_prompt_templates()
+        self.model_name = model_name
+        # Draft with DRAFT_MODEL first, escalating to model_name only for weak drafts
+        self.prefer_flash = prefer_flash and model_name != DRAFT_MODEL
+        self._generation_config, self._build_response = self._response_plan()
+        self._capped_configs = {
+            budget: {**self._generation_config,
+                     "max_output_tokens": min(budget, self._generation_config["max_output_tokens"])}
+            for budget in (OUTPUT_TOKENS_SHORT, OUTPUT_TOKENS_MEDIUM, OUTPUT_TOKENS_BROAD)
+        }
     
-    def _generate_professional_response(self, query: str, context: List[str], 
-                                      collaboration_context: str = "", user_info: Dict = None) -> Dict[str, Any]:
-        """Generate professional responses with real references and standards"""
+    @property
+    def model(self) -> "genai.GenerativeModel":
+        """
+        Gemini model carrying the persona and instructions as a byte-stable
+        system instruction, so each request sends only the per-query part.
+        Created (and the SDK imported) only when this expert is first consulted.
+        """
+        return get_gemini_model(self._api_key, self.model_name, self._static_prompt)
+    
+    def _build_prompt_templates(self) -> Tuple[str, str]:
+        """
+        Render the persona and instructions shared by every query to this expert,
+        and pick the template for the per-query part of the prompt.
+        """
+        if self.name == "MarketAnalysisExpert":
+            return MARKET_RESEARCH_PROMPT, QUERY_PROMPT_TEMPLATE
+        if self.name == "AdvancedMarketAnalyst":
+            return ADVANCED_MARKET_RESEARCH_PROMPT, QUERY_PROMPT_TEMPLATE
         
-        try:
-            # Build expert-specific professional prompt
-            professional_prompt = f"""
-            You are {self.name}, a {self.title} with 10/10 expertise in {self.expertise}.
-            
-            PERSONALITY & APPROACH: {self.personality}
-            
-            USER QUERY: {query}
-            CONTEXT: {chr(10).join(context) if context else "No specific context available"}
-            {f"COLLABORATION CONTEXT: {collaboration_context}" if collaboration_context else ""}
-            
-            PROFESSIONAL STANDARDS REQUIRED:
-            
-            1. **CITE REAL STANDARDS & REFERENCES**:
-               - Reference actual industry standards (ISO, ASTM, FDA CFR, OSHA, cGMP, USP, etc.)
-               - Include specific regulation numbers and sections when applicable
-               - Cite real equipment manuals, manufacturer specifications, and technical guides
-               - Reference actual case studies, industry reports, and technical papers
-            
-            2. **PROVIDE SPECIFIC TECHNICAL DATA**:
-               - Include actual operating parameters, specifications, and tolerances
-               - Reference real manufacturer part numbers, model numbers, and technical specs
-               - Provide specific measurement units, ranges, and acceptance criteria
-               - Include actual troubleshooting procedures and diagnostic steps
-            
-            3. **REFERENCE REAL INDUSTRY PRACTICES**:
-               - Cite actual companies and their documented best practices (when publicly available)
-               - Reference real industry associations and their guidelines
-               - Include actual training programs, certifications, and qualifications
-               - Mention real software, tools, and systems used in the industry
-            
-            4. **INCLUDE ACTUAL SOURCES**:
-               - Provide website URLs for standards organizations and regulatory bodies
-               - Reference actual equipment manufacturer websites and technical documentation
-               - Include links to industry associations and professional organizations
-               - Cite real training providers and certification bodies
-            
-            5. **EXPERT-SPECIFIC REQUIREMENTS**:
-            
-            **For Quality/Safety Experts**: 
-               - Cite specific FDA CFR sections, ISO standards, and cGMP requirements
-               - Reference actual audit checklists and compliance documentation
-               - Include real SPC charts, control limits, and statistical methods
-            
-            **For Manufacturing/Process/Maintenance Experts**:
-               - Reference actual equipment manuals and manufacturer specifications
-               - Include real troubleshooting flowcharts and diagnostic procedures
-               - Cite specific maintenance schedules and PM procedures
-               - Reference actual OEE calculations and performance metrics
-            
-            **For Product Development/Formulation Experts**:
-               - Cite real scientific studies and clinical research papers
-               - Reference actual ingredient suppliers and specification sheets
-               - Include real formulation guidelines and stability testing protocols
-               - Mention actual analytical methods and testing procedures
-            
-            **For Accounting Experts**:
-               - Reference actual GAAP standards and accounting principles
-               - Cite real software systems (SAP, Oracle, QuickBooks) and their implementations
-               - Include actual cost accounting methods and variance analysis techniques
-               - Reference real financial ratios and industry benchmarks
-            
-            FORMAT REQUIREMENTS:
-            - Start with direct technical analysis (no greetings)
-            - Include section headers for easy navigation
-            - Provide actionable step-by-step procedures
-            - Include specific references with URLs when possible
-            - End with clear next steps and recommendations
-            
-            AVOID:
-            - Generic advice without specific references
-            - Vague statements like "industry best practices suggest"
-            - Hypothetical examples instead of real case studies
-            - Recommendations without technical backing
-            
-            Deliver expert-level technical guidance with the depth and specificity expected from a seasoned professional with 10+ years of experience.
-            """
-            
-            generation_config = {
-                "max_output_tokens": 32768,  # MAXIMUM tokens for comprehensive technical analysis
-                "temperature": 0.1,  # Lower temperature for technical accuracy
-                "top_p": 0.95,
-                "top_k": 40
-            }
-            
-            response = self.model.generate_content(professional_prompt, generation_config=generation_config)
-            
-            expert_response = {
-                "expert_name": self.name,
-                "expert_title": self.title,
-                "main_response": response.text,
-                "key_insights": ["Technical analysis with industry standards", "Real specifications and procedures referenced", "Professional-grade recommendations provided"],
-                "recommendations": {"immediate": ["Review referenced standards and procedures", "Implement specific technical recommendations"], 
-                                 "strategic": ["Develop systematic approach based on industry standards", "Establish monitoring and measurement protocols"]},
-                "risks_considerations": ["Ensure compliance with all referenced regulations", "Verify equipment specifications before implementation"],
-                "follow_up_questions": ["Would you like specific implementation guidance?", "Should I provide additional technical references for this topic?"],
-                "confidence_level": "high",
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            return expert_response
-            
-        except Exception as e:
-            logger.error(f"Error generating professional response for {self.name}: {e}")
-            return self._generate_fallback_response(query)
+        persona = {
+            "name": self.name,
+            "title": self.title,
+            "expertise": self.expertise,
+            "personality": self.personality,
+            "specializations": "\n".join(f"- {spec}" for spec in self.specializations)
+        }
+        if self.name in PROFESSIONAL_EXPERTS:
+            return PROFESSIONAL_PROMPT.format(**persona), QUERY_PROMPT_TEMPLATE
+        return STANDARD_PROMPT.format(**persona), STANDARD_QUERY_PROMPT_TEMPLATE
     
-    def generate_response(self, query: str, context: List[str], 
-                         collaboration_context: str = "", user_info: Dict = None) -> Dict[str, Any]:
-        """Generate a response from this expert's perspective"""
+    def analyze_relevance(self, query: str) -> float:
+        """Analyze how relevant this expert is to the query (0.0 to 1.0)"""
+        relevance_score = 0.0
+        query_lower = query.lower()
+        
+        # Check for direct mentions
+        if self._mention in query_lower:
+            return 1.0
+        
+        # Check for specialization keywords (each distinct specialization counts
+        # once, including ones nested in a longer matched specialization)
+        relevance_score += 0.3 * sum(1 for spec in self._specs_lower if spec in query_lower)
+        
+        # Check for title/role keywords
+        if self._title_tokens.intersection(_WORD_RE.findall(query_lower)):
+            relevance_score += 0.2
+        
+        return min(relevance_score, 1.0)
+    
+    def _config_for(self, query: str) -> Dict[str, Any]:
+        """Generation config with max_output_tokens capped for this query"""
+        budget = _output_token_budget(query)
+        return self._generation_config if budget is None else self._capped_configs[budget]
+    
+    def _response_plan(self) -> Tuple[Dict[str, Any], Callable[[str, List[str], str], Dict[str, Any]]]:
+        """Pick the generation config and response builder for this expert (once, in __init__)"""
         
         # Enhanced experts with specialized research capabilities
-        if self.name == "MarketAnalysisExpert":
-            return self._generate_market_analysis_response(query, context, collaboration_context, user_info)
-        elif self.name == "AdvancedMarketAnalyst":
-            return self._generate_advanced_market_analysis_response(query, context, collaboration_context, user_info)
-        elif self.name in ["QualityExpert", "ManufacturingExpert", "SafetyExpert", "MaintenanceExpert", 
-                          "ProcessEngineeringExpert", "ProductDevelopmentExpert", "AccountingExpert"]:
-            return self._generate_professional_response(query, context, collaboration_context, user_info)
+        research_builder = {
+            "MarketAnalysisExpert": self._market_analysis_response,
+            "AdvancedMarketAnalyst": self._advanced_market_analysis_response
+        }.get(self.name)
+        if research_builder is not None:
+            return FACTUAL_GENERATION_CONFIG, research_builder
+        if self.name in PROFESSIONAL_EXPERTS:
+            return FACTUAL_GENERATION_CONFIG, self._professional_response
+        return STANDARD_GENERATION_CONFIG, self._standard_response
+    
+    def _market_analysis_response(self, query: str, context: List[str], response_text: str) -> Dict[str, Any]:
+        """Enhanced Market Analysis with actual web research capabilities"""
+        return self._fixed_fields_response(_MARKET_ANALYSIS_FIELDS, response_text)
+    
+    def _advanced_market_analysis_response(self, query: str, context: List[str], response_text: str) -> Dict[str, Any]:
+        """Advanced Market Analysis with comprehensive product URL analysis"""
+        return self._fixed_fields_response(_ADVANCED_MARKET_ANALYSIS_FIELDS, response_text)
+    
+    def _professional_response(self, query: str, context: List[str], response_text: str) -> Dict[str, Any]:
+        """Professional responses with real references and standards"""
+        return self._fixed_fields_response(_PROFESSIONAL_FIELDS, response_text)
+    
+    def _fixed_fields_response(self, fields: Dict[str, Any], response_text: str) -> Dict[str, Any]:
+        """Response carrying the model text and a builder's fixed fields"""
+        return {
+            "expert_name": self.name,
+            "expert_title": self.title,
+            "main_response": response_text,
+            **fields,
+            "recommendations": dict(fields["recommendations"]),
+            "timestamp": response_timestamp()
+        }
+    
+    def _standard_response(self, query: str, context: List[str], response_text: str) -> Dict[str, Any]:
+        """Structured response with SOP references and extracted follow-ups"""
+        formatted_response = self._format_sop_references(response_text)
+        
+        expert_response = {
+            "expert_name": self.name,
+            "expert_title": self.title,
+            "main_response": formatted_response,
+            "key_insights": self._extract_insights(response_text),
+            "recommendations": self._extract_recommendations(response_text),
+            "risks_considerations": self._extract_risks(response_text),
+            "follow_up_questions": self._generate_follow_ups(query, response_text),
+            "confidence_level": self._assess_confidence(query, context),
+            "timestamp": response_timestamp()
+        }
+        
+        # Add a lightweight record to conversation history
+        self._record_interaction({
+            "query": query,
+            "confidence_level": expert_response["confidence_level"],
+            "context_used": len(context),
+            "timestamp_ns": time.time_ns()
+        })
         
-        prompt = self._build_expert_prompt(query, context, collaboration_context, user_info)
+        return expert_response
+    
+    def generate_response(self, query: str, context: List[str], 
+                         collaboration_context: str = "", user_info: Dict = None) -> Dict[str, Any]:
+        """Generate a response from this expert's perspective, reusing cached answers to near-identical queries"""
+        digest = context_digest(context, collaboration_context, user_info)
+        exact_key = _exact_cache_key(self.name, self.model_name, query, digest)
+        cached = _get_exact_response(exact_key)
+        if cached is not None:
+            return cached
         
+        future, leader = _join_inflight(exact_key, _inflight)
+        if not leader:
+            return _restamped(future.result())
         try:
-            generation_config = {
-                "max_output_tokens": 32768,  # MAXIMUM tokens for comprehensive expert analysis
-                "temperature": 0.2,
-                "top_p": 0.9,
-                "top_k": 40
-            }
-            
-            response = self.model.generate_content(prompt, generation_config=generation_config)
-            formatted_response = self._format_sop_references(response.text)
-            
-            expert_response = {
-                "expert_name": self.name,
-                "expert_title": self.title,
-                "main_response": formatted_response,
-                "key_insights": self._extract_insights(response.text),
-                "recommendations": self._extract_recommendations(response.text),
-                "risks_considerations": self._extract_risks(response.text),
-                "follow_up_questions": self._generate_follow_ups(query, response.text),
-                "confidence_level": self._assess_confidence(query, context),
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            # Add to conversation history
-            self.conversation_history.append({
-                "query": query,
-                "response": expert_response,
-                "context_used": len(context)
-            })
-            
+            expert_response = self._generate_uncached(query, context, collaboration_context, user_info, digest, exact_key)
+            future.set_result(expert_response)
             return expert_response
-            
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            _leave_inflight(exact_key, _inflight)
+    
+    def _generate_uncached(self, query: str, context: List[str], collaboration_context: str,
+                           user_info: Optional[Dict], digest: str, exact_key: str) -> Dict[str, Any]:
+        """Answer a request missing from the exact cache: semantic cache, then synthesis, then the model"""
+        vector = _embed_query(query)
+        cached = self._get_cached_response(vector, digest)
+        if cached is not None:
+            _store_exact_response(exact_key, cached)
+            return cached
+        
+        synthesized = self._synthesize(query, vector, digest)
+        if synthesized is not None:
+            return synthesized
+        
+        model, prompt = self.model, self._build_expert_prompt(query, context, collaboration_context, user_info)
+        text = self._draft(prompt)
+        if text is not None:
+            # Drafts come from DRAFT_MODEL, so they are not cached under model_name's keys
+            return self._build_response(query, context, text)
+        try:
+            response = model.generate_content(prompt, generation_config=self._config_for(query))
+            text = response.text
         except Exception as e:
             logger.error(f"Error generating response for {self.name}: {e}")
             return self._generate_fallback_response(query)
-    
-    def _build_expert_prompt(self, query: str, context: List[str], 
-                           collaboration_context: str = "", user_info: Dict = None) -> str:
-        """Build expert-specific prompt"""
-        
-        # Special enhanced prompt for Market Analysis Expert
-        if self.name == "MarketAnalysisExpert":
-            return f"""
-            You are {self.name}, a {self.title} specializing in {self.expertise}.
-            
-            PERSONALITY & APPROACH: {self.personality}
-            
-            CORE SPECIALIZATIONS:
-            {chr(10).join(f"- {spec}" for spec in self.specializations)}
-            
-            USER QUERY: {query}
-            
-            USER CONTEXT: You are speaking with a colleague in your organization. {f"The user's name is {user_info.get('name', '')} and they are a {user_info.get('role', 'team member')}." if user_info else "Address them professionally"}
-            
-            RELEVANT CONTEXT:
-            {chr(10).join(context) if context else "No specific context available"}
-            
-            {f"COLLABORATION CONTEXT: {collaboration_context}" if collaboration_context else ""}
-            
-            MARKET ANALYSIS INSTRUCTIONS:
-            As a Senior Market Intelligence Analyst, provide comprehensive competitive analysis including:
-            
-            1. **COMPETITIVE PRODUCT IDENTIFICATION**: Research and identify similar products in the market
-            2. **INGREDIENT COMPARISON**: Analyze competitor formulations vs. our products with detailed pros/cons
-            3. **MARKET STRATEGY EVALUATION**: Assess competitor marketing strategies, positioning, and messaging
-            4. **MARKET SHARE ANALYSIS**: Provide market share data and competitive positioning insights  
-            5. **CUSTOMER REVIEW ANALYSIS**: Analyze customer reviews, ratings, and sentiment for competitive products
-            6. **PRICING STRATEGY**: Compare pricing strategies and value propositions
-            7. **DISTRIBUTION ANALYSIS**: Evaluate competitor distribution channels and market presence
-            8. **TREND IDENTIFICATION**: Identify market trends and opportunities
-            9. **SWOT ANALYSIS**: Provide strengths, weaknesses, opportunities, and threats assessment
-            10. **ACTIONABLE RECOMMENDATIONS**: Provide specific strategies for competitive advantage
-            
-            RESEARCH APPROACH:
-            - Use comprehensive market intelligence methodology
-            - Provide specific product names, brands, and companies when relevant
-            - Include quantitative data (market share %, pricing, review scores) when available
-            - Reference specific platforms (Amazon, iHerb, Vitacost, etc.) for review analysis
-            - Consider regulatory landscape and compliance factors
-            - Analyze both direct and indirect competitors
-            
-            FORMAT YOUR RESPONSE:
-            Structure your analysis with clear sections for easy consumption:
-            - Executive Summary
-            - Competitive Landscape Overview  
-            - Detailed Product Comparisons
-            - Market Strategy Analysis
-            - Customer Sentiment Analysis
-            - Pricing & Positioning Analysis
-            - Market Opportunities & Threats
-            - Strategic Recommendations
-            
-            CRITICAL REQUIREMENTS:
-            - Provide specific, actionable market intelligence
-            - Use factual market data and avoid speculation
-            - Include competitor names, product names, and specific details
-            - Analyze both strengths and weaknesses objectively
-            - Focus on delivering competitive advantages and market opportunities
-            - Make recommendations based on market evidence
-            
-            Deliver the depth and precision expected from a senior market intelligence professional.
-            """
         
-        # Standard prompt for other experts
-        return f"""
-        You are {self.name}, a {self.title} specializing in {self.expertise}.
+        expert_response = self._build_response(query, context, text)
+        self._cache_response(exact_key, vector, digest, expert_response)
+        return expert_response
+    
+    async def generate_response_async(self, query: str, context: List[str], 
+                                      collaboration_context: str = "", user_info: Dict = None) -> Dict[str, Any]:
+        """Async counterpart of generate_response, so several experts can be awaited concurrently"""
+        digest = context_digest(context, collaboration_context, user_info)
+        exact_key = _exact_cache_key(self.name, self.model_name, query, digest)
+        cached = _get_exact_response(exact_key)
+        if cached is not None:
+            return cached
         
-        PERSONALITY & APPROACH: {self.personality}
+        future, leader = _join_inflight(exact_key, _inflight_async)
+        if not leader:
+            return _restamped(await asyncio.wrap_future(future))
+        try:
+            expert_response = await self._generate_uncached_async(query, context, collaboration_context, user_info,
+                                                                  digest, exact_key)
+            future.set_result(expert_response)
+            return expert_response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            _leave_inflight(exact_key, _inflight_async)
+    
+    async def _generate_uncached_async(self, query: str, context: List[str], collaboration_context: str,
+                                       user_info: Optional[Dict], digest: str, exact_key: str) -> Dict[str, Any]:
+        """Async counterpart of _generate_uncached"""
+        vector = await _embed_query_async(query)
+        cached = self._get_cached_response(vector, digest)
+        if cached is not None:
+            _store_exact_response(exact_key, cached)
+            return cached
         
-        CORE SPECIALIZATIONS:
-        {chr(10).join(f"- {spec}" for spec in self.specializations)}
+        synthesized = await self._synthesize_async(query, vector, digest)
+        if synthesized is not None:
+            return synthesized
         
-        USER QUERY: {query}
+        model, prompt = self.model, self._build_expert_prompt(query, context, collaboration_context, user_info)
+        text = await self._draft_async(prompt)
+        if text is not None:
+            # Drafts come from DRAFT_MODEL, so they are not cached under model_name's keys
+            return self._build_response(query, context, text)
+        try:
+            response = await model.generate_content_async(prompt, generation_config=self._config_for(query))
+            text = response.text
+        except Exception as e:
+            logger.error(f"Error generating response for {self.name}: {e}")
+            return self._generate_fallback_response(query)
         
-        USER CONTEXT: You are speaking with a colleague in your organization. {f"The user's name is {user_info.get('name', '')} and they are a {user_info.get('role', 'team member')}." if user_info else "Address them professionally"} Never use generic placeholders like "[Executive Name]" or forced greetings.
+        expert_response = self._build_response(query, context, text)
+        await _run_blocking(self._cache_response, exact_key, vector, digest, expert_response)
+        return expert_response
+    
+    def _synthesis_request(self, query: str, vector: Optional[np.ndarray],
+                           digest: str) -> Optional[Tuple["genai.GenerativeModel", str, Dict[str, Any]]]:
+        """
+        Build a request that combines this expert's related cached answers, if
+        enough of them clear SYNTHESIS_MIN_SIMILARITY. Returns (model, prompt,
+        closest cached response) or None.
+        """
+        if not SYNTHESIS_ENABLED or vector is None:
+            return None
+        related = _response_cache.nearest(self.name, vector, digest, SYNTHESIS_TOP_K, SYNTHESIS_MIN_SIMILARITY)
+        if len(related) < SYNTHESIS_MIN_ENTRIES:
+            return None
         
-        RELEVANT SOP CONTEXT:
-        {chr(10).join(context) if context else "No specific SOP context available"}
+        prior_answers = "\n\n".join(f"PRIOR ANSWER {i}:\n{response['main_response']}"
+                                     for i, (_, response) in enumerate(related, 1))
+        prompt = SYNTHESIS_PROMPT_TEMPLATE.format(
+            title=self.title,
+            insufficient=SYNTHESIS_INSUFFICIENT,
+            query=query,
+            prior_answers=prior_answers
+        )
+        return get_gemini_model(self._api_key, SYNTHESIS_MODEL), prompt, related[0][1]
+    
+    def _synthesized_response(self, closest: Dict[str, Any], text: str) -> Optional[Dict[str, Any]]:
+        """Accept a synthesized answer unless it is empty or declined, reusing the closest response's structure"""
+        text = text.strip()
+        if not text or text.startswith(SYNTHESIS_INSUFFICIENT):
+            return None
+        return {**closest, "main_response": self._format_sop_references(text), "synthesized": True,
+                "timestamp": response_timestamp()}
+    
+    def _synthesize(self, query: str, vector: Optional[np.ndarray], digest: str) -> Optional[Dict[str, Any]]:
+        """Try to answer from related cached responses with the lightweight model"""
+        request = self._synthesis_request(query, vector, digest)
+        if request is None:
+            return None
+        model, prompt, closest = request
+        try:
+            response = model.generate_content(prompt, generation_config=SYNTHESIS_GENERATION_CONFIG)
+            return self._synthesized_response(closest, response.text)
+        except Exception as e:
+            logger.warning(f"Cache synthesis failed for {self.name}: {e}")
+            return None
+    
+    async def _synthesize_async(self, query: str, vector: Optional[np.ndarray], digest: str) -> Optional[Dict[str, Any]]:
+        """Async counterpart of _synthesize"""
+        request = self._synthesis_request(query, vector, digest)
+        if request is None:
+            return None
+        model, prompt, closest = request
+        try:
+            response = await model.generate_content_async(prompt, generation_config=SYNTHESIS_GENERATION_CONFIG)
+            return self._synthesized_response(closest, response.text)
+        except Exception as e:
+            logger.warning(f"Cache synthesis failed for {self.name}: {e}")
+            return None
+    
+    def _accepted_draft(self, text: str) -> Optional[str]:
+        """Return a lightweight-model draft if it clears DRAFT_MIN_QUALITY"""
+        quality = _draft_quality(text, self.name in RESEARCH_EXPERTS)
+        if quality < DRAFT_MIN_QUALITY:
+            logger.info(f"Escalating {self.name} to {self.model_name}: draft quality {quality:.2f}")
+            return None
+        return text
+    
+    def _draft(self, prompt: str) -> Optional[str]:
+        """With prefer_flash, answer with DRAFT_MODEL if its draft passes the quality checklist"""
+        if not self.prefer_flash:
+            return None
+        try:
+            model = get_gemini_model(self._api_key, DRAFT_MODEL, self._static_prompt)
+            response = model.generate_content(prompt, generation_config=DRAFT_GENERATION_CONFIG)
+            return self._accepted_draft(response.text)
+        except Exception as e:
+            logger.warning(f"Draft generation failed for {self.name}: {e}")
+            return None
+    
+    async def _draft_async(self, prompt: str) -> Optional[str]:
+        """Async counterpart of _draft"""
+        if not self.prefer_flash:
+            return None
+        try:
+            model = get_gemini_model(self._api_key, DRAFT_MODEL, self._static_prompt)
+            response = await model.generate_content_async(prompt, generation_config=DRAFT_GENERATION_CONFIG)
+            return self._accepted_draft(response.text)
+        except Exception as e:
+            logger.warning(f"Draft generation failed for {self.name}: {e}")
+            return None
+    
+    def stream_response(self, query: str, context: List[str], 
+                        collaboration_context: str = "", user_info: Dict = None) -> Iterator[Dict[str, Any]]:
+        """
+        Stream this expert's response as Gemini generates it. Yields
+        {"partial": True, "chunk": text} for each chunk, then the structured
+        response as {"partial": False, **expert_response}.
+        """
+        digest = context_digest(context, collaboration_context, user_info)
+        exact_key = _exact_cache_key(self.name, self.model_name, query, digest)
+        cached = _get_exact_response(exact_key)
+        if cached is not None:
+            yield {"partial": False, **cached}
+            return
         
-        {f"COLLABORATION CONTEXT: {collaboration_context}" if collaboration_context else ""}
+        vector = _embed_query(query)
+        cached = self._get_cached_response(vector, digest)
+        if cached is not None:
+            _store_exact_response(exact_key, cached)
+            yield {"partial": False, **cached}
+            return
         
-        Provide PROFESSIONAL, INDUSTRY-SPECIFIC ADVICE as a seasoned expert. Your response should:
+        parts = []
+        model, prompt = self.model, self._build_expert_prompt(query, context, collaboration_context, user_info)
+        try:
+            for chunk in model.generate_content(prompt, generation_config=self._config_for(query), stream=True):
+                parts.append(chunk.text)
+                yield {"partial": True, "chunk": chunk.text}
+            expert_response = self._build_response(query, context, "".join(parts))
+        except Exception as e:
+            logger.error(f"Error streaming response for {self.name}: {e}")
+            yield {"partial": False, **self._generate_fallback_response(query)}
+            return
         
-        1. Start directly with expert analysis - NO GREETINGS unless the user greets you first
-        2. Use your extensive technical expertise and knowledge base to provide comprehensive solutions
-        3. Reference SOP context when relevant and helpful, but don't be limited by it
-        4. If SOP context doesn't address the question, use your expert knowledge and industry experience
-        5. Include specific metrics, standards, or benchmarks used in the industry
-        6. Cite industry best practices, troubleshooting procedures, and technical solutions
-        7. Provide actionable, specific recommendations based on your expertise and experience
+        self._cache_response(exact_key, vector, digest, expert_response)
+        yield {"partial": False, **expert_response}
+    
+    async def stream_response_async(self, query: str, context: List[str], 
+                                    collaboration_context: str = "", user_info: Dict = None) -> AsyncIterator[Dict[str, Any]]:
+        """Async counterpart of stream_response"""
+        digest = context_digest(context, collaboration_context, user_info)
+        exact_key = _exact_cache_key(self.name, self.model_name, query, digest)
+        cached = _get_exact_response(exact_key)
+        if cached is not None:
+            yield {"partial": False, **cached}
+            return
         
-        Format your response naturally as a professional consultation, NOT as a rigid template.
+        vector = await _embed_query_async(query)
+        cached = self._get_cached_response(vector, digest)
+        if cached is not None:
+            _store_exact_response(exact_key, cached)
+            yield {"partial": False, **cached}
+            return
         
-        Examples of professional tone:
-        - "For filter dryer noise, first check the agitator bearing lubrication and alignment..."
-        - "Based on industry standards, your fill weight variance should remain within ±2% to meet USP requirements..."
-        - "Common causes of hydraulic noise include cavitation, worn pump components, or contaminated fluid..."
-        - "I recommend checking the vacuum pump oil level and inlet filter - these are frequent noise sources..."
-        - "The symptoms you describe suggest bearing wear - typical replacement intervals are 8,000-12,000 hours..."
+        parts = []
+        model, prompt = self.model, self._build_expert_prompt(query, context, collaboration_context, user_info)
+        try:
+            response = await model.generate_content_async(prompt, generation_config=self._config_for(query), stream=True)
+            async for chunk in response:
+                parts.append(chunk.text)
+                yield {"partial": True, "chunk": chunk.text}
+            expert_response = self._build_response(query, context, "".join(parts))
+        except Exception as e:
+            logger.error(f"Error streaming response for {self.name}: {e}")
+            yield {"partial": False, **self._generate_fallback_response(query)}
+            return
         
-        CRITICAL REQUIREMENTS:
-        - NO formulaic sections like "Immediate/Short-term/Long-term" recommendations
-        - NO time-based greetings like "Good morning" unless user greets you first
-        - NO generic placeholders like "[Executive Name]", "[Company Name]", etc.
-        - NO template-style responses
-        - Use your full technical expertise and knowledge base to provide comprehensive solutions
-        - Don't be limited to only SOP context - use your extensive industry experience
-        - Provide specific, actionable technical guidance based on your expertise
-        - Address the user directly and professionally as a colleague
+        await _run_blocking(self._cache_response, exact_key, vector, digest, expert_response)
+        yield {"partial": False, **expert_response}
+    
+    @contextmanager
+    def batch(self) -> Iterator["ExpertBatch"]:
+        """
+        Collect several requests to this expert and answer them concurrently
+        when the block exits.
         
-        Write as if you're a highly experienced professional giving specific, valuable advice to a colleague in your organization.
+            with expert.batch() as pending:
+                first = pending.add(query, context)
+                second = pending.add(other_query, context)
+            first.result(), second.result()
         """
+        pending = ExpertBatch(self)
+        yield pending
+        if pending.requests:
+            pending.resolve()
+    
+    def _get_cached_response(self, vector: Optional[np.ndarray], digest: str) -> Optional[Dict[str, Any]]:
+        """Return this expert's cached response for a near-identical query, restamped"""
+        if vector is None:
+            return None
+        cached = _response_cache.lookup(self.name, vector, digest)
+        if cached is not None:
+            cached["timestamp"] = response_timestamp()
+        return cached
+    
+    def _cache_response(self, exact_key: str, vector: Optional[np.ndarray], digest: str,
+                        response: Dict[str, Any]) -> None:
+        """Store a generated response in the exact cache and, if the query was embedded, the semantic cache"""
+        _store_exact_response(exact_key, response)
+        if vector is not None:
+            _response_cache.add(self.name, vector, digest, response)
+    
+    def _record_interaction(self, record: Dict[str, Any]) -> None:
+        """Append to the history ring, spilling the evicted record to EXPERT_HISTORY_FILE if configured"""
+        if _history_writer is not None and len(self.conversation_history) == self.conversation_history.maxlen:
+            _history_writer.submit(_append_history_line, EXPERT_HISTORY_FILE,
+                                   {"expert_name": self.name, **self.conversation_history[0]})
+        self.conversation_history.append(record)
+    
+    def _build_expert_prompt(self, query: str, context: List[str], 
+                           collaboration_context: str = "", user_info: Dict = None) -> str:
+        """Build the per-query part of the expert prompt; persona and instructions are in self._static_prompt"""
+        if user_info:
+            user_context = f"The user's name is {user_info.get('name', '')} and they are a {user_info.get('role', 'team member')}."
+        else:
+            user_context = "Address them professionally"
+        
+        return self._query_template.format(
+            query=query,
+            context=_prepare_context(tuple(context)) or "No specific context available",
+            collaboration=f"COLLABORATION CONTEXT: {collaboration_context}" if collaboration_context else "",
+            user_context=user_context
+        )
     
     def _format_sop_references(self, text: str) -> str:
         """Format SOP references in the response"""
-        sop_pattern = r'\b([A-Za-z0-9\-\_\(\)\s]+(?:Rev\d+(?:Draft\d+)?)?[A-Za-z0-9\-\_\(\)\s]*\.(doc|docx|pdf))\b'
-        
-        def format_sop(match):
-            sop_name = match.group(1)
-            clean_name = re.sub(r'<[^>]+>', '', sop_name)
-            return f'<span class="sop-reference-inline">{clean_name}</span>'
-        
         if '<span class="sop-reference-inline">' not in text:
-            return re.sub(sop_pattern, format_sop, text)
+            return _link_sop_references(text)
         return text
     
     def _extract_insights(self, text: str) -> List[str]:
@@ -954,33 +1650,16 @@ class ExpertPersona:
     
     def _generate_follow_ups(self, query: str, response: str) -> List[str]:
         """Generate contextual follow-up questions"""
-        # Generate actually relevant follow-ups based on the topic
-        follow_ups = []
-        
-        # Quality-related follow-ups
-        if any(term in query.lower() for term in ['quality', 'defect', 'compliance', 'fda']):
-            follow_ups.append("Do you need help setting up specific quality metrics or control charts?")
-            follow_ups.append("Would you like guidance on FDA audit preparation?")
-        
-        # Manufacturing-related follow-ups
-        elif any(term in query.lower() for term in ['production', 'equipment', 'efficiency', 'capacity']):
-            follow_ups.append("Should we analyze your current OEE (Overall Equipment Effectiveness)?")
-            follow_ups.append("Do you need help with capacity planning calculations?")
-        
-        # Financial-related follow-ups
-        elif any(term in query.lower() for term in ['cost', 'budget', 'financial', 'accounting']):
-            follow_ups.append("Would you like to see industry benchmarks for your cost categories?")
-            follow_ups.append("Should we develop a cost reduction roadmap?")
-        
-        # Default contextual follow-up
-        else:
-            follow_ups.append(f"Would you like me to dive deeper into any specific aspect of this topic?")
-        
-        return follow_ups[:2]  # Return max 2 relevant follow-ups
+        # Generate actually relevant follow-ups based on the topic (max 2)
+        query_lower = query.lower()
+        for pattern, follow_ups in _FOLLOW_UP_RULES:
+            if pattern.search(query_lower):
+                return list(follow_ups)
+        return list(_DEFAULT_FOLLOW_UPS)
     
     def _assess_confidence(self, query: str, context: List[str]) -> str:
         """Assess confidence level for this response"""
-        if len(context) > 3 and any(spec.lower() in query.lower() for spec in self.specializations):
+        if len(context) > 3 and self._spec_re is not None and self._spec_re.search(query.lower()):
             return "high"
         elif len(context) > 0:
             return "medium"
@@ -989,31 +1668,185 @@ class ExpertPersona:
     def _generate_fallback_response(self, query: str) -> Dict[str, Any]:
         """Generate fallback response"""
         return {
+            **self._FALLBACK_SHELL,
             "expert_name": self.name,
             "expert_title": self.title,
             "main_response": f"As a {self.title}, I understand your question about {query}. Let me provide some general guidance based on my expertise in {self.expertise}.",
-            "key_insights": ["General insight based on field expertise"],
-            "recommendations": {
-                "immediate": ["Review relevant documentation"],
-                "short_term": ["Consult with team"],
-                "long_term": ["Develop comprehensive strategy"]
-            },
-            "risks_considerations": ["Consider regulatory requirements"],
-            "follow_up_questions": ["Can you provide more specific details?"],
-            "confidence_level": "low",
-            "timestamp": datetime.now().isoformat()
+            "recommendations": dict(self._FALLBACK_RECOMMENDATIONS),
+            "timestamp": response_timestamp()
         }
 
 
+class ExpertBatch:
+    """Requests collected by ExpertPersona.batch(), resolved together by resolve() or, from async code, flush()"""
+    
+    def __init__(self, expert: ExpertPersona):
+        self.expert = expert
+        self.requests: List[Tuple[str, List[str], str, Optional[Dict]]] = []
+        self._futures: List[Future] = []
+    
+    def add(self, query: str, context: List[str], 
+            collaboration_context: str = "", user_info: Dict = None) -> Future:
+        """Queue a request; the returned future holds the expert response after the batch exits"""
+        future = Future()
+        self.requests.append((query, context, collaboration_context, user_info))
+        self._futures.append(future)
+        return future
+    
+    def resolve(self) -> None:
+        """
+        Answer all queued requests through the sync client, at most
+        BATCH_MAX_CONCURRENCY at a time, and resolve their futures. Needs no
+        event loop, so it is safe to call from inside one.
+        """
+        requests, futures = self.requests, self._futures
+        self.requests, self._futures = [], []
+        # One batched embedding call fills the memo each request's cache lookup reads
+        if _response_cache is not None:
+            _response_cache.embed_many([request[0] for request in requests])
+        with ThreadPoolExecutor(max_workers=min(BATCH_MAX_CONCURRENCY, len(requests)),
+                                thread_name_prefix="expert-batch") as pool:
+            for future, request in zip(futures, requests):
+                pool.submit(self._resolve_one, future, request)
+    
+    def _resolve_one(self, future: Future, request: Tuple[str, List[str], str, Optional[Dict]]) -> None:
+        """Answer one queued request into its future"""
+        try:
+            future.set_result(self.expert.generate_response(*request))
+        except BaseException as e:
+            future.set_exception(e)
+    
+    async def flush(self) -> None:
+        """Issue all queued requests concurrently (at most BATCH_MAX_CONCURRENCY at a time) and resolve their futures"""
+        requests, futures = self.requests, self._futures
+        self.requests, self._futures = [], []
+        # One batched embedding call fills the memo each request's cache lookup reads
+        if _response_cache is not None:
+            await _response_cache.embed_many_async([request[0] for request in requests])
+        # Created here so it belongs to the loop running this flush
+        limit = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+        
+        async def limited(request: Tuple[str, List[str], str, Optional[Dict]]) -> Dict[str, Any]:
+            async with limit:
+                return await self.expert.generate_response_async(*request)
+        
+        results = await asyncio.gather(*(limited(request) for request in requests), return_exceptions=True)
+        for future, result in zip(futures, results):
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class ExpertRelevanceIndex:
+    """
+    Scores every expert's relevance to a query in one pass. @mentions and
+    specializations of all experts share a single Aho-Corasick automaton, so
+    the query is scanned once rather than once per expert; title keywords are
+    looked up per query word. Every distinct specialization found, overlapping
+    or not, counts once, so scores equal ExpertPersona.analyze_relevance,
+    which is used directly when pyahocorasick is not installed
+    (test_expert_relevance.py checks both paths agree).
+    
+    It also keeps a TF-IDF profile of each expert's expertise and
+    specializations (one row per expert), so similarities() ranks every
+    expert against a query with one matrix-vector product.
+    """
+    
+    def __init__(self, experts: Dict[str, ExpertPersona]):
+        self.experts = experts
+        self._title_index: Dict[str, List[str]] = {}
+        self._automaton = None
+        self._build_profiles()
+        
+        for name, expert in experts.items():
+            for token in expert._title_tokens:
+                self._title_index.setdefault(token, []).append(name)
+        
+        if ahocorasick is not None and experts:
+            # Several experts can share a keyword, so each word maps to all of its owners
+            owners: Dict[str, List[Tuple[str, bool]]] = {}
+            for name, expert in experts.items():
+                owners.setdefault(expert._mention, []).append((name, True))
+                for spec in expert._specs_lower:
+                    owners.setdefault(spec, []).append((name, False))
+            
+            automaton = ahocorasick.Automaton()
+            for word, word_owners in owners.items():
+                automaton.add_word(word, (word, tuple(word_owners)))
+            automaton.make_automaton()
+            self._automaton = automaton
+    
+    def scores(self, query: str) -> Dict[str, float]:
+        """Relevance (0.0 to 1.0) of each expert to the query; experts with no match may be omitted"""
+        if self._automaton is None:
+            return {name: expert.analyze_relevance(query) for name, expert in self.experts.items()}
+        
+        query_lower = query.lower()
+        mentioned = set()
+        matched_specs: Dict[str, set] = {}
+        for _, (word, word_owners) in self._automaton.iter(query_lower):
+            for name, is_mention in word_owners:
+                if is_mention:
+                    mentioned.add(name)
+                else:
+                    matched_specs.setdefault(name, set()).add(word)
+        
+        scores = {name: 0.3 * len(specs) for name, specs in matched_specs.items()}
+        title_matches = {name for token in set(_WORD_RE.findall(query_lower))
+                         for name in self._title_index.get(token, ())}
+        for name in title_matches:
+            scores[name] = scores.get(name, 0.0) + 0.2
+        for name in mentioned:
+            scores[name] = 1.0
+        
+        return {name: min(score, 1.0) for name, score in scores.items()}
+    
+    def similarities(self, query: str) -> np.ndarray:
+        """Cosine similarity of the query to each expert's profile, in self.experts order"""
+        query_vector = np.zeros(len(self._vocabulary), dtype=np.float32)
+        for word in _WORD_RE.findall(query.lower()):
+            idx = self._vocabulary.get(word)
+            if idx is not None:
+                query_vector[idx] += 1
+        query_vector *= self._idf
+        norm = np.linalg.norm(query_vector)
+        if not norm:
+            return np.zeros(len(self.experts), dtype=np.float32)
+        return self._profiles @ (query_vector / norm)
+    
+    def _build_profiles(self) -> None:
+        """Build the L2-normalised TF-IDF matrix of expert profiles"""
+        docs = [_WORD_RE.findall(" ".join([expert.expertise, *expert.specializations]).lower())
+                for expert in self.experts.values()]
+        self._vocabulary = {word: idx for idx, word in enumerate(sorted({word for doc in docs for word in doc}))}
+        
+        counts = np.zeros((len(docs), len(self._vocabulary)), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            for word in doc:
+                counts[row, self._vocabulary[word]] += 1
+        
+        # Words every expert uses get zero weight
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self._idf = np.log(len(docs) / np.maximum(document_frequency, 1)).astype(np.float32)
+        profiles = counts * self._idf
+        norms = np.linalg.norm(profiles, axis=1, keepdims=True)
+        self._profiles = profiles / np.where(norms == 0, 1, norms)
+
+
 class MultiExpertSystem:
     """Manages multiple expert personas with @mention functionality"""
     
-    def __init__(self, api_key: str, model_name: str = "gemini-1.5-pro"):
+    def __init__(self, api_key: str, model_name: str = "gemini-1.5-pro", prefer_flash: bool = False):
         self.api_key = api_key
         self.model_name = model_name
+        self.prefer_flash = prefer_flash
         self.experts = {}
-        self.conversation_history = []
+        self.conversation_history = deque(maxlen=CONSULTATION_HISTORY_MAX_TURNS)
         self._initialize_experts()
+        self._relevance_index = ExpertRelevanceIndex(self.experts)
+        self._mention_index = self._build_mention_index()
+        self._available_experts = self._build_available_experts()
     
     def _initialize_experts(self):
         """Initialize all expert personas"""
@@ -1035,7 +1868,8 @@ class MultiExpertSystem:
                 "manufacturing efficiency", "production scheduling", "equipment optimization"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Quality Expert
@@ -1055,7 +1889,8 @@ class MultiExpertSystem:
                 "inspection procedures", "validation protocols", "quality training"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Process Engineering Expert
@@ -1077,7 +1912,8 @@ class MultiExpertSystem:
                 "equipment troubleshooting", "machinery maintenance", "process optimization"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Product Development Expert
@@ -1097,7 +1933,8 @@ class MultiExpertSystem:
                 "excipient selection", "delivery systems", "bioactive compounds"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Supply Chain Expert
@@ -1112,7 +1949,8 @@ class MultiExpertSystem:
                 "supply chain optimization", "cost management", "supplier qualification"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Safety Expert
@@ -1133,7 +1971,8 @@ class MultiExpertSystem:
                 "safety documentation", "regulatory compliance", "safety metrics"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Accounting Expert
@@ -1153,7 +1992,8 @@ class MultiExpertSystem:
                 "activity-based costing", "standard costing", "manufacturing variances"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Maintenance Expert
@@ -1175,7 +2015,8 @@ class MultiExpertSystem:
                 "maintenance documentation", "technical troubleshooting", "equipment specifications"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Environmental Expert
@@ -1190,7 +2031,8 @@ class MultiExpertSystem:
                 "waste reduction", "environmental audits", "sustainable practices"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Financial Expert
@@ -1205,7 +2047,8 @@ class MultiExpertSystem:
                 "variance analysis", "cost accounting", "financial reporting"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Regulatory Expert
@@ -1220,7 +2063,8 @@ class MultiExpertSystem:
                 "industry standards", "regulatory updates", "compliance training"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Advanced Market Analyst
@@ -1241,7 +2085,8 @@ class MultiExpertSystem:
                 "B2B market analysis", "product cataloging", "source referencing"
             ],
             api_key=self.api_key,
-            model_name=self.model_name
+            model_name=self.model_name,
+            prefer_flash=self.prefer_flash
         )
         
         # Market Analysis Expert
@@ -1265,66 +2110,267 @@ class MultiExpertSystem:
                 "clinical study comparison", "scientific backing analysis", "ingredient sourcing", "supply chain analysis"
             ],
             api_key=self.api_key,
-            model_name="gemini-1.5-pro"  # Use pro model for advanced analysis
+            model_name="gemini-1.5-pro",  # Use pro model for advanced analysis
+            prefer_flash=self.prefer_flash
         )
     
+    def _build_mention_index(self) -> Dict[str, str]:
+        """
+        Map every lowercase substring of an expert name to the first expert
+        (in registration order) whose name contains it, so both exact and
+        partial @mentions resolve with one dict lookup.
+        """
+        index = {}
+        for expert_name in self.experts:
+            name_lower = expert_name.lower()
+            for start in range(len(name_lower)):
+                for end in range(start + 1, len(name_lower) + 1):
+                    index.setdefault(name_lower[start:end], expert_name)
+        return index
+    
     def parse_mentions(self, query: str) -> List[str]:
         """Parse @mentions from user query"""
-        mentions = re.findall(r'@(\w+)', query)
+        if '@' not in query:
+            return []
+        
         valid_mentions = []
         
-        for mention in mentions:
+        for mention in _MENTION_RE.findall(query):
             # Find exact matches or partial matches
-            for expert_name in self.experts.keys():
-                if mention.lower() == expert_name.lower() or mention.lower() in expert_name.lower():
-                    valid_mentions.append(expert_name)
-                    break
+            expert_name = self._mention_index.get(mention.lower())
+            if expert_name is not None:
+                valid_mentions.append(expert_name)
         
         return valid_mentions
     
     def get_relevant_experts(self, query: str, max_experts: int = 3) -> List[str]:
         """Get most relevant experts for a query if no @mentions"""
-        expert_scores = []
+        scores = self._relevance_index.scores(query)
+        similarities = self._relevance_index.similarities(query)
+        expert_scores = [(expert_name, scores.get(expert_name, 0.0), float(similarity))
+                         for expert_name, similarity in zip(self.experts, similarities)]
         
-        for expert_name, expert in self.experts.items():
-            relevance = expert.analyze_relevance(query)
-            if relevance > 0:
-                expert_scores.append((expert_name, relevance))
+        # Sort by relevance (profile similarity breaks ties) and return top experts, skipping weak matches
+        expert_scores.sort(key=lambda x: (x[1], x[2]), reverse=True)
+        selected = [name for name, score, _ in expert_scores[:max_experts] if score >= MIN_DISPATCH_RELEVANCE]
+        if selected:
+            return selected
         
-        # Sort by relevance and return top experts
-        expert_scores.sort(key=lambda x: x[1], reverse=True)
-        return [name for name, score in expert_scores[:max_experts]]
+        name, score, similarity = expert_scores[0] if expert_scores else (None, 0.0, 0.0)
+        return [name] if score > 0 or similarity >= MIN_PROFILE_SIMILARITY else []
     
-    def consult_experts(self, query: str, context: List[str], user_info: Dict = None) -> Dict[str, Any]:
-        """Main consultation method that handles @mentions and expert selection"""
+    def consult_experts(self, query: str, context: List[str], user_info: Dict = None,
+                        collaborate: bool = False) -> Dict[str, Any]:
+        """
+        Main consultation method that handles @mentions and expert selection.
+        The selected experts are queried concurrently on the I/O pool through
+        the sync client, so this never creates an event loop and is safe to
+        call from inside one.
+        """
+        selected_experts = self._select_experts(query)
+        consulted = [expert_name for expert_name in selected_experts if expert_name in self.experts]
         
-        # Parse @mentions
-        mentioned_experts = self.parse_mentions(query)
+        # Reuse a consultation of the same panel for a near-identical query
+        vector = _embed_query(query)
+        scope = "consultation:" + "+".join(sorted(consulted))
+        digest = context_digest(context, user_info, collaborate)
+        cached = self._get_cached_consultation(query, vector, scope, digest)
+        if cached is not None:
+            return cached
         
-        if mentioned_experts:
-            # Use mentioned experts
-            selected_experts = mentioned_experts
-        else:
-            # Auto-select relevant experts
-            selected_experts = self.get_relevant_experts(query)
+        # Round 1: independent responses from selected experts
+        responses = _io_executor.map(
+            lambda expert_name: self.experts[expert_name].generate_response(query, context, "", user_info),
+            consulted
+        )
+        expert_responses = dict(zip(consulted, responses))
         
-        if not selected_experts:
-            # Fallback to ManufacturingExpert
-            selected_experts = ["ManufacturingExpert"]
+        # Round 2: revise with the other experts' perspectives
+        if collaborate and len(expert_responses) > 1:
+            collaboration = self._collaboration_contexts(expert_responses)
+            responses = _io_executor.map(
+                lambda expert_name: self.experts[expert_name].generate_response(
+                    query, context, collaboration[expert_name], user_info
+                ),
+                consulted
+            )
+            expert_responses = dict(zip(consulted, responses))
+        
+        return self._finish_consultation(query, selected_experts, expert_responses, vector, scope, digest)
+    
+    async def aconsult_experts(self, query: str, context: List[str], user_info: Dict = None,
+                               collaborate: bool = False) -> Dict[str, Any]:
+        """
+        Async counterpart of consult_experts for callers running a long-lived
+        event loop. The selected experts answer independently and concurrently;
+        with collaborate=True and more than one expert, each then answers again,
+        concurrently, seeing the others' first answers.
+        """
+        selected_experts = self._select_experts(query)
+        consulted = [expert_name for expert_name in selected_experts if expert_name in self.experts]
+        
+        # Reuse a consultation of the same panel for a near-identical query
+        vector = await _embed_query_async(query)
+        scope = "consultation:" + "+".join(sorted(consulted))
+        digest = context_digest(context, user_info, collaborate)
+        cached = self._get_cached_consultation(query, vector, scope, digest)
+        if cached is not None:
+            return cached
+        
+        # Round 1: independent responses from selected experts
+        responses = await asyncio.gather(*(
+            self.experts[expert_name].generate_response_async(query, context, "", user_info)
+            for expert_name in consulted
+        ))
+        expert_responses = dict(zip(consulted, responses))
+        
+        # Round 2: revise with the other experts' perspectives
+        if collaborate and len(expert_responses) > 1:
+            collaboration = self._collaboration_contexts(expert_responses)
+            responses = await asyncio.gather(*(
+                self.experts[expert_name].generate_response_async(query, context, collaboration[expert_name], user_info)
+                for expert_name in consulted
+            ))
+            expert_responses = dict(zip(consulted, responses))
+        
+        return await _run_blocking(self._finish_consultation, query, selected_experts, expert_responses,
+                                   vector, scope, digest)
+    
+    def _collaboration_contexts(self, expert_responses: Dict[str, Any]) -> Dict[str, str]:
+        """For each expert, the other experts' first-round perspectives"""
+        perspectives = {
+            expert_name: f"\n{expert_name}'s perspective: {response['main_response'][:200]}..."
+            for expert_name, response in expert_responses.items()
+        }
+        return {
+            expert_name: "".join(text for other, text in perspectives.items() if other != expert_name)
+            for expert_name in expert_responses
+        }
+    
+    async def astream_consultation(self, query: str, context: List[str],
+                                   user_info: Dict = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a consultation while the selected experts generate concurrently.
+        Yields {"expert": name, "delta": text} chunks from all experts, interleaved
+        as they arrive, then {"expert": None, "result": consultation_result} with
+        the same result consult_experts returns. An expert answered from cache
+        sends its whole main_response as a single delta.
+        """
+        selected_experts = self._select_experts(query)
+        consulted = [expert_name for expert_name in selected_experts if expert_name in self.experts]
+        
+        vector = await _embed_query_async(query)
+        scope = "consultation:" + "+".join(sorted(consulted))
+        digest = context_digest(context, user_info, False)
+        cached = self._get_cached_consultation(query, vector, scope, digest)
+        if cached is not None:
+            yield {"expert": None, "result": cached}
+            return
+        
+        events: asyncio.Queue = asyncio.Queue()
+        finished: Dict[str, Dict[str, Any]] = {}
+        
+        async def relay(expert_name: str) -> None:
+            streamed = False
+            try:
+                async for event in self.experts[expert_name].stream_response_async(query, context, "", user_info):
+                    if event["partial"]:
+                        streamed = True
+                        await events.put({"expert": expert_name, "delta": event["chunk"]})
+                        continue
+                    response = {key: value for key, value in event.items() if key != "partial"}
+                    finished[expert_name] = response
+                    if not streamed:
+                        await events.put({"expert": expert_name, "delta": response["main_response"]})
+            finally:
+                await events.put(None)
+        
+        tasks = [asyncio.create_task(relay(expert_name)) for expert_name in consulted]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await events.get()
+                if event is None:
+                    remaining -= 1
+                else:
+                    yield event
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        expert_responses = {expert_name: finished[expert_name] for expert_name in consulted if expert_name in finished}
+        result = await _run_blocking(self._finish_consultation, query, selected_experts, expert_responses,
+                                     vector, scope, digest)
+        yield {"expert": None, "result": result}
+    
+    def stream_consultation(self, query: str, context: List[str],
+                            user_info: Dict = None) -> Iterator[Dict[str, Any]]:
+        """
+        Sync counterpart of astream_consultation, for callers such as
+        st.write_stream. The selected experts generate concurrently on the I/O
+        pool, but their {"expert": name, "delta": text} chunks are yielded one
+        expert at a time in consultation order, buffering the later experts'
+        chunks meanwhile. Ends with {"expert": None, "result": consultation_result}.
+        """
+        selected_experts = self._select_experts(query)
+        consulted = [expert_name for expert_name in selected_experts if expert_name in self.experts]
+        
+        vector = _embed_query(query)
+        scope = "consultation:" + "+".join(sorted(consulted))
+        digest = context_digest(context, user_info, False)
+        cached = self._get_cached_consultation(query, vector, scope, digest)
+        if cached is not None:
+            yield {"expert": None, "result": cached}
+            return
+        
+        # Each expert's chunks, ended by None
+        channels = {expert_name: queue.Queue() for expert_name in consulted}
+        finished: Dict[str, Dict[str, Any]] = {}
         
-        # Generate responses from selected experts
-        expert_responses = {}
-        collaboration_context = ""
+        def relay(expert_name: str) -> None:
+            try:
+                for event in self.experts[expert_name].stream_response(query, context, "", user_info):
+                    if event["partial"]:
+                        channels[expert_name].put(event["chunk"])
+                    else:
+                        finished[expert_name] = {key: value for key, value in event.items() if key != "partial"}
+            finally:
+                channels[expert_name].put(None)
         
-        for expert_name in selected_experts:
-            if expert_name in self.experts:
-                response = self.experts[expert_name].generate_response(
-                    query, context, collaboration_context, user_info
-                )
-                expert_responses[expert_name] = response
-                
-                # Build collaboration context for subsequent experts
-                collaboration_context += f"\n{expert_name}'s perspective: {response['main_response'][:200]}..."
+        relays = [_io_executor.submit(relay, expert_name) for expert_name in consulted]
+        for expert_name in consulted:
+            streamed = False
+            for chunk in iter(channels[expert_name].get, None):
+                streamed = True
+                yield {"expert": expert_name, "delta": chunk}
+            if not streamed and expert_name in finished:
+                yield {"expert": expert_name, "delta": finished[expert_name]["main_response"]}
+        for future in relays:
+            future.result()
+        
+        expert_responses = {expert_name: finished[expert_name] for expert_name in consulted if expert_name in finished}
+        yield {"expert": None, "result": self._finish_consultation(query, selected_experts, expert_responses,
+                                                                    vector, scope, digest)}
+    
+    def _get_cached_consultation(self, query: str, vector: Optional[np.ndarray], scope: str,
+                                 digest: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a cached consultation for a near-identical query, recording it in
+        history. It is restamped, carries this query, and keeps the query it
+        originally answered as "cached_query".
+        """
+        cached = _response_cache.lookup(scope, vector, digest) if vector is not None else None
+        if cached is not None:
+            cached["cached_query"] = cached.get("cached_query", cached["query"])
+            cached["query"] = query
+            cached["timestamp"] = response_timestamp()
+            self._record_consultation(cached)
+        return cached
+    
+    def _finish_consultation(self, query: str, selected_experts: List[str], expert_responses: Dict[str, Any],
+                             vector: Optional[np.ndarray], scope: str, digest: str) -> Dict[str, Any]:
+        """Assemble the consultation result, record it in history and cache it"""
         
         # Create consolidated response
         consultation_result = {
@@ -1332,14 +2378,38 @@ class MultiExpertSystem:
             "experts_consulted": selected_experts,
             "expert_responses": expert_responses,
             "consultation_summary": self._create_consultation_summary(expert_responses),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": response_timestamp()
         }
         
         # Add to conversation history
-        self.conversation_history.append(consultation_result)
+        self._record_consultation(consultation_result)
+        
+        # Only cache consultations in which every expert actually answered
+        if vector is not None and not any(response.get("fallback") or response.get("synthesized")
+                                          for response in expert_responses.values()):
+            _response_cache.add(scope, vector, digest, consultation_result)
         
         return consultation_result
     
+    def _select_experts(self, query: str) -> List[str]:
+        """Experts to consult: @mentioned ones, else the most relevant, else ManufacturingExpert"""
+        
+        # Parse @mentions
+        mentioned_experts = self.parse_mentions(query)
+        
+        if mentioned_experts:
+            # Use mentioned experts
+            selected_experts = mentioned_experts
+        else:
+            # Auto-select relevant experts
+            selected_experts = self.get_relevant_experts(query)
+        
+        if not selected_experts:
+            # Fallback to ManufacturingExpert
+            selected_experts = ["ManufacturingExpert"]
+        
+        return selected_experts
+    
     def _create_consultation_summary(self, expert_responses: Dict[str, Any]) -> Dict[str, Any]:
         """Create a summary when multiple experts are consulted"""
         if len(expert_responses) == 1:
@@ -1365,13 +2435,20 @@ class MultiExpertSystem:
             "type": "multi_expert",
             "expert_count": len(expert_responses),
             "expert_perspectives": expert_perspectives,
-            "consolidated_recommendations": all_recommendations,
-            "consolidated_risks": list(set(all_risks)),  # Remove duplicates
+            # Remove duplicates from overlapping experts, keeping first-mentioned order
+            "consolidated_recommendations": {
+                timeframe: list(dict.fromkeys(recs)) for timeframe, recs in all_recommendations.items()
+            },
+            "consolidated_risks": list(dict.fromkeys(all_risks)),
             "coordination_needed": len(expert_responses) > 1
         }
     
     def get_available_experts(self) -> Dict[str, Dict[str, str]]:
-        """Get list of available experts with their details"""
+        """Get list of available experts with their details (built once; treat as read-only)"""
+        return self._available_experts
+    
+    def _build_available_experts(self) -> Dict[str, Dict[str, str]]:
+        """Display details for every expert, served by get_available_experts"""
         return {
             name: {
                 "title": expert.title,
@@ -1382,6 +2459,21 @@ class MultiExpertSystem:
             for name, expert in self.experts.items()
         }
     
+    def _record_consultation(self, consultation_result: Dict[str, Any]) -> None:
+        """Append to history, trimming expert answers in the turn that just left the full-text window"""
+        self.conversation_history.append(consultation_result)
+        if len(self.conversation_history) <= CONSULTATION_FULL_TURNS:
+            return
+        
+        # Replace rather than mutate: callers and the response cache may share the old dicts
+        idx = -(CONSULTATION_FULL_TURNS + 1)
+        old = self.conversation_history[idx]
+        self.conversation_history[idx] = {**old, "expert_responses": {
+            expert_name: {**response, "main_response": response["main_response"][:CONSULTATION_TRIMMED_CHARS]}
+            for expert_name, response in old["expert_responses"].items()
+        }}
+    
     def get_conversation_history(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Get recent conversation history"""
-        return self.conversation_history[-limit:]
\ No newline at end of file
+        start = max(0, len(self.conversation_history) - limit)
+        return list(itertools.islice(self.conversation_history, start, None))
\ No newline at end of file
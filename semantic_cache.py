@@ -0,0 +1,382 @@
+"""
+Semantic Response Cache for Expert Personas
+Reuses a previous expert response when a new query is a near-duplicate of one
+already answered with the same context
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import atexit
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+import logging
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+SIMILARITY_THRESHOLD = 0.92
+CACHE_TTL_SECONDS = 24 * 60 * 60
+MAX_ENTRIES_PER_SCOPE = 1024
+
+# Recent query embeddings are memoised, so a consultation and each of its
+# experts embed the same query with a single API call
+EMBEDDING_MEMO_SIZE = 256
+
+# Texts per batch embedding request (the API's limit for one call)
+EMBED_BATCH_SIZE = 100
+
+# With a cache directory, new entries are written in batches: once this many
+# are pending, or when the last write is this old. Pending entries are also
+# written at interpreter exit.
+PERSIST_BATCH_SIZE = 16
+PERSIST_INTERVAL_SECONDS = 30.0
+
+# Embeddings are stored as int8 (unit vector components scaled by 127), a
+# quarter of the float32 size; similarity error is well under 0.01.
+QUANT_SCALE = 127
+
+
+def context_digest(*parts: Any) -> str:
+    """Digest of the non-query inputs a cached response depends on."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def _dump_json(data: Any) -> bytes:
+    """Serialize cache metadata as UTF-8 JSON, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data).encode("utf-8")
+
+
+def _load_json(path: Path) -> Any:
+    """Read cache metadata, using orjson when available."""
+    raw = path.read_bytes()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def _quantize(vectors: np.ndarray) -> np.ndarray:
+    """Quantize unit vectors to int8."""
+    return np.round(vectors * QUANT_SCALE).astype(np.int8)
+
+
+def _entry_id(meta: Dict[str, Any]) -> str:
+    """Identity of a cache entry, for merging copies written by several processes."""
+    return meta.get("id") or f"{meta['digest']}:{meta['created']}"
+
+
+def _unit_vector(embedding: Any) -> Optional[np.ndarray]:
+    """L2-normalise an embedding so dot products are cosine similarities."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache of responses keyed on query embeddings. Entries are
+    partitioned by scope (one per expert) so experts never answer with each
+    other's responses, and a hit also requires an identical context digest.
+    Embeddings are L2-normalised, so a matrix-vector product gives cosine
+    similarity against every entry in the scope at once.
+
+    The cache lives in memory unless cache_dir is given. With a directory,
+    new entries are persisted in batches outside the cache lock; each write
+    merges with what is on disk under a file lock, so processes sharing the
+    directory keep each other's entries and pick them up when they write.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, threshold: float = SIMILARITY_THRESHOLD,
+                 ttl_seconds: float = CACHE_TTL_SECONDS, max_entries: int = MAX_ENTRIES_PER_SCOPE):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._scopes: Dict[str, Dict[str, Any]] = {}
+        self._embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Scopes with entries not yet written, and the number pending
+        self._dirty: Dict[str, int] = {}
+        self._last_persist = time.time()
+        self._persist_lock = threading.Lock()
+        if self.cache_dir is not None:
+            atexit.register(self.persist)
+
+    def embed(self, text: str) -> Optional[np.ndarray]:
+        """Return the normalised embedding for text, or None if embedding fails."""
+        vector = self._memoised_embedding(text)
+        if vector is not None:
+            return vector
+        try:
+            import google.generativeai as genai
+            result = genai.embed_content(
+                model=EMBEDDING_MODEL,
+                content=text,
+                task_type="semantic_similarity"
+            )
+        except Exception as e:
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            return None
+        return self._memoise_embedding(text, _unit_vector(result['embedding']))
+
+    async def embed_async(self, text: str) -> Optional[np.ndarray]:
+        """Async counterpart of embed."""
+        vector = self._memoised_embedding(text)
+        if vector is not None:
+            return vector
+        try:
+            import google.generativeai as genai
+            result = await genai.embed_content_async(
+                model=EMBEDDING_MODEL,
+                content=text,
+                task_type="semantic_similarity"
+            )
+        except Exception as e:
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            return None
+        return self._memoise_embedding(text, _unit_vector(result['embedding']))
+
+    def embed_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Embed several texts, sending those not yet memoised in batched requests."""
+        vectors = [self._memoised_embedding(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        try:
+            import google.generativeai as genai
+            for start in range(0, len(missing), EMBED_BATCH_SIZE):
+                batch = missing[start:start + EMBED_BATCH_SIZE]
+                result = genai.embed_content(model=EMBEDDING_MODEL, content=batch, task_type="semantic_similarity")
+                for text, embedding in zip(batch, result['embedding']):
+                    self._memoise_embedding(text, _unit_vector(embedding))
+        except Exception as e:
+            logger.warning(f"Semantic cache batch embedding failed: {e}")
+        return [vector if vector is not None else self._memoised_embedding(text)
+                for text, vector in zip(texts, vectors)]
+
+    async def embed_many_async(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Async counterpart of embed_many."""
+        vectors = [self._memoised_embedding(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        try:
+            import google.generativeai as genai
+            for start in range(0, len(missing), EMBED_BATCH_SIZE):
+                batch = missing[start:start + EMBED_BATCH_SIZE]
+                result = await genai.embed_content_async(model=EMBEDDING_MODEL, content=batch,
+                                                         task_type="semantic_similarity")
+                for text, embedding in zip(batch, result['embedding']):
+                    self._memoise_embedding(text, _unit_vector(embedding))
+        except Exception as e:
+            logger.warning(f"Semantic cache batch embedding failed: {e}")
+        return [vector if vector is not None else self._memoised_embedding(text)
+                for text, vector in zip(texts, vectors)]
+
+    def _memoised_embedding(self, text: str) -> Optional[np.ndarray]:
+        """Return the memoised embedding for text, if it was embedded recently."""
+        with self._lock:
+            vector = self._embeddings.get(text)
+            if vector is not None:
+                self._embeddings.move_to_end(text)
+            return vector
+
+    def _memoise_embedding(self, text: str, vector: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """Remember an embedding, evicting the least recently used beyond EMBEDDING_MEMO_SIZE."""
+        if vector is not None:
+            with self._lock:
+                self._embeddings[text] = vector
+                if len(self._embeddings) > EMBEDDING_MEMO_SIZE:
+                    self._embeddings.popitem(last=False)
+        return vector
+
+    def lookup(self, scope: str, vector: np.ndarray, digest: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the best cached response above the threshold, if any."""
+        matches = self.nearest(scope, vector, digest, 1, self.threshold)
+        return matches[0][1] if matches else None
+
+    def nearest(self, scope: str, vector: np.ndarray, digest: str, k: int,
+                min_similarity: float) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        Return up to k (similarity, response copy) pairs for unexpired entries
+        with the same digest and at least min_similarity, most similar first.
+        """
+        matches = []
+        with self._lock:
+            entries = self._get_scope(scope)
+            if not entries["meta"]:
+                return matches
+
+            similarities = (entries["vectors"] @ vector.astype(np.float32)) / QUANT_SCALE
+            now = time.time()
+            for idx in np.argsort(similarities)[::-1]:
+                if similarities[idx] < min_similarity or len(matches) == k:
+                    break
+                meta = entries["meta"][idx]
+                if meta["digest"] == digest and now - meta["created"] <= self.ttl_seconds:
+                    matches.append((float(similarities[idx]), meta["response"]))
+        # Deep copies, outside the lock, so callers cannot mutate cached responses
+        return [(similarity, copy.deepcopy(response)) for similarity, response in matches]
+
+    def add(self, scope: str, vector: np.ndarray, digest: str, response: Dict[str, Any]) -> None:
+        """Cache a response, dropping expired and excess entries for the scope."""
+        response = copy.deepcopy(response)
+        with self._lock:
+            entries = self._get_scope(scope)
+            now = time.time()
+            keep = [i for i, meta in enumerate(entries["meta"])
+                    if now - meta["created"] <= self.ttl_seconds]
+            keep = keep[max(0, len(keep) - self.max_entries + 1):]
+            
+            entries["meta"] = [entries["meta"][i] for i in keep]
+            entries["meta"].append({"id": uuid.uuid4().hex, "digest": digest, "created": now,
+                                    "response": response})
+            row = _quantize(vector)[np.newaxis, :]
+            entries["vectors"] = np.vstack([entries["vectors"][keep], row]) if keep else row
+            
+            if self.cache_dir is None:
+                return
+            self._dirty[scope] = self._dirty.get(scope, 0) + 1
+            due = (sum(self._dirty.values()) >= PERSIST_BATCH_SIZE
+                   or now - self._last_persist >= PERSIST_INTERVAL_SECONDS)
+        if due:
+            self.persist()
+
+    def persist(self) -> None:
+        """Write scopes with pending entries to cache_dir, merged with the entries already there."""
+        if self.cache_dir is None:
+            return
+        with self._persist_lock:
+            with self._lock:
+                snapshots = {scope: dict(self._scopes[scope]) for scope in self._dirty}
+                self._dirty.clear()
+                self._last_persist = time.time()
+            
+            for scope, entries in snapshots.items():
+                written = self._write_scope(scope, entries)
+                if written is None:
+                    continue
+                with self._lock:
+                    current = self._scopes[scope]
+                    written_ids = {_entry_id(meta) for meta in written["meta"]}
+                    if all(_entry_id(meta) in written_ids for meta in current["meta"]):
+                        # Keep the memory-mapped copy when nothing was added meanwhile
+                        self._scopes[scope] = written
+                    else:
+                        self._scopes[scope] = self._merge_entries(written, current)
+
+    def _merge_entries(self, *parts: Dict[str, Any]) -> Dict[str, Any]:
+        """Union of several copies of a scope, without expired entries, keeping the newest max_entries."""
+        now = time.time()
+        by_id = {}
+        for entries in parts:
+            for meta, row in zip(entries["meta"], entries["vectors"]):
+                if now - meta["created"] <= self.ttl_seconds:
+                    by_id.setdefault(_entry_id(meta), (meta, row))
+        ordered = sorted(by_id.values(), key=lambda pair: pair[0]["created"])
+        ordered = ordered[max(0, len(ordered) - self.max_entries):]
+        if not ordered:
+            return {"vectors": np.zeros((0, 0), dtype=np.int8), "meta": []}
+        return {"vectors": np.stack([np.asarray(row, dtype=np.int8) for _, row in ordered]),
+                "meta": [meta for meta, _ in ordered]}
+
+    def _get_scope(self, scope: str) -> Dict[str, Any]:
+        """Return the entries for a scope, loading them from disk on first use."""
+        entries = self._scopes.get(scope)
+        if entries is None:
+            entries = self._load_scope(scope)
+            self._scopes[scope] = entries
+        return entries
+
+    def _scope_paths(self, scope: str) -> Tuple[Path, Path, Path]:
+        """Embedding matrix, metadata and lock file paths for a scope."""
+        safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in scope)
+        return (self.cache_dir / f"{safe_name}.npy", self.cache_dir / f"{safe_name}.json",
+                self.cache_dir / f"{safe_name}.lock")
+
+    @contextmanager
+    def _scope_file_lock(self, scope: str, exclusive: bool) -> Iterator[None]:
+        """Hold the scope's lock file, shared for reads and exclusive for writes (POSIX only)."""
+        if fcntl is None:
+            yield
+            return
+        with open(self._scope_paths(scope)[2], 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_scope(self, scope: str) -> Optional[Dict[str, Any]]:
+        """Read a scope's persisted entries, or None if there are none; raises if they are unreadable."""
+        vectors_path, meta_path, _ = self._scope_paths(scope)
+        if not (vectors_path.exists() and meta_path.exists()):
+            return None
+        vectors = np.load(vectors_path, mmap_mode='r')
+        if vectors.dtype != np.int8:
+            vectors = _quantize(np.asarray(vectors))
+        meta = _load_json(meta_path)
+        if len(meta) != len(vectors):
+            raise ValueError("vector and metadata counts differ")
+        return {"vectors": vectors, "meta": meta}
+
+    def _load_scope(self, scope: str) -> Dict[str, Any]:
+        """Load a scope's persisted entries, starting empty if none are usable."""
+        empty = {"vectors": np.zeros((0, 0), dtype=np.int8), "meta": []}
+        if self.cache_dir is None or not self.cache_dir.is_dir():
+            return empty
+        
+        try:
+            with self._scope_file_lock(scope, exclusive=False):
+                return self._read_scope(scope) or empty
+        except Exception as e:
+            logger.warning(f"Discarding unreadable semantic cache for {scope}: {e}")
+            return empty
+
+    def _write_scope(self, scope: str, entries: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Merge a scope's entries with the persisted ones and write the result,
+        returning it (with the matrix memory-mapped) or None if writing failed.
+        """
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            vectors_path, meta_path, _ = self._scope_paths(scope)
+            with self._scope_file_lock(scope, exclusive=True):
+                try:
+                    on_disk = self._read_scope(scope)
+                except Exception as e:
+                    logger.warning(f"Overwriting unreadable semantic cache for {scope}: {e}")
+                    on_disk = None
+                merged = self._merge_entries(entries, on_disk) if on_disk else self._merge_entries(entries)
+                
+                # Write to temporary files unique to this writer and swap them in,
+                # so readers that have the old matrix memory-mapped never see a
+                # truncated file
+                fd, tmp_vectors = tempfile.mkstemp(dir=self.cache_dir, prefix=vectors_path.name, suffix=".tmp")
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, merged["vectors"])
+                fd, tmp_meta = tempfile.mkstemp(dir=self.cache_dir, prefix=meta_path.name, suffix=".tmp")
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(_dump_json(merged["meta"]))
+                os.replace(tmp_vectors, vectors_path)
+                os.replace(tmp_meta, meta_path)
+                return {"vectors": np.load(vectors_path, mmap_mode='r'), "meta": merged["meta"]}
+        except Exception as e:
+            logger.warning(f"Could not persist semantic cache for {scope}: {e}")
+            return None
@@ -0,0 +1,62 @@
+"""
+Relevance scoring must not depend on whether pyahocorasick is installed:
+ExpertRelevanceIndex.scores and ExpertPersona.analyze_relevance agree.
+"""
+
+import itertools
+
+import pytest
+
+import multi_expert_system
+from multi_expert_system import ExpertRelevanceIndex, MultiExpertSystem
+
+
+@pytest.fixture(scope="module")
+def experts():
+    return MultiExpertSystem("test-key").experts
+
+
+def _probe_queries(experts):
+    """Single and paired specializations, titles, mentions and nested phrases."""
+    specs = sorted({spec for expert in experts.values() for spec in expert.specializations})
+    queries = [f"How should we handle {spec}?" for spec in specs]
+    queries += [f"{first} and {second}" for first, second in zip(specs, specs[7:])]
+    queries += [f"Question for the {expert.title}" for expert in experts.values()]
+    queries += [f"@{name} please review" for name in experts]
+    queries += [
+        "equipment troubleshooting",
+        "workplace safety regulations",
+        "quality control and quality assurance for FDA compliance",
+        "",
+    ]
+    return queries
+
+
+def test_index_scores_match_analyze_relevance(experts):
+    pytest.importorskip("ahocorasick")
+    index = ExpertRelevanceIndex(experts)
+    assert index._automaton is not None
+
+    for query in _probe_queries(experts):
+        scores = index.scores(query)
+        for name, expert in experts.items():
+            assert scores.get(name, 0.0) == pytest.approx(expert.analyze_relevance(query)), (query, name)
+
+
+def test_fallback_scores_match_analyze_relevance(experts, monkeypatch):
+    monkeypatch.setattr(multi_expert_system, "ahocorasick", None)
+    index = ExpertRelevanceIndex(experts)
+    assert index._automaton is None
+
+    for query in itertools.islice(_probe_queries(experts), 50):
+        scores = index.scores(query)
+        for name, expert in experts.items():
+            assert scores.get(name, 0.0) == pytest.approx(expert.analyze_relevance(query)), (query, name)
+
+
+@pytest.mark.parametrize("expert_name, query", [
+    ("ProcessEngineeringExpert", "equipment troubleshooting"),
+    ("SafetyExpert", "workplace safety regulations"),
+])
+def test_nested_specializations_each_count(experts, expert_name, query):
+    assert experts[expert_name].analyze_relevance(query) == pytest.approx(0.6)
@@ -0,0 +1,118 @@
+"""
+SemanticCache: threshold hits and misses, TTL expiry, eviction, and entries
+shared between instances through a cache directory.
+"""
+
+import numpy as np
+import pytest
+
+import semantic_cache
+from semantic_cache import SemanticCache
+
+
+def _vector(degrees: float, dims: int = 8) -> np.ndarray:
+    """Unit vector whose cosine similarity with _vector(0) is cos(degrees)."""
+    vector = np.zeros(dims, dtype=np.float32)
+    vector[0], vector[1] = np.cos(np.radians(degrees)), np.sin(np.radians(degrees))
+    return vector
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    """Stub SemanticCache.embed with fixed vectors, so no embedding API is called."""
+    vectors = {
+        "calibrate the pH meter": _vector(0),
+        "how do I calibrate the pH meter": _vector(10),   # cosine 0.985
+        "calibrate the conductivity meter": _vector(30),  # cosine 0.866
+    }
+    monkeypatch.setattr(SemanticCache, "embed", lambda self, text: vectors.get(text))
+    return vectors
+
+
+def test_hit_above_threshold_and_miss_below(embeddings):
+    cache = SemanticCache()
+    cache.add("QualityExpert", cache.embed("calibrate the pH meter"), "ctx", {"main_response": "pH"})
+
+    assert cache.lookup("QualityExpert", cache.embed("how do I calibrate the pH meter"), "ctx") == {"main_response": "pH"}
+    assert cache.lookup("QualityExpert", cache.embed("calibrate the conductivity meter"), "ctx") is None
+
+
+def test_hit_requires_same_scope_and_digest(embeddings):
+    cache = SemanticCache()
+    vector = cache.embed("calibrate the pH meter")
+    cache.add("QualityExpert", vector, "ctx", {"main_response": "pH"})
+
+    assert cache.lookup("SafetyExpert", vector, "ctx") is None
+    assert cache.lookup("QualityExpert", vector, "other ctx") is None
+
+
+def test_quantized_similarity_is_close():
+    for degrees in (0, 10, 25, 45):
+        quantized = semantic_cache._quantize(_vector(degrees)).astype(np.float32)
+        similarity = quantized @ _vector(0) / semantic_cache.QUANT_SCALE
+        assert similarity == pytest.approx(np.cos(np.radians(degrees)), abs=0.01)
+
+
+def test_entries_expire_after_ttl(embeddings, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    cache = SemanticCache(ttl_seconds=60)
+    vector = cache.embed("calibrate the pH meter")
+    cache.add("QualityExpert", vector, "ctx", {"main_response": "pH"})
+
+    now[0] += 59
+    assert cache.lookup("QualityExpert", vector, "ctx") is not None
+    now[0] += 2
+    assert cache.lookup("QualityExpert", vector, "ctx") is None
+
+
+@pytest.mark.parametrize("max_entries", [1, 3])
+def test_keeps_newest_max_entries(max_entries):
+    cache = SemanticCache(max_entries=max_entries)
+    for i in range(5):
+        cache.add("QualityExpert", _vector(i * 40), "ctx", {"main_response": str(i)})
+
+    kept = [cache.lookup("QualityExpert", _vector(i * 40), "ctx") for i in range(5)]
+    assert kept == [None] * (5 - max_entries) + [{"main_response": str(i)} for i in range(5 - max_entries, 5)]
+
+
+def test_instances_sharing_a_directory_see_each_others_entries(embeddings, tmp_path):
+    first, second = SemanticCache(str(tmp_path)), SemanticCache(str(tmp_path))
+    ph, conductivity = embeddings["calibrate the pH meter"], embeddings["calibrate the conductivity meter"]
+
+    first.add("QualityExpert", ph, "ctx", {"main_response": "pH"})
+    first.persist()
+    second.add("QualityExpert", conductivity, "ctx", {"main_response": "conductivity"})
+    second.persist()
+    first.add("QualityExpert", _vector(90), "ctx", {"main_response": "other"})
+    first.persist()
+
+    # Each write merged with what was on disk, so nobody's entries were lost
+    assert first.lookup("QualityExpert", conductivity, "ctx") == {"main_response": "conductivity"}
+    assert second.lookup("QualityExpert", ph, "ctx") == {"main_response": "pH"}
+
+    reloaded = SemanticCache(str(tmp_path))
+    for vector, answer in [(ph, "pH"), (conductivity, "conductivity"), (_vector(90), "other")]:
+        assert reloaded.lookup("QualityExpert", vector, "ctx") == {"main_response": answer}
+    assert isinstance(reloaded._scopes["QualityExpert"]["vectors"], np.memmap)
+
+
+def test_nothing_is_written_without_a_directory_or_before_persist(embeddings, tmp_path):
+    SemanticCache().add("QualityExpert", _vector(0), "ctx", {"main_response": "pH"})
+    cache = SemanticCache(str(tmp_path / "cache"))
+    cache.add("QualityExpert", _vector(0), "ctx", {"main_response": "pH"})
+
+    assert not (tmp_path / "cache").exists()
+    cache.persist()
+    assert (tmp_path / "cache" / "QualityExpert.npy").exists()
+
+
+def test_cached_responses_are_not_shared_with_callers(embeddings):
+    cache = SemanticCache()
+    response = {"main_response": "pH", "sources": ["SOP-001"]}
+    cache.add("QualityExpert", _vector(0), "ctx", response)
+    response["sources"].append("SOP-002")
+
+    hit = cache.lookup("QualityExpert", _vector(0), "ctx")
+    hit["sources"].append("SOP-003")
+    assert cache.lookup("QualityExpert", _vector(0), "ctx")["sources"] == ["SOP-001"]